@@ -1,9 +1,7 @@
 import logging
 import secrets
 from datetime import datetime, timedelta
-import asyncio
 
-import httpx
 from django.conf import settings
 from django.shortcuts import redirect
 from django.http import HttpResponse
@@ -11,8 +9,11 @@ from ninja_extra import api_controller, route
 
 from .models import OAuthState, Repository, Branch
 from .schemas import *
+from .services.github_client import github_client
 from .services.github_service import GitHubService
-from telegram_bot.utils import notify_user
+from .services.webhook import handle_github_webhook, verify_signature
+from jobs.models import Job
+from jobs.queue import enqueue
 from telegram import Bot
 
 bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
@@ -92,38 +93,38 @@ class GitHubAuthController:
                 "redirect_uri": settings.GITHUB_REDIRECT_URI,
             }
 
-            async with httpx.AsyncClient() as client:
-                token_response = await client.post(
-                    "https://github.com/login/oauth/access_token",
-                    headers={"Accept": "application/json"},
-                    data=token_data,
-                    timeout=10,
-                )
-                token_response.raise_for_status()
-                token_json = token_response.json()
+            token_response = await github_client.post(
+                "https://github.com/login/oauth/access_token",
+                headers={"Accept": "application/json"},
+                data=token_data,
+            )
+            token_response.raise_for_status()
+            token_json = token_response.json()
 
             access_token = token_json.get("access_token")
             if not access_token:
                 return 400, {"detail": "Failed to obtain access token", "code": 400}
 
-            # Get user data and all repositories
-            user_data = github_service.get_user_data(access_token)
-            repos_task = github_service.get_all_repos(access_token)
-            user_data, repos = await asyncio.gather(user_data, repos_task)
+            # Get user data, the repositories are synced by a background job
+            user_data = await github_service.get_user_data(access_token)
 
             # Update user
             user = await github_service.update_user_data(user_data, access_token)
             user.chat_id = tg_id
             await user.asave(update_fields=["chat_id"])
 
-            created_count = await github_service.update_repository(user, repos)
-
-            logger.info(f"Repositories synced: {created_count} created")
-            await notify_user(tg_id, "✅ Your repositories have been synced!")
+            await enqueue(
+                Job.KIND_SYNC_REPOS,
+                {"user_id": user.id},
+                priority=Job.PRIORITY_INTERACTIVE,
+                dedup_key=f"sync_repos:{user.id}",
+                notify=tg_id,
+            )
 
             return HttpResponse(
                 "<h2>✅ GitHub login successful!</h2>"
-                "<p>You can return to Telegram now. Your repositories have been synced.</p>"
+                "<p>You can return to Telegram now. "
+                "We'll message you there once your repositories are synced.</p>"
             )
 
         except Exception as e:
@@ -175,3 +176,19 @@ class GitHubAuthController:
         if not branch:
             return 404, {"detail": "Branch not found", "code": 404}
         return 200, BranchSchema.model_validate(branch)
+
+
+@api_controller("/github", tags=["GitHub Webhooks"], auth=None)
+class GitHubWebhookController:
+    @route.post("/webhook", response={200: dict, 400: ErrorResponse, 401: ErrorResponse})
+    async def webhook(self, request):
+        """Receive GitHub push events and pre-build snapshots"""
+        body = request.body
+        if not verify_signature(body, request.headers.get("X-Hub-Signature-256", "")):
+            return 401, {"detail": "Invalid signature", "code": 401}
+
+        event = request.headers.get("X-GitHub-Event", "")
+        result = await handle_github_webhook(event, body)
+        if result["status"] == "error":
+            return 400, {"detail": result["error"], "code": 400}
+        return 200, result
@@ -0,0 +1,122 @@
+import hashlib
+import time
+from collections import Counter, OrderedDict
+from typing import Optional
+
+import cryptography.fernet
+from django.conf import settings
+from django.db.models.query_utils import DeferredAttribute
+from encrypted_model_fields.fields import EncryptedCharField, decrypt_str
+
+
+class Ciphertext(str):
+    """A column value read from the database and not decrypted yet"""
+
+
+class DecryptedValueCache:
+    """
+    Short-lived, process-local cache of decrypted values keyed by row and
+    ciphertext, so loading the same user over and over costs one decryption.
+    A changed ciphertext (new token) never hits an old entry.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._counters = Counter()
+
+    @staticmethod
+    def make_key(label: str, pk, ciphertext: str) -> str:
+        digest = hashlib.sha256(ciphertext.encode("utf-8")).hexdigest()
+        return f"{label}:{pk}:{digest}"
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            self._entries.pop(key, None)
+            self._counters["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._counters["hits"] += 1
+        return entry[0]
+
+    def set(self, key: str, value: str):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    @property
+    def stats(self) -> dict:
+        return {**self._counters, "entries": len(self._entries)}
+
+
+decrypted_cache = DecryptedValueCache(
+    ttl=settings.DECRYPTED_TOKEN_CACHE_TTL,
+    max_entries=settings.DECRYPTED_TOKEN_CACHE_MAX_ENTRIES,
+)
+
+
+def decrypt_cached(label: str, pk, ciphertext: str) -> str:
+    key = decrypted_cache.make_key(label, pk, ciphertext)
+    value = decrypted_cache.get(key)
+    if value is None:
+        try:
+            value = decrypt_str(ciphertext)
+        except cryptography.fernet.InvalidToken:
+            # Stored before encryption was enabled, same as EncryptedMixin
+            value = str(ciphertext)
+        decrypted_cache.set(key, value)
+    return value
+
+
+class LazyDecryptedAttribute(DeferredAttribute):
+    """Decrypts the loaded ciphertext on first attribute access"""
+
+    def __get__(self, instance, cls=None):
+        value = super().__get__(instance, cls)
+        if instance is None or not isinstance(value, Ciphertext):
+            return value
+        value = decrypt_cached(instance._meta.label, instance.pk, value)
+        instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        # Being a data descriptor keeps __get__ in the path once the value is loaded
+        instance.__dict__[self.field.attname] = value
+
+
+class LazyEncryptedCharField(EncryptedCharField):
+    """
+    EncryptedCharField that leaves the value encrypted until it is read.
+    Rows loaded only for their other columns never touch Fernet, and a row
+    saved without its value being read writes the stored ciphertext back as is.
+    """
+
+    descriptor_class = LazyDecryptedAttribute
+
+    def from_db_value(self, value, *args, **kwargs):
+        if not value:
+            return value
+        return Ciphertext(value)
+
+    @classmethod
+    def is_set(cls, instance, attname: str) -> bool:
+        """Whether the loaded column holds a value, without decrypting it"""
+        return bool(instance.__dict__.get(attname))
+
+    def pre_save(self, model_instance, add):
+        # Bypass the descriptor so saving doesn't decrypt
+        return model_instance.__dict__.get(self.attname)
+
+    def get_db_prep_save(self, value, connection):
+        if isinstance(value, Ciphertext):
+            return str(value)
+        # Stored empty rather than encrypted, so emptiness can be told from the column
+        if value == "":
+            return value
+        return super().get_db_prep_save(value, connection)
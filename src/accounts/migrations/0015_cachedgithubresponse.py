@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0014_user_current_branch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedGitHubResponse',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('etag', models.CharField(max_length=255)),
+                ('body', models.JSONField()),
+                ('link', models.TextField(blank=True, default='')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:43
+
+import accounts.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0015_cachedgithubresponse'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='access_token',
+            field=accounts.fields.LazyEncryptedCharField(),
+        ),
+    ]
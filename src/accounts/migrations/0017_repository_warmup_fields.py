@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0016_lazy_access_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repository',
+            name='last_selected_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='repository',
+            name='metadata_synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+import cryptography.fernet
+from django.db import migrations
+from encrypted_model_fields.fields import decrypt_str
+
+
+def clear_empty_tokens(apps, schema_editor):
+    """Logged out users had an encrypted empty string stored; store it as empty"""
+    User = apps.get_model("accounts", "User")
+    empty = []
+    for pk, ciphertext in User.objects.exclude(access_token="").values_list(
+        "pk", "access_token"
+    ).iterator():
+        try:
+            if decrypt_str(ciphertext) == "":
+                empty.append(pk)
+        except cryptography.fernet.InvalidToken:
+            continue
+    User.objects.filter(pk__in=empty).update(access_token="")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0017_repository_warmup_fields"),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_empty_tokens, migrations.RunPython.noop),
+    ]
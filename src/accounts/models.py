@@ -1,6 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
-from encrypted_model_fields.fields import EncryptedCharField
+from .fields import LazyEncryptedCharField
 
 
 class User(AbstractUser):
@@ -8,7 +8,7 @@ class User(AbstractUser):
     chat_id = models.BigIntegerField(null=True, blank=True)
     github_login = models.CharField(max_length=255)
     avatar = models.URLField(blank=True, null=True)
-    access_token = EncryptedCharField(max_length=255)
+    access_token = LazyEncryptedCharField(max_length=255)
     sso_token_expiry = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -28,6 +28,11 @@ class User(AbstractUser):
     def __str__(self):
         return self.github_login
 
+    @property
+    def has_access_token(self) -> bool:
+        """Whether the user is logged in; checks the stored ciphertext without decrypting it"""
+        return LazyEncryptedCharField.is_set(self, "access_token")
+
 
 class Repository(models.Model):
     VISIBILITY_CHOICES = [
@@ -77,6 +82,10 @@ class Repository(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     pushed_at = models.DateTimeField(null=True, blank=True)
+    # When the owner last picked this repo in /select_repo
+    last_selected_at = models.DateTimeField(null=True, blank=True)
+    # When branches, permissions, license and topics were last synced
+    metadata_synced_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         unique_together = ("user", "repo_id")  # Prevents duplicates per user
@@ -147,3 +156,17 @@ class OAuthState(models.Model):
 
     def __str__(self):
         return f"OAuthState (expires: {self.expires_at})"
+
+
+
+class CachedGitHubResponse(models.Model):
+    """Persistent tier of the GitHub ETag response cache"""
+
+    key = models.CharField(max_length=64, unique=True)
+    etag = models.CharField(max_length=255)
+    body = models.JSONField()
+    link = models.TextField(blank=True, default="")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"CachedGitHubResponse ({self.etag})"
@@ -0,0 +1,161 @@
+import logging
+import time
+from collections import Counter
+from typing import Optional, Tuple
+
+import httpx
+import jwt
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from .github_client import GITHUB_API_URL, github_client
+from .resilience import CircuitOpenError
+from .single_flight import single_flight
+
+logger = logging.getLogger(__name__)
+
+# GitHub rejects app JWTs that live longer than ten minutes
+JWT_LIFETIME = 540
+# Backdated to absorb clock drift between us and GitHub
+JWT_CLOCK_SKEW = 60
+
+_ACCEPT = {"Accept": "application/vnd.github+json"}
+
+
+class GitHubAppAuth:
+    """
+    Authenticates as a GitHub App to read repository contents with
+    installation tokens. The app JWT and the installation tokens are cached
+    and minted again shortly before they expire, so steady traffic costs one
+    token exchange per installation and hour. Users still log in with OAuth;
+    only repository reads move to the installation.
+    """
+
+    def __init__(
+        self,
+        app_id: str,
+        private_key: str,
+        refresh_margin: float,
+        installation_ttl: float,
+    ):
+        self.app_id = app_id
+        self.private_key = private_key
+        self.refresh_margin = refresh_margin
+        self.installation_ttl = installation_ttl
+        self._jwt: Optional[Tuple[str, float]] = None
+        self._installations = {}  # full_name -> (installation id or None, expires)
+        self._tokens = {}  # installation id -> (token, expires)
+        self._counters = Counter()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.app_id and self.private_key)
+
+    def app_jwt(self) -> str:
+        """Short-lived RS256 JWT identifying the app itself"""
+        now = time.time()
+        if self._jwt is not None and self._jwt[1] - JWT_CLOCK_SKEW > now:
+            return self._jwt[0]
+        issued_at = int(now) - JWT_CLOCK_SKEW
+        expires_at = int(now) + JWT_LIFETIME
+        token = jwt.encode(
+            {"iat": issued_at, "exp": expires_at, "iss": str(self.app_id)},
+            self.private_key,
+            algorithm="RS256",
+        )
+        self._jwt = (token, expires_at)
+        self._counters["jwts_minted"] += 1
+        return token
+
+    def _app_headers(self) -> dict:
+        # Sent as a plain header: the JWT changes every few minutes and must
+        # not get its own rate limiter bucket
+        return {**_ACCEPT, "Authorization": f"Bearer {self.app_jwt()}"}
+
+    async def installation_id(self, full_name: str) -> Optional[int]:
+        """The installation covering a repository, or None when the app isn't installed there"""
+        cached = self._installations.get(full_name)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+
+        response = await github_client.get(
+            f"{GITHUB_API_URL}/repos/{full_name}/installation",
+            headers=self._app_headers(),
+        )
+        if response.status_code == 404:
+            installation_id = None
+        else:
+            response.raise_for_status()
+            installation_id = response.json()["id"]
+        self._installations[full_name] = (
+            installation_id,
+            time.monotonic() + self.installation_ttl,
+        )
+        return installation_id
+
+    async def installation_token(self, installation_id: int) -> str:
+        """A valid access token for the installation, minted again near expiry"""
+        cached = self._tokens.get(installation_id)
+        if cached is not None and cached[1] - self.refresh_margin > time.time():
+            self._counters["token_hits"] += 1
+            return cached[0]
+        # Callers racing on an expiring token share one exchange
+        return await single_flight.do(
+            f"github-app-token:{installation_id}",
+            lambda: self._mint_token(installation_id),
+        )
+
+    async def _mint_token(self, installation_id: int) -> str:
+        response = await github_client.post(
+            f"{GITHUB_API_URL}/app/installations/{installation_id}/access_tokens",
+            headers=self._app_headers(),
+        )
+        response.raise_for_status()
+        data = response.json()
+        expires_at = parse_datetime(data["expires_at"]).timestamp()
+        self._tokens[installation_id] = (data["token"], expires_at)
+        self._counters["tokens_minted"] += 1
+        logger.info(f"Minted token for GitHub App installation {installation_id}")
+        return data["token"]
+
+    async def token_for_repo(self, full_name: str, fallback: str) -> str:
+        """
+        Token to read a repository's contents with: an installation token when
+        the app is configured and installed on the repository, else ``fallback``
+        (the user's OAuth token).
+        """
+        if not self.enabled:
+            return fallback
+        try:
+            installation_id = await self.installation_id(full_name)
+            if installation_id is None:
+                self._counters["not_installed"] += 1
+                return fallback
+            return await self.installation_token(installation_id)
+        except (httpx.HTTPError, CircuitOpenError, KeyError, ValueError) as e:
+            self._counters["errors"] += 1
+            logger.warning(f"GitHub App auth failed for {full_name}, using OAuth: {e}")
+            return fallback
+
+    def forget(self, full_name: str = None):
+        """Drop cached installations (all of them, or one repository's)"""
+        if full_name is None:
+            self._installations.clear()
+        else:
+            self._installations.pop(full_name, None)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            **self._counters,
+            "installations": len(self._installations),
+            "tokens": len(self._tokens),
+        }
+
+
+github_app = GitHubAppAuth(
+    app_id=settings.GITHUB_APP_ID,
+    private_key=settings.GITHUB_APP_PRIVATE_KEY,
+    refresh_margin=settings.GITHUB_APP_TOKEN_REFRESH_MARGIN,
+    installation_ttl=settings.GITHUB_APP_INSTALLATION_CACHE_TTL,
+)
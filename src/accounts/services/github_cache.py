@@ -0,0 +1,152 @@
+import hashlib
+import json
+import logging
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from ..models import CachedGitHubResponse
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedResponse:
+    etag: str
+    body: Any
+    link: str = ""
+    stored_at: float = field(default_factory=time.time)
+    # Bytes of the response body, what the entry costs the in-process tier
+    size: int = 0
+
+
+class ConditionalRequestCache:
+    """
+    ETag cache for GitHub GET requests.
+
+    Entries live in an in-process LRU bounded by entry count and body bytes
+    and, optionally, in the
+    CachedGitHubResponse table so they survive restarts and are shared between
+    workers. A stored ETag is sent back as If-None-Match; GitHub answers 304
+    without charging the rate limit and the stored body is reused.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float, use_db: bool = False):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.use_db = use_db
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._counters = Counter()
+
+    @staticmethod
+    def make_key(access_token: str, url: str, params: dict = None, headers: dict = None) -> str:
+        """Build a cache key from the token, URL, query params and Accept header"""
+        raw = json.dumps(
+            [
+                access_token or "",
+                url,
+                sorted((params or {}).items()),
+                (headers or {}).get("Accept", ""),
+            ],
+            default=str,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _is_expired(self, entry: CachedResponse) -> bool:
+        return time.time() - entry.stored_at > self.ttl
+
+    def _forget(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _remember(self, key: str, entry: CachedResponse):
+        self._forget(key)
+        if entry.size > self.max_bytes:
+            # Would push out everything else; left to the DB tier
+            self._counters["too_large"] += 1
+            return
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self._counters["evictions"] += 1
+
+    async def aget(self, key: str) -> Optional[CachedResponse]:
+        """Return a non-expired entry from memory or, failing that, the DB tier"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if not self._is_expired(entry):
+                self._entries.move_to_end(key)
+                return entry
+            self._forget(key)
+
+        if not self.use_db:
+            return None
+
+        row = await CachedGitHubResponse.objects.filter(
+            key=key, updated_at__gt=timezone.now() - timedelta(seconds=self.ttl)
+        ).afirst()
+        if row is None:
+            return None
+
+        self._counters["db_loads"] += 1
+        entry = CachedResponse(
+            etag=row.etag,
+            body=row.body,
+            link=row.link,
+            stored_at=row.updated_at.timestamp(),
+            size=len(json.dumps(row.body)),
+        )
+        self._remember(key, entry)
+        return entry
+
+    async def aset(self, key: str, etag: str, body: Any, link: str = "", size: int = 0):
+        """Store a fresh response under its ETag; ``size`` is the raw body's length"""
+        self._remember(key, CachedResponse(etag=etag, body=body, link=link or "", size=size))
+        self._counters["stores"] += 1
+
+        if self.use_db:
+            try:
+                await CachedGitHubResponse.objects.aupdate_or_create(
+                    key=key, defaults={"etag": etag, "body": body, "link": link or ""}
+                )
+            except Exception as e:
+                logger.warning(f"Failed to persist GitHub response cache entry: {e}")
+
+    def record_hit(self):
+        self._counters["hits"] += 1
+
+    def record_miss(self):
+        self._counters["misses"] += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    @property
+    def stats(self) -> dict:
+        """Counters plus current size and hit ratio"""
+        lookups = self._counters["hits"] + self._counters["misses"]
+        return {
+            **self._counters,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hit_ratio": self._counters["hits"] / lookups if lookups else 0.0,
+        }
+
+
+response_cache = ConditionalRequestCache(
+    max_entries=settings.GITHUB_CACHE_MAX_ENTRIES,
+    max_bytes=settings.GITHUB_CACHE_MAX_BYTES,
+    ttl=settings.GITHUB_CACHE_TTL,
+    use_db=settings.GITHUB_CACHE_DB_TIER,
+)
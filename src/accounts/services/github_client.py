@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import weakref
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+from django.conf import settings
+
+from .rate_limit import rate_limiter
+from .resilience import resilient_caller
+from .single_flight import request_key, single_flight
+
+logger = logging.getLogger(__name__)
+
+GITHUB_API_URL = settings.GITHUB_API_URL
+
+# Only idempotent reads are shared between concurrent callers
+COALESCED_METHODS = {"GET", "HEAD"}
+# Methods safe to send again when the response was lost; a POST like the
+# OAuth code exchange may already have taken effect
+RETRIED_METHODS = {"GET", "HEAD", "PUT", "DELETE"}
+
+
+class GitHubClient:
+    """
+    Long-lived, connection-pooled HTTP client for all GitHub traffic.
+
+    httpx clients are bound to the event loop they were created on, so one
+    pooled client is kept per running loop. Short-lived loops, like the one
+    ``async_to_sync`` starts for every async view under WSGI, get their
+    client closed when they finish: the client is tied to an async generator
+    of that loop, and ``asyncio.run`` closes those before closing the loop.
+    """
+
+    def __init__(self):
+        self._clients = weakref.WeakKeyDictionary()  # loop -> (client, lifetime)
+
+    def _build_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=settings.GITHUB_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.GITHUB_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.GITHUB_HTTP_KEEPALIVE_EXPIRY,
+        )
+        return httpx.AsyncClient(
+            http2=settings.GITHUB_HTTP2,
+            limits=limits,
+            timeout=httpx.Timeout(settings.GITHUB_HTTP_TIMEOUT),
+            follow_redirects=True,
+        )
+
+    @staticmethod
+    async def _lifetime(client: httpx.AsyncClient):
+        """Suspended for as long as the loop runs; closed with the loop's async generators"""
+        try:
+            yield
+        finally:
+            await client.aclose()
+            logger.debug("Closed pooled GitHub client of a finished loop")
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        """Return the pooled client for the running event loop, creating it on first use"""
+        loop = asyncio.get_running_loop()
+        client, _ = self._clients.get(loop, (None, None))
+        if client is None or client.is_closed:
+            client = self._build_client()
+            lifetime = self._lifetime(client)
+            # Advancing it registers it with the loop's async generator hooks;
+            # the reference kept here stops it being finalized any earlier
+            await lifetime.__anext__()
+            self._clients[loop] = (client, lifetime)
+            logger.debug(f"Created pooled GitHub client for loop {id(loop)}")
+        return client
+
+    @staticmethod
+    def _auth_headers(token: Optional[str], headers: Optional[dict]) -> dict:
+        headers = dict(headers or {})
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        return headers
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        token: str = None,
+        headers: dict = None,
+        stream: bool = False,
+        public: bool = False,
+        retry: bool = None,
+        **kwargs,
+    ) -> httpx.Response:
+        """
+        Send a request through the pooled client, scheduled per access token and
+        retried with backoff behind a per-endpoint circuit breaker.
+        With ``stream=True`` the body is left unread and the caller must close it.
+
+        Concurrent identical GETs share one upstream call and its response.
+        They are shared per token, or across tokens with ``public=True`` for
+        resources that look the same to everyone, like a public repo's trees.
+
+        Only idempotent methods are retried unless ``retry`` says otherwise,
+        e.g. for read-only GraphQL queries, which are POSTs.
+        """
+        client = await self._get_client()
+        headers = self._auth_headers(token, headers)
+        if retry is None:
+            retry = method.upper() in RETRIED_METHODS
+
+        async def send():
+            request = client.build_request(method, url, headers=headers, **kwargs)
+            return await client.send(request, stream=stream)
+
+        async def scheduled_send():
+            if token is None:
+                return await send()
+            return await rate_limiter.run(token, send)
+
+        async def call():
+            return await resilient_caller.call(url, scheduled_send, retry=retry)
+
+        if stream or method.upper() not in COALESCED_METHODS or kwargs.keys() - {"params"}:
+            return await call()
+        key = request_key(method, url, kwargs.get("params"), headers, token, public)
+        return await single_flight.do(key, call)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs):
+        """Streaming request sharing the same pool, scheduling and retries"""
+        response = await self.request(method, url, stream=True, **kwargs)
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    async def aclose(self):
+        """Close the pooled client of the running event loop"""
+        loop = asyncio.get_running_loop()
+        _, lifetime = self._clients.pop(loop, (None, None))
+        if lifetime is not None:
+            await lifetime.aclose()
+
+
+github_client = GitHubClient()
@@ -1,76 +1,375 @@
+import asyncio
 import logging
+import re
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
 
 import httpx
+from django.conf import settings
+from django.db.models import Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from ..models import *
+from .github_app import github_app
+from .github_cache import response_cache
+from .github_client import GITHUB_API_URL, github_client
+from .rate_limit import rate_limiter
+from .upsert import async_sync_m2m, aupsert
 
 logger = logging.getLogger(__name__)
 
+_LINK_RE = re.compile(r'<(?P<url>[^>]+)>;\s*rel="(?P<rel>[^"]+)"')
+
+
+def _last_page(link_header: str) -> int:
+    """Read the page number of the rel="last" entry of a Link header"""
+    for match in _LINK_RE.finditer(link_header or ""):
+        if match.group("rel") == "last":
+            query = parse_qs(urlparse(match.group("url")).query)
+            return int(query.get("page", ["1"])[0])
+    return 1
+
+
+# GitHub Enterprise serves REST under /api/v3 and GraphQL at /api/graphql
+GRAPHQL_URL = f"{GITHUB_API_URL.removesuffix('/v3')}/graphql"
+
+# Repositories per GraphQL metadata query, kept well below GitHub's node limits
+GRAPHQL_BATCH_SIZE = 25
+
+_REPO_METADATA_FIELDS = """
+    pushedAt
+    viewerPermission
+    licenseInfo { key name spdxId url id }
+    repositoryTopics(first: 100) { nodes { topic { name } } }
+    refs(refPrefix: "refs/heads/", first: 100%s) {
+      pageInfo { hasNextPage endCursor }
+      nodes { name branchProtectionRule { id } target { oid } }
+    }
+"""
+
+# GraphQL viewerPermission -> REST style permissions dict
+_VIEWER_PERMISSIONS = {
+    "ADMIN": {"admin": True, "maintain": True, "push": True, "triage": True, "pull": True},
+    "MAINTAIN": {"admin": False, "maintain": True, "push": True, "triage": True, "pull": True},
+    "WRITE": {"admin": False, "maintain": False, "push": True, "triage": True, "pull": True},
+    "TRIAGE": {"admin": False, "maintain": False, "push": False, "triage": True, "pull": True},
+    "READ": {"admin": False, "maintain": False, "push": False, "triage": False, "pull": True},
+}
+
+
+# Repository columns copied verbatim from GitHub's REST payload on every sync
+REPOSITORY_SYNC_FIELDS = [
+    "node_id",
+    "name",
+    "full_name",
+    "private",
+    "description",
+    "fork",
+    "url",
+    "html_url",
+    "git_url",
+    "ssh_url",
+    "clone_url",
+    "svn_url",
+    "homepage",
+    "size",
+    "stargazers_count",
+    "watchers_count",
+    "language",
+    "has_issues",
+    "has_projects",
+    "has_downloads",
+    "has_wiki",
+    "has_pages",
+    "has_discussions",
+    "forks_count",
+    "mirror_url",
+    "archived",
+    "disabled",
+    "open_issues_count",
+    "allow_forking",
+    "is_template",
+    "web_commit_signoff_required",
+    "visibility",
+    "default_branch",
+    "pushed_at",
+]
+
 
 class GitHubService:
     def __init__(self):
         self.headers = {"Accept": "application/vnd.github.v3+json"}
 
+    async def _request(
+        self,
+        access_token: str,
+        url: str,
+        params: dict = None,
+        headers: dict = None,
+        public: bool = False,
+    ) -> Tuple[object, str]:
+        """Make a conditional GitHub GET request and return (data, Link header)"""
+        if headers is None:
+            headers = self.headers
+
+        cache_key = response_cache.make_key(access_token, url, params, headers)
+        cached = await response_cache.aget(cache_key)
+        if cached is not None:
+            headers = {**headers, "If-None-Match": cached.etag}
+
+        response = await github_client.get(
+            url, token=access_token, headers=headers, params=params, public=public
+        )
+        if cached is not None and response.status_code == 304:
+            response_cache.record_hit()
+            return cached.body, cached.link
+
+        response.raise_for_status()
+        data = response.json()
+        link = response.headers.get("Link", "")
+        response_cache.record_miss()
+
+        etag = response.headers.get("ETag")
+        if etag:
+            await response_cache.aset(cache_key, etag, data, link, size=len(response.content))
+        return data, link
+
     async def _make_request(
         self, access_token: str, url: str, params: dict = None, headers: dict = None
     ) -> dict:
         """Async helper method to make GitHub API requests"""
-        if headers is None:
-            headers = {**self.headers, "Authorization": f"Bearer {access_token}"}
-        else:
-            headers = {**headers, "Authorization": f"Bearer {access_token}"}
+        data, _ = await self._request(access_token, url, params, headers)
+        return data
+
+    async def _paginate(
+        self,
+        access_token: str,
+        url: str,
+        params: dict = None,
+        headers: dict = None,
+        items_key: str = None,
+        per_page: int = 100,
+        public: bool = False,
+    ) -> AsyncIterator[list]:
+        """
+        Yield the pages of a GitHub list endpoint as they arrive.
+        The first response's Link rel="last" tells how many pages exist, the rest
+        are fetched concurrently under GITHUB_PAGINATION_CONCURRENCY.
+        """
+        params = {**(params or {}), "per_page": per_page}
+
+        def items(data):
+            return data.get(items_key, []) if items_key else data
+
+        data, link = await self._request(
+            access_token, url, params={**params, "page": 1}, headers=headers, public=public
+        )
+        yield items(data)
+
+        last_page = _last_page(link)
+        if last_page <= 1:
+            return
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers, params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
+        semaphore = asyncio.Semaphore(settings.GITHUB_PAGINATION_CONCURRENCY)
+
+        async def fetch_page(page: int):
+            async with semaphore:
+                data, _ = await self._request(
+                    access_token,
+                    url,
+                    params={**params, "page": page},
+                    headers=headers,
+                    public=public,
+                )
+                return items(data)
+
+        tasks = [
+            asyncio.create_task(fetch_page(page)) for page in range(2, last_page + 1)
+        ]
+        try:
+            for next_page in asyncio.as_completed(tasks):
+                yield await next_page
+        finally:
+            for task in tasks:
+                task.cancel()
 
     async def get_user_data(self, access_token: str) -> dict:
         """Fetch user data from GitHub"""
-        return await self._make_request(access_token, "https://api.github.com/user")
+        return await self._make_request(access_token, f"{GITHUB_API_URL}/user")
+
+    async def iter_all_repos(self, access_token: str) -> AsyncIterator[List[dict]]:
+        """Stream batches of the user's repositories as pages arrive"""
+        async for batch in self._paginate(
+            access_token,
+            f"{GITHUB_API_URL}/user/repos",
+            params={"sort": "updated"},
+        ):
+            yield batch
 
     async def get_all_repos(self, access_token: str) -> List[dict]:
         """Fetch all repositories with pagination"""
         repos = []
-        page = 1
-        per_page = 100
-
-        while True:
-            try:
-                batch = await self._make_request(
-                    access_token,
-                    "https://api.github.com/user/repos",
-                    params={"page": page, "per_page": per_page, "sort": "updated"},
-                )
-                if not batch:
-                    break
-
+        try:
+            async for batch in self.iter_all_repos(access_token):
                 repos.extend(batch)
-                page += 1
-
-                if len(batch) < per_page:
-                    break
-            except httpx.HTTPError as e:
-                logger.error(f"Failed to fetch repos page {page}: {str(e)}")
-                break
+        except httpx.HTTPError as e:
+            logger.error(f"Failed to fetch repos: {str(e)}")
 
         return repos
 
-    async def get_repo_branches(self, access_token: str, full_name: str) -> List[dict]:
-        """Fetch branches for a repository"""
-        return await self._make_request(
-            access_token, f"https://api.github.com/repos/{full_name}/branches"
-        )
+    async def get_repo_branches(
+        self, access_token: str, full_name: str, public: bool = False
+    ) -> List[dict]:
+        """Fetch all branches for a repository"""
+        branches = []
+        async for batch in self._paginate(
+            access_token,
+            f"{GITHUB_API_URL}/repos/{full_name}/branches",
+            public=public,
+        ):
+            branches.extend(batch)
+        return branches
 
-    async def get_repo_topics(self, access_token: str, full_name: str) -> dict:
+    async def get_repo_topics(self, access_token: str, full_name: str) -> List[str]:
         """Fetch repository topics"""
-        return await self._make_request(
+        topics = []
+        async for batch in self._paginate(
             access_token,
-            f"https://api.github.com/repos/{full_name}/topics",
+            f"{GITHUB_API_URL}/repos/{full_name}/topics",
             headers={"Accept": "application/vnd.github.mercy-preview+json"},
+            items_key="names",
+        ):
+            topics.extend(batch)
+        return topics
+
+    async def _graphql(self, access_token: str, query: str, variables: dict = None) -> dict:
+        """Run a GitHub GraphQL query and return its data"""
+        response = await github_client.post(
+            GRAPHQL_URL,
+            token=access_token,
+            json={"query": query, "variables": variables or {}},
+            # Queries only read, sending one again is safe
+            retry=True,
+        )
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get("errors"):
+            logger.warning(f"GraphQL query returned errors: {payload['errors']}")
+        return payload.get("data") or {}
+
+    def _parse_repo_metadata(self, full_name: str, node: dict) -> dict:
+        """Convert a GraphQL repository node to the shapes the DB writers expect"""
+        license_info = node.get("licenseInfo")
+        return {
+            "pushed_at": parse_datetime(node["pushedAt"]) if node.get("pushedAt") else None,
+            "permissions": _VIEWER_PERMISSIONS.get(node.get("viewerPermission"), {}),
+            "license": {
+                "key": license_info.get("key", ""),
+                "name": license_info.get("name", ""),
+                "spdx_id": license_info.get("spdxId") or "",
+                "url": license_info.get("url"),
+                "node_id": license_info.get("id", ""),
+            }
+            if license_info
+            else None,
+            "topics": [
+                t["topic"]["name"] for t in node["repositoryTopics"]["nodes"]
+            ],
+            "branches": self._parse_refs(full_name, node["refs"]["nodes"]),
+        }
+
+    @staticmethod
+    def _parse_refs(full_name: str, refs: List[dict]) -> List[dict]:
+        return [
+            {
+                "name": ref["name"],
+                "protected": ref.get("branchProtectionRule") is not None,
+                "commit": {
+                    "sha": ref["target"]["oid"],
+                    "url": f"{GITHUB_API_URL}/repos/{full_name}/commits/{ref['target']['oid']}",
+                },
+            }
+            for ref in refs
+        ]
+
+    async def _fetch_remaining_refs(
+        self, access_token: str, full_name: str, cursor: str
+    ) -> Optional[List[dict]]:
+        """
+        Page through branches beyond the first 100 returned by the batch query.
+        Returns None if a page is missing: stored branches not in an incomplete
+        listing would be deleted.
+        """
+        owner, name = full_name.split("/", 1)
+        query = (
+            "query($owner: String!, $name: String!, $cursor: String) {"
+            " repository(owner: $owner, name: $name) {"
+            + _REPO_METADATA_FIELDS % ", after: $cursor"
+            + "} }"
         )
+        branches = []
+        while cursor:
+            data = await self._graphql(
+                access_token, query, {"owner": owner, "name": name, "cursor": cursor}
+            )
+            refs = (data.get("repository") or {}).get("refs")
+            if not refs:
+                return None
+            branches.extend(self._parse_refs(full_name, refs["nodes"]))
+            page_info = refs["pageInfo"]
+            cursor = page_info["endCursor"] if page_info["hasNextPage"] else None
+        return branches
+
+    async def get_repositories_metadata(
+        self, access_token: str, full_names: List[str]
+    ) -> Dict[str, dict]:
+        """
+        Fetch branches (with head SHAs), topics, license, viewer permission and
+        pushed_at for many repositories with one GraphQL query per batch.
+        """
+        metadata = {}
+        for start in range(0, len(full_names), GRAPHQL_BATCH_SIZE):
+            batch = full_names[start : start + GRAPHQL_BATCH_SIZE]
+            params, fields, variables = [], [], {}
+            for index, full_name in enumerate(batch):
+                owner, name = full_name.split("/", 1)
+                params.append(f"$owner{index}: String!, $name{index}: String!")
+                fields.append(
+                    f"r{index}: repository(owner: $owner{index}, name: $name{index}) {{"
+                    + _REPO_METADATA_FIELDS % ""
+                    + "}"
+                )
+                variables[f"owner{index}"] = owner
+                variables[f"name{index}"] = name
+
+            query = f"query({', '.join(params)}) {{ {' '.join(fields)} }}"
+            data = await self._graphql(access_token, query, variables)
+
+            for index, full_name in enumerate(batch):
+                node = data.get(f"r{index}")
+                if not node:
+                    continue
+                try:
+                    repo_metadata = self._parse_repo_metadata(full_name, node)
+                except (KeyError, TypeError):
+                    # A field GraphQL nulled out because of an error
+                    logger.warning(f"Incomplete GraphQL metadata for {full_name}")
+                    continue
+                page_info = node["refs"]["pageInfo"]
+                if page_info["hasNextPage"]:
+                    remaining = await self._fetch_remaining_refs(
+                        access_token, full_name, page_info["endCursor"]
+                    )
+                    if remaining is None:
+                        logger.warning(f"Incomplete GraphQL branch listing for {full_name}")
+                        continue
+                    repo_metadata["branches"].extend(remaining)
+                metadata[full_name] = repo_metadata
+
+        return metadata
 
     async def update_user_data(self, user_data: dict, access_token: str) -> User:
         """Create or update user from GitHub data"""
@@ -91,44 +390,43 @@ class GitHubService:
         )
         return user
 
-    async def update_repository(self, user: User, repos: dict) -> List[Repository]:
-        """Version that returns created repositories"""
+    def _build_repository(self, user: User, repo: dict) -> Repository:
+        """Map a GitHub REST repository payload onto a Repository instance"""
+        fields = {}
+        for name in REPOSITORY_SYNC_FIELDS:
+            value = repo.get(name)
+            field = Repository._meta.get_field(name)
+            if value is None and not field.null:
+                value = field.get_default()
+            fields[name] = value
+        fields["pushed_at"] = parse_datetime(repo["pushed_at"]) if repo.get("pushed_at") else None
+        return Repository(user=user, repo_id=repo["id"], **fields)
+
+    async def update_repository(self, user: User, repos: List[dict]) -> List[Repository]:
+        """
+        Create new repositories and refresh the metadata of changed ones in a
+        single upsert. Returns all of the user's synced repositories.
+        """
         if not repos:
             return []
 
-        repo_ids = [r["id"] for r in repos]
-        existing_ids = set(
-            [
-                r.repo_id
-                async for r in Repository.objects.filter(
-                    user=user, repo_id__in=repo_ids
-                )
-            ]
+        return await aupsert(
+            Repository,
+            [self._build_repository(user, repo) for repo in repos],
+            unique_fields=["user", "repo_id"],
+            update_fields=REPOSITORY_SYNC_FIELDS + ["updated_at"],
+            existing=Repository.objects.filter(
+                user=user, repo_id__in=[repo["id"] for repo in repos]
+            ),
         )
 
-        to_create = [
-            Repository(
-                repo_id=repo["id"],
-                user=user,
-                node_id=repo["node_id"],
-                name=repo["name"],
-                full_name=repo["full_name"],
-                private=repo["private"],
-                description=repo.get("description"),
-            )
-            for repo in repos
-            if repo["id"] not in existing_ids
-        ]
-
-        if to_create:
-            created = await Repository.objects.abulk_create(to_create, batch_size=100)
-            return created
-        return []
-
     async def update_branches(self, access_token: str, repository: Repository):
         """Update branches for a repository"""
         try:
-            branches = await self.get_repo_branches(access_token, repository.full_name)
+            token = await github_app.token_for_repo(repository.full_name, access_token)
+            branches = await self.get_repo_branches(
+                token, repository.full_name, public=not repository.private
+            )
             db_branches = await self._update_branches_in_db(repository, branches)
             return db_branches
         except Exception as e:
@@ -136,183 +434,177 @@ class GitHubService:
                 f"Failed to update branches for {repository.full_name}: {str(e)}"
             )
 
+    async def sync_repository_metadata(
+        self, access_token: str, repositories: List[Repository]
+    ) -> Dict[int, List[Branch]]:
+        """
+        Sync branches, topics, license, permissions and pushed_at for the given
+        repositories from a single batched GraphQL request.
+        Returns the refreshed branches keyed by repository id.
+        """
+        metadata = await self.get_repositories_metadata(
+            access_token, [repo.full_name for repo in repositories]
+        )
+
+        synced = {}
+        for repository in repositories:
+            repo_metadata = metadata.get(repository.full_name)
+            if repo_metadata is None:
+                logger.warning(f"No metadata returned for {repository.full_name}")
+                continue
+
+            synced[repository.id] = await self._update_branches_in_db(
+                repository, repo_metadata["branches"]
+            )
+            await self._update_permissions(repository, repo_metadata["permissions"])
+            await self._update_license(repository, repo_metadata["license"])
+            await self._update_topics_in_db(repository, repo_metadata["topics"])
+
+            repository.pushed_at = repo_metadata["pushed_at"]
+            repository.metadata_synced_at = timezone.now()
+            await Repository.objects.filter(id=repository.id).aupdate(
+                pushed_at=repository.pushed_at,
+                metadata_synced_at=repository.metadata_synced_at,
+            )
+
+        return synced
+
+    async def warm_up_repositories(
+        self, user: User, repositories: List[Repository]
+    ) -> Dict[int, List[Branch]]:
+        """
+        Sync the metadata of the repositories the user is most likely to select
+        next, so /select_repo can show their branches without asking GitHub.
+        Repositories are ranked by their latest push or selection, and the
+        warm-up is skipped when the token is running low on quota.
+        """
+        remaining = rate_limiter.state_for(user.access_token).remaining
+        if remaining is not None and remaining < settings.REPO_WARMUP_MIN_QUOTA:
+            logger.info(f"Skipping warm-up for {user}, {remaining} requests left")
+            return {}
+
+        # Ranked from the stored rows: objects returned by an upsert are the
+        # ones just built from GitHub's listing, without our own timestamps
+        never = datetime(1970, 1, 1, tzinfo=timezone.get_current_timezone())
+        ranked = (
+            Repository.objects.filter(
+                user=user, repo_id__in=[repository.repo_id for repository in repositories]
+            )
+            .annotate(
+                last_activity=Greatest(
+                    Coalesce("pushed_at", Value(never)),
+                    Coalesce("last_selected_at", Value(never)),
+                )
+            )
+            .order_by("-last_activity", "-id")[: settings.REPO_WARMUP_COUNT]
+        )
+        return await self.sync_repository_metadata(
+            user.access_token, [repository async for repository in ranked]
+        )
+
     async def _update_branches_in_db(
         self, repository: Repository, branches: List[dict]
-    ):
-        """Async method to update branches in database using bulk operations and return refreshed objects"""
-        # Get existing branches
-        existing_branches_query = repository.branches.all()
-        existing_branches = {
-            branch.name: branch async for branch in existing_branches_query
-        }
+    ) -> List[Branch]:
+        """Upsert the repository's branches, drop vanished ones and return them all"""
         current_branch_names = {branch["name"] for branch in branches}
+        await repository.branches.exclude(name__in=current_branch_names).adelete()
 
-        # Delete old branches not present anymore
-        to_delete = [
-            name for name in existing_branches if name not in current_branch_names
-        ]
-        if to_delete:
-            await repository.branches.filter(name__in=to_delete).adelete()
-
-        # Prepare batches for bulk operations
-        to_create = []
-        to_update = []
-
+        to_upsert = []
         for branch in branches:
-            branch_name = branch["name"]
             commit = branch.get("commit", {})
-            defaults = {
-                "protected": branch.get("protected", False),
-                "last_commit_sha": commit.get("sha", ""),
-                "last_commit_url": commit.get("url", ""),
-            }
-
-            if branch_name in existing_branches:
-                # Update existing branch
-                db_branch = existing_branches[branch_name]
-                for field, value in defaults.items():
-                    setattr(db_branch, field, value)
-                to_update.append(db_branch)
-            else:
-                # Create new branch
-                to_create.append(
-                    Branch(repository=repository, name=branch_name, **defaults)
+            to_upsert.append(
+                Branch(
+                    repository=repository,
+                    name=branch["name"],
+                    protected=branch.get("protected", False),
+                    last_commit_sha=commit.get("sha", ""),
+                    last_commit_url=commit.get("url", ""),
                 )
-
-        # Perform bulk operations
-        if to_create:
-            await Branch.objects.abulk_create(to_create)
-
-        if to_update:
-            await Branch.objects.abulk_update(
-                to_update, fields=["protected", "last_commit_sha", "last_commit_url"]
-            )
-
-        # Refresh all branches from DB to get complete updated instances
-        refreshed_branches = [
-            branch
-            async for branch in repository.branches.filter(
-                name__in=current_branch_names
             )
-        ]
 
-        return refreshed_branches
+        return await aupsert(
+            Branch,
+            to_upsert,
+            unique_fields=["repository", "name"],
+            update_fields=["protected", "last_commit_sha", "last_commit_url"],
+            existing=repository.branches.all(),
+        )
 
     async def _update_permissions(self, repository: Repository, permissions: dict):
-        """Update repository permissions using bulk operations"""
+        """Upsert repository permissions"""
         if not permissions:
             return
 
-        # Fetch existing permissions in bulk (usually just 1 record)
-        existing_perms = [
-            perm
-            async for perm in RepositoryPermission.objects.filter(repository=repository)
-        ]
-
-        if existing_perms:
-            # Bulk update existing records
-            for perm in existing_perms:
-                perm.admin = permissions.get("admin", False)
-                perm.maintain = permissions.get("maintain", False)
-                perm.push = permissions.get("push", False)
-                perm.triage = permissions.get("triage", False)
-                perm.pull = permissions.get("pull", True)
-
-            await RepositoryPermission.objects.abulk_update(
-                existing_perms, fields=["admin", "maintain", "push", "triage", "pull"]
-            )
-        else:
-            # Bulk create new record (even if just one)
-            new_perms = RepositoryPermission(
-                repository=repository,
-                admin=permissions.get("admin", False),
-                maintain=permissions.get("maintain", False),
-                push=permissions.get("push", False),
-                triage=permissions.get("triage", False),
-                pull=permissions.get("pull", True),
-            )
-            await RepositoryPermission.objects.abulk_create([new_perms])
+        await aupsert(
+            RepositoryPermission,
+            [
+                RepositoryPermission(
+                    repository=repository,
+                    admin=permissions.get("admin", False),
+                    maintain=permissions.get("maintain", False),
+                    push=permissions.get("push", False),
+                    triage=permissions.get("triage", False),
+                    pull=permissions.get("pull", True),
+                )
+            ],
+            unique_fields=["repository"],
+            update_fields=["admin", "maintain", "push", "triage", "pull"],
+            existing=RepositoryPermission.objects.filter(repository=repository),
+        )
 
     async def _update_license(
         self, repository: Repository, license_data: Optional[dict]
     ):
-        """Alternative with bulk operations (less optimal for this case)"""
+        """Upsert the repository license"""
         if not license_data:
             return
 
-        defaults = {
-            "key": license_data.get("key", ""),
-            "name": license_data.get("name", ""),
-            "spdx_id": license_data.get("spdx_id", ""),
-            "url": license_data.get("url"),
-            "node_id": license_data.get("node_id", ""),
-        }
-
-        existing_licenses = [
-            license_obj
-            async for license_obj in License.objects.filter(repository=repository)
-        ]
-
-        if existing_licenses:
-            for license_obj in existing_licenses:
-                for field, value in defaults.items():
-                    setattr(license_obj, field, value)
-            await License.objects.abulk_update(
-                existing_licenses, fields=["key", "name", "spdx_id", "url", "node_id"]
-            )
-        else:
-            await License.objects.abulk_create(
-                [License(repository=repository, **defaults)]
-            )
+        await aupsert(
+            License,
+            [
+                License(
+                    repository=repository,
+                    key=license_data.get("key", ""),
+                    name=license_data.get("name", ""),
+                    spdx_id=license_data.get("spdx_id") or "",
+                    url=license_data.get("url"),
+                    node_id=license_data.get("node_id", ""),
+                )
+            ],
+            unique_fields=["repository"],
+            update_fields=["key", "name", "spdx_id", "url", "node_id"],
+            existing=License.objects.filter(repository=repository),
+        )
 
     async def _update_topics(
         self, access_token: str, repository: Repository, repo_name: str
     ):
         """Update repository topics"""
         try:
-            topics_response = await self._make_request(
-                access_token,
-                f"https://api.github.com/repos/{repository.full_name}/topics",
-                headers={"Accept": "application/vnd.github.mercy-preview+json"},
-            )
-            topics = topics_response.get("names", [])
+            topics = await self.get_repo_topics(access_token, repository.full_name)
             await self._update_topics_in_db(repository, topics)
         except Exception as e:
             logger.error(f"Failed to update topics for {repo_name}: {str(e)}")
 
     async def _update_topics_in_db(self, repository: Repository, topics: List[str]):
-        """Async method to update topics in database using bulk operations"""
-        if not topics:
-            await repository.topics.aclear()
-            return
-
-        # Clear existing topics
-        await repository.topics.aclear()
-
-        # Get existing topics in bulk
-        existing_topics = {
-            topic.name: topic async for topic in Topic.objects.filter(name__in=topics)
-        }
-
-        # Identify topics that need to be created
-        topics_to_create = [name for name in topics if name not in existing_topics]
-
-        # Bulk create missing topics
-        if topics_to_create:
-            new_topics = await Topic.objects.abulk_create(
-                [Topic(name=name) for name in topics_to_create]
+        """Bring the repository's topics in line with GitHub, changing only the difference"""
+        topics = set(topics)
+        wanted = {topic.name: topic async for topic in Topic.objects.filter(name__in=topics)}
+        missing = topics - wanted.keys()
+        if missing:
+            await Topic.objects.abulk_create(
+                [Topic(name=name) for name in missing], ignore_conflicts=True
             )
-            existing_topics.update({topic.name: topic for topic in new_topics})
-
-        # Bulk add all topics to repository
-        topic_objects = [existing_topics[name] for name in topics]
-        await repository.topics.aadd(*topic_objects)
+            wanted.update(
+                {topic.name: topic async for topic in Topic.objects.filter(name__in=missing)}
+            )
+        await async_sync_m2m(repository.topics, wanted.values())
 
     async def fetch_codebase(self, repository, owner, branch, access_token):
         try:
             return await self._make_request(
                 access_token,
-                f"https://api.github.com/repos/{owner}/{repository}/git/trees/{branch}",
+                f"{GITHUB_API_URL}/repos/{owner}/{repository}/git/trees/{branch}",
             )
         except Exception as e:
             logger.error(f"Failed to fetch codebase for {repository}: {str(e)}")
@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+import weakref
+from collections import Counter
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# GitHub asks clients to wait at least a minute after a secondary rate limit
+# response that carries neither Retry-After nor an exhausted primary quota.
+SECONDARY_LIMIT_BACKOFF = 60.0
+
+
+@dataclass
+class TokenState:
+    """Rate limit bookkeeping for a single access token"""
+
+    limit: float
+    in_flight: int = 0
+    remaining: Optional[int] = None
+    reset_at: float = 0.0
+    paused_until: float = 0.0
+
+
+class RateLimitScheduler:
+    """
+    Per-token request scheduler driven by GitHub's rate limit headers.
+
+    Every token gets a token bucket refilled from X-RateLimit-Remaining and
+    X-RateLimit-Reset, and an AIMD concurrency window: it grows by roughly one
+    request per round trip on success and halves on a throttled response.
+    Throttled requests wait for Retry-After (or the reset) and are requeued
+    instead of being handed back to the caller as failures.
+    """
+
+    def __init__(
+        self, initial_concurrency: int, max_concurrency: int, max_requeues: int
+    ):
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_requeues = max_requeues
+        self._states = {}
+        self._conditions = weakref.WeakKeyDictionary()
+        # Token states are shared by every event loop (each async_to_sync call
+        # under WSGI runs its own, on its own thread)
+        self._guard = threading.Lock()
+        self._counters = Counter()
+
+    @staticmethod
+    def _token_key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def state_for(self, token: str) -> TokenState:
+        key = self._token_key(token)
+        state = self._states.get(key)
+        if state is None:
+            state = TokenState(limit=float(self.initial_concurrency))
+            self._states[key] = state
+        return state
+
+    def _condition(self, token: str) -> asyncio.Condition:
+        # Conditions are bound to an event loop, the token state is not
+        loop = asyncio.get_running_loop()
+        key = self._token_key(token)
+        with self._guard:
+            conditions = self._conditions.setdefault(loop, {})
+            if key not in conditions:
+                conditions[key] = asyncio.Condition()
+            return conditions[key]
+
+    def _wake_other_loops(self, token: str):
+        """Wake this token's waiters on the other event loops: a slot freed here is theirs too"""
+        current = asyncio.get_running_loop()
+        key = self._token_key(token)
+        with self._guard:
+            waiting = [
+                (loop, conditions[key])
+                for loop, conditions in self._conditions.items()
+                if loop is not current and key in conditions
+            ]
+        for loop, condition in waiting:
+            notify = self._notify(condition)
+            try:
+                loop.call_soon_threadsafe(loop.create_task, notify)
+            except RuntimeError:  # the loop has closed meanwhile
+                notify.close()
+
+    @staticmethod
+    async def _notify(condition: asyncio.Condition):
+        async with condition:
+            condition.notify_all()
+
+    def _wait_time(self, state: TokenState) -> float:
+        now = time.time()
+        wait = max(state.paused_until - now, 0.0)
+        if (
+            state.remaining is not None
+            and state.remaining <= 0
+            and state.reset_at > now
+        ):
+            wait = max(wait, state.reset_at - now)
+        return wait
+
+    async def _acquire(self, token: str, state: TokenState):
+        condition = self._condition(token)
+        async with condition:
+            while True:
+                wait = self._wait_time(state)
+                if wait == 0 and self._take_slot(state):
+                    return
+                try:
+                    await asyncio.wait_for(condition.wait(), timeout=wait or None)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _take_slot(self, state: TokenState) -> bool:
+        with self._guard:
+            if state.in_flight >= int(state.limit):
+                return False
+            state.in_flight += 1
+            if state.remaining is not None:
+                state.remaining -= 1
+            return True
+
+    async def _release(self, token: str, state: TokenState):
+        condition = self._condition(token)
+        async with condition:
+            with self._guard:
+                state.in_flight -= 1
+            condition.notify_all()
+        self._wake_other_loops(token)
+
+    def _observe(self, state: TokenState, response: httpx.Response) -> Optional[float]:
+        """Update the token state from a response; return a delay if it was throttled"""
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset = response.headers.get("X-RateLimit-Reset")
+        if remaining is not None and remaining.isdigit():
+            state.remaining = int(remaining)
+        if reset is not None and reset.isdigit():
+            state.reset_at = float(reset)
+
+        if not self._is_throttled(state, response):
+            # Additive increase: about one extra slot per window of successes
+            state.limit = min(
+                float(self.max_concurrency), state.limit + 1.0 / state.limit
+            )
+            return None
+
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None and retry_after.isdigit():
+            delay = float(retry_after)
+        elif state.remaining == 0 and state.reset_at:
+            delay = max(state.reset_at - time.time(), 1.0)
+        else:
+            delay = SECONDARY_LIMIT_BACKOFF
+
+        # Multiplicative decrease
+        state.limit = max(1.0, state.limit / 2)
+        state.paused_until = max(state.paused_until, time.time() + delay)
+        return delay
+
+    @staticmethod
+    def _is_throttled(state: TokenState, response: httpx.Response) -> bool:
+        if response.status_code == 429:
+            return True
+        if response.status_code != 403:
+            return False
+        if "Retry-After" in response.headers or state.remaining == 0:
+            return True
+        try:
+            return "rate limit" in response.text.lower()
+        except httpx.ResponseNotRead:
+            return False
+
+    async def run(
+        self, token: str, send: Callable[[], Awaitable[httpx.Response]]
+    ) -> httpx.Response:
+        """Run ``send`` under the token's budget, requeueing throttled attempts"""
+        state = self.state_for(token)
+        attempt = 0
+        while True:
+            await self._acquire(token, state)
+            try:
+                response = await send()
+            finally:
+                await self._release(token, state)
+
+            delay = self._observe(state, response)
+            if delay is None:
+                self._counters["completed"] += 1
+                return response
+
+            self._counters["throttled"] += 1
+            if attempt >= self.max_requeues:
+                logger.error(
+                    f"Giving up on {response.request.url} after {attempt} requeues"
+                )
+                return response
+
+            attempt += 1
+            self._counters["requeued"] += 1
+            await response.aclose()
+            logger.warning(
+                f"GitHub throttled {response.request.url} "
+                f"(status {response.status_code}), requeueing in {delay:.0f}s"
+            )
+
+    @property
+    def stats(self) -> dict:
+        return dict(self._counters)
+
+
+rate_limiter = RateLimitScheduler(
+    initial_concurrency=settings.GITHUB_INITIAL_CONCURRENCY,
+    max_concurrency=settings.GITHUB_MAX_CONCURRENCY,
+    max_requeues=settings.GITHUB_MAX_REQUEUES,
+)
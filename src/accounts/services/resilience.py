@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import random
+import re
+import time
+from collections import Counter
+from typing import Awaitable, Callable
+from urllib.parse import urlparse
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {500, 502, 503, 504}
+
+RETRYABLE_ERRORS = (
+    httpx.TimeoutException,
+    httpx.NetworkError,
+    httpx.RemoteProtocolError,
+)
+
+_SHA_RE = re.compile(r"^[0-9a-f]{40}$")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling GitHub while an endpoint's circuit is open"""
+
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(f"Circuit open for {endpoint}, retry in {retry_in:.0f}s")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+def endpoint_key(url: str) -> str:
+    """
+    Group URLs by endpoint: owner/repo names, SHAs and file paths are collapsed
+    so that e.g. every /git/blobs/{sha} call shares one breaker and budget.
+    """
+    parsed = urlparse(str(url))
+    parts = [p for p in parsed.path.split("/") if p]
+    if parts[:1] == ["repos"] and len(parts) >= 3:
+        resource = parts[3:5] if parts[3:4] == ["git"] else parts[3:4]
+        parts = ["repos", ":owner", ":repo"] + resource
+    parts = [":sha" if _SHA_RE.match(p) else p for p in parts]
+    return f"{parsed.netloc}/{'/'.join(parts)}"
+
+
+class CircuitBreaker:
+    """
+    Classic closed -> open -> half-open breaker.
+    Opens after ``failure_threshold`` consecutive failures, rejects calls for
+    ``reset_timeout`` seconds, then lets a single probe through.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+        # Half-open: only one probe at a time
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def retry_in(self) -> float:
+        return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0)
+
+    def release_probe(self):
+        self._probe_in_flight = False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> bool:
+        """Count a failure; return True if this opened the circuit"""
+        self._probe_in_flight = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            was_open = self.state == self.OPEN
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            return not was_open
+        return False
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of recent requests per endpoint, so a failing
+    endpoint cannot multiply its own load by the retry count.
+    """
+
+    def __init__(self, ratio: float, min_per_window: int, window: float):
+        self.ratio = ratio
+        self.min_per_window = min_per_window
+        self.window = window
+        self.window_start = time.monotonic()
+        self.requests = 0
+        self.retries = 0
+
+    def _roll(self):
+        if time.monotonic() - self.window_start > self.window:
+            self.window_start = time.monotonic()
+            self.requests = 0
+            self.retries = 0
+
+    def record_request(self):
+        self._roll()
+        self.requests += 1
+
+    def try_spend(self) -> bool:
+        self._roll()
+        if self.retries < max(self.min_per_window, self.requests * self.ratio):
+            self.retries += 1
+            return True
+        return False
+
+
+class ResilientCaller:
+    """Jittered exponential retries plus per-endpoint circuit breakers and retry budgets"""
+
+    def __init__(
+        self,
+        max_attempts: int,
+        base_delay: float,
+        max_delay: float,
+        failure_threshold: int,
+        reset_timeout: float,
+        budget_ratio: float,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.budget_ratio = budget_ratio
+        self._breakers = {}
+        self._budgets = {}
+        self._counters = Counter()
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        if endpoint not in self._breakers:
+            self._breakers[endpoint] = CircuitBreaker(
+                self.failure_threshold, self.reset_timeout
+            )
+        return self._breakers[endpoint]
+
+    def _budget(self, endpoint: str) -> RetryBudget:
+        if endpoint not in self._budgets:
+            self._budgets[endpoint] = RetryBudget(
+                self.budget_ratio, min_per_window=10, window=60.0
+            )
+        return self._budgets[endpoint]
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: uniform in [0, min(cap, base * 2^attempt)]
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    async def call(
+        self,
+        url: str,
+        send: Callable[[], Awaitable[httpx.Response]],
+        retry: bool = True,
+    ) -> httpx.Response:
+        """
+        Send through the endpoint's circuit breaker, retrying transient
+        failures unless ``retry`` is False (the failure still counts).
+        """
+        endpoint = endpoint_key(url)
+        breaker = self.breaker(endpoint)
+        budget = self._budget(endpoint)
+        attempt = 0
+
+        while True:
+            if not breaker.allow():
+                self._counters["rejected"] += 1
+                raise CircuitOpenError(endpoint, breaker.retry_in())
+
+            budget.record_request()
+            try:
+                response = await send()
+                failed = response.status_code in RETRYABLE_STATUS
+                error = None
+            except RETRYABLE_ERRORS as e:
+                response, failed, error = None, True, e
+            except BaseException:
+                # Cancelled or not a transport failure, don't count it against GitHub
+                breaker.release_probe()
+                raise
+
+            if not failed:
+                breaker.record_success()
+                return response
+
+            self._counters["failures"] += 1
+            if breaker.record_failure():
+                self._counters["circuit_opened"] += 1
+                logger.error(f"Circuit opened for {endpoint}")
+
+            attempt += 1
+            circuit_open = breaker.state == CircuitBreaker.OPEN
+            if (
+                not retry
+                or circuit_open
+                or attempt >= self.max_attempts
+                or not budget.try_spend()
+            ):
+                if retry and not circuit_open and attempt < self.max_attempts:
+                    self._counters["budget_exhausted"] += 1
+                if error is not None:
+                    raise error
+                return response
+
+            if response is not None:
+                await response.aclose()
+            delay = self._backoff(attempt)
+            self._counters["retries"] += 1
+            logger.warning(
+                f"Retrying {endpoint} in {delay:.2f}s (attempt {attempt + 1}): "
+                f"{error or response.status_code}"
+            )
+            await asyncio.sleep(delay)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            **self._counters,
+            "open_circuits": [
+                endpoint
+                for endpoint, breaker in self._breakers.items()
+                if breaker.state != CircuitBreaker.CLOSED
+            ],
+        }
+
+
+resilient_caller = ResilientCaller(
+    max_attempts=settings.GITHUB_RETRY_ATTEMPTS,
+    base_delay=settings.GITHUB_RETRY_BASE_DELAY,
+    max_delay=settings.GITHUB_RETRY_MAX_DELAY,
+    failure_threshold=settings.GITHUB_CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=settings.GITHUB_CIRCUIT_RESET_TIMEOUT,
+    budget_ratio=settings.GITHUB_RETRY_BUDGET_RATIO,
+)
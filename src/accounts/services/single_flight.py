@@ -0,0 +1,80 @@
+import asyncio
+import hashlib
+import weakref
+from collections import Counter
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+# Headers that never change what GitHub returns, or are folded into the scope
+_IGNORED_HEADERS = {"authorization", "user-agent"}
+
+
+def request_key(
+    method: str,
+    url: str,
+    params: Optional[dict],
+    headers: dict,
+    token: Optional[str],
+    public: bool,
+) -> str:
+    """
+    Identity of a request for coalescing. Responses are shared between callers
+    of the same token, or between any callers when the resource is public.
+    """
+    if public or token is None:
+        scope = "public"
+    else:
+        scope = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    header_items = sorted(
+        (name.lower(), value)
+        for name, value in headers.items()
+        if name.lower() not in _IGNORED_HEADERS
+    )
+    full_url = httpx.URL(url, params=params)
+    return f"{scope} {method.upper()} {full_url} {header_items}"
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical calls into one: the first caller starts the
+    call and later callers with the same key await its result instead of
+    issuing their own. Nothing is cached once the call has finished.
+    """
+
+    def __init__(self):
+        self._calls = weakref.WeakKeyDictionary()
+        self._counters = Counter()
+
+    def _in_flight(self) -> dict:
+        # Tasks are bound to an event loop
+        loop = asyncio.get_running_loop()
+        return self._calls.setdefault(loop, {})
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        calls = self._in_flight()
+        task = calls.get(key)
+        if task is None:
+            self._counters["calls"] += 1
+            task = asyncio.ensure_future(fn())
+            calls[key] = task
+            task.add_done_callback(lambda t: self._done(calls, key, t))
+        else:
+            self._counters["coalesced"] += 1
+        # A cancelled caller must not cancel the call the others are waiting on
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def _done(calls: dict, key: str, task: asyncio.Task):
+        if calls.get(key) is task:
+            del calls[key]
+        if not task.cancelled():
+            # Mark the exception retrieved even if every caller went away
+            task.exception()
+
+    @property
+    def stats(self) -> dict:
+        return dict(self._counters)
+
+
+single_flight = SingleFlight()
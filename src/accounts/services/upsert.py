@@ -0,0 +1,69 @@
+from typing import Iterable, List, Type
+
+from django.db import models
+
+
+def _key(model: Type[models.Model], obj: models.Model, unique_fields: List[str]) -> tuple:
+    return tuple(
+        getattr(obj, model._meta.get_field(field).attname) for field in unique_fields
+    )
+
+
+async def aupsert(
+    model: Type[models.Model],
+    objs: Iterable[models.Model],
+    unique_fields: List[str],
+    update_fields: List[str],
+    existing: models.QuerySet,
+) -> List[models.Model]:
+    """
+    Insert or update ``objs`` with a single INSERT ... ON CONFLICT DO UPDATE.
+
+    ``existing`` is the queryset of rows the objects may collide with; it is
+    read once to leave out rows whose update_fields already hold the same
+    values (auto_now fields are written but not compared). Returns one object
+    per input, either the stored row or the freshly written one with its pk set.
+    """
+    objs = list(objs)
+    stored = {_key(model, row, unique_fields): row async for row in existing}
+    compare_fields = [
+        model._meta.get_field(field).attname
+        for field in update_fields
+        if not getattr(model._meta.get_field(field), "auto_now", False)
+    ]
+
+    result, changed = [], []
+    for obj in objs:
+        row = stored.get(_key(model, obj, unique_fields))
+        if row is not None and all(
+            getattr(row, field) == getattr(obj, field) for field in compare_fields
+        ):
+            result.append(row)
+            continue
+        changed.append(obj)
+        result.append(obj)
+
+    if changed:
+        await model.objects.abulk_create(
+            changed,
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=update_fields,
+        )
+    return result
+
+
+async def async_sync_m2m(manager, wanted: Iterable[models.Model]):
+    """
+    Make a many-to-many manager hold exactly ``wanted`` by adding and removing
+    only the difference, instead of clearing and re-adding the whole set.
+    """
+    wanted = {obj.pk: obj for obj in wanted}
+    current = {obj.pk: obj async for obj in manager.all()}
+
+    to_remove = [obj for pk, obj in current.items() if pk not in wanted]
+    to_add = [obj for pk, obj in wanted.items() if pk not in current]
+    if to_remove:
+        await manager.aremove(*to_remove)
+    if to_add:
+        await manager.aadd(*to_add)
@@ -0,0 +1,100 @@
+import hashlib
+import hmac
+import json
+import logging
+
+from django.conf import settings
+
+from ..models import Branch, Repository
+from .github_client import GITHUB_API_URL
+from preview.models import RepositoryCodeState
+from jobs.models import Job
+from jobs.queue import enqueue, snapshot_key
+
+logger = logging.getLogger(__name__)
+
+DELETED_SHA = "0" * 40
+
+
+def verify_signature(body: bytes, signature_header: str) -> bool:
+    """Check GitHub's X-Hub-Signature-256 HMAC against the configured secret"""
+    secret = settings.GITHUB_WEBHOOK_SECRET
+    if not secret or not signature_header:
+        return False
+    expected = "sha256=" + hmac.new(
+        secret.encode("utf-8"), body, hashlib.sha256
+    ).hexdigest()
+    return hmac.compare_digest(expected, signature_header)
+
+
+async def handle_push_event(payload: dict) -> int:
+    """
+    Move every tracked copy of the pushed branch to the new head and queue a
+    snapshot rebuild where one already exists. Returns the number of branches updated.
+    """
+    ref = payload.get("ref", "")
+    if not ref.startswith("refs/heads/"):
+        return 0
+    branch_name = ref[len("refs/heads/") :]
+    repository = payload.get("repository") or {}
+    repo_id = repository.get("id")
+    full_name = repository.get("full_name", "")
+    head_sha = payload.get("after", "")
+    if repo_id is None:
+        logger.warning(f"Push to {branch_name} without a repository, ignoring")
+        return 0
+
+    repositories = [
+        repo async for repo in Repository.objects.filter(repo_id=repo_id)
+    ]
+    if not repositories:
+        return 0
+
+    if payload.get("deleted") or head_sha == DELETED_SHA:
+        await Branch.objects.filter(
+            repository__in=repositories, name=branch_name
+        ).adelete()
+        return 0
+
+    updated = 0
+    for repository in repositories:
+        branch, _ = await Branch.objects.aupdate_or_create(
+            repository=repository,
+            name=branch_name,
+            defaults={
+                "last_commit_sha": head_sha,
+                "last_commit_url": f"{GITHUB_API_URL}/repos/{full_name}/commits/{head_sha}",
+            },
+        )
+        updated += 1
+
+        # Only branches somebody has already previewed get rebuilt eagerly
+        if await RepositoryCodeState.objects.filter(branch=branch).aexists():
+            # Delayed so a burst of pushes only rebuilds the last head
+            await enqueue(
+                Job.KIND_SNAPSHOT,
+                {"branch_id": branch.id, "commit_sha": head_sha},
+                dedup_key=snapshot_key(branch, head_sha),
+                delay=settings.SNAPSHOT_REBUILD_DEBOUNCE,
+            )
+
+    logger.info(f"Push to {full_name}@{branch_name} ({head_sha[:8]}): {updated} branches")
+    return updated
+
+
+async def handle_github_webhook(event: str, body: bytes) -> dict:
+    """Dispatch a verified GitHub webhook delivery"""
+    try:
+        payload = json.loads(body.decode("utf-8"))
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        logger.error(f"Invalid GitHub webhook body: {e}")
+        return {"status": "error", "error": "Invalid JSON or encoding"}
+    if not isinstance(payload, dict):
+        return {"status": "error", "error": "Expected a JSON object"}
+
+    if event == "ping":
+        return {"status": "ok", "event": "ping"}
+    if event == "push":
+        updated = await handle_push_event(payload)
+        return {"status": "ok", "event": "push", "branches": updated}
+    return {"status": "ignored", "event": event}
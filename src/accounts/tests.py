@@ -1,3 +1,1022 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import hmac
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from encrypted_model_fields.fields import decrypt_str, encrypt_str
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from jobs.models import Job
+from preview.models import RepositoryCodeState
+from .fields import Ciphertext, decrypted_cache
+from .models import Branch, License, Repository, RepositoryPermission, Topic, User
+from .services.github_app import GitHubAppAuth
+from .services.github_cache import ConditionalRequestCache
+from .services.github_client import github_client
+from .services.github_service import GRAPHQL_URL, GitHubService
+from .services.rate_limit import RateLimitScheduler
+from .services.resilience import CircuitBreaker, CircuitOpenError, ResilientCaller, RetryBudget
+from .services.single_flight import SingleFlight
+from .services.upsert import async_sync_m2m, aupsert
+
+INSTALLATION_ID = 7
+
+
+class FakeTokenEndpoint:
+    """Stands in for GitHub's installation and access token endpoints"""
+
+    def __init__(self, public_key, installed: set, token_lifetime: float = 3600):
+        self.public_key = public_key
+        self.installed = installed
+        self.token_lifetime = token_lifetime
+        self.minted = []
+        self.lookups = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        scheme, app_jwt = request.headers["Authorization"].split(" ", 1)
+        assert scheme == "Bearer"
+        claims = jwt.decode(app_jwt, self.public_key, algorithms=["RS256"])
+        assert claims["iss"] == "42"
+
+        path = request.url.path
+        if path.endswith("/installation"):
+            self.lookups += 1
+            full_name = path.removeprefix("/repos/").removesuffix("/installation")
+            if full_name not in self.installed:
+                return httpx.Response(404, json={"message": "Not Found"})
+            return httpx.Response(200, json={"id": INSTALLATION_ID})
+
+        if request.method == "POST" and path == f"/app/installations/{INSTALLATION_ID}/access_tokens":
+            token = f"ghs_{len(self.minted)}"
+            self.minted.append(token)
+            expires_at = datetime.fromtimestamp(time.time() + self.token_lifetime, timezone.utc)
+            return httpx.Response(
+                201, json={"token": token, "expires_at": expires_at.isoformat()}
+            )
+        return httpx.Response(404)
+
+
+class GitHubAppAuthTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        cls.private_key = key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ).decode()
+        cls.public_key = key.public_key()
+
+    def _auth(self, installed=("owner/app",), token_lifetime=3600):
+        fake = FakeTokenEndpoint(self.public_key, set(installed), token_lifetime)
+        transport = httpx.MockTransport(fake)
+        patcher = mock.patch.object(
+            github_client, "_build_client", lambda: httpx.AsyncClient(transport=transport)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        auth = GitHubAppAuth(
+            app_id="42",
+            private_key=self.private_key,
+            refresh_margin=300,
+            installation_ttl=600,
+        )
+        return auth, fake
+
+    def test_mints_installation_token(self):
+        auth, fake = self._auth()
+
+        token = asyncio.run(auth.token_for_repo("owner/app", fallback="oauth"))
+
+        self.assertEqual(token, "ghs_0")
+        self.assertEqual(fake.minted, ["ghs_0"])
+        self.assertEqual(auth.stats["jwts_minted"], 1)
+
+    def test_cached_token_is_reused(self):
+        auth, fake = self._auth()
+
+        async def twice():
+            return [await auth.token_for_repo("owner/app", fallback="oauth") for _ in range(2)]
+
+        self.assertEqual(asyncio.run(twice()), ["ghs_0", "ghs_0"])
+        self.assertEqual(len(fake.minted), 1)
+        self.assertEqual(fake.lookups, 1)
+        self.assertEqual(auth.stats["token_hits"], 1)
+
+    def test_token_is_refreshed_near_expiry(self):
+        # Expires within the refresh margin, so it is never served from the cache
+        auth, fake = self._auth(token_lifetime=200)
+
+        async def twice():
+            return [await auth.token_for_repo("owner/app", fallback="oauth") for _ in range(2)]
+
+        self.assertEqual(asyncio.run(twice()), ["ghs_0", "ghs_1"])
+        self.assertEqual(auth.stats["tokens_minted"], 2)
+        # The app JWT itself lives for minutes and is not minted again
+        self.assertEqual(auth.stats["jwts_minted"], 1)
+
+    def test_falls_back_to_oauth_without_installation(self):
+        auth, fake = self._auth(installed=())
+
+        async def twice():
+            return [await auth.token_for_repo("owner/other", fallback="oauth") for _ in range(2)]
+
+        self.assertEqual(asyncio.run(twice()), ["oauth", "oauth"])
+        self.assertEqual(fake.minted, [])
+        # The miss is cached too
+        self.assertEqual(fake.lookups, 1)
+
+    def test_disabled_without_app_credentials(self):
+        auth = GitHubAppAuth(app_id="", private_key="", refresh_margin=300, installation_ttl=600)
+
+        self.assertEqual(asyncio.run(auth.token_for_repo("owner/app", fallback="oauth")), "oauth")
+
+
+class RateLimitSchedulerTests(SimpleTestCase):
+    def test_slot_freed_on_one_loop_wakes_waiters_on_another(self):
+        # Under WSGI every async_to_sync view runs on its own loop and thread
+        scheduler = RateLimitScheduler(initial_concurrency=2, max_concurrency=2, max_requeues=0)
+        holding = threading.Event()
+        finished = {}
+
+        async def send(hold):
+            holding.set()
+            await asyncio.sleep(hold)
+            return httpx.Response(200, request=httpx.Request("GET", "https://api.github.com/"))
+
+        async def hold_both_slots():
+            await asyncio.gather(*(scheduler.run("token", lambda: send(0.3)) for _ in range(2)))
+
+        def wait_for_slot():
+            asyncio.run(scheduler.run("token", lambda: send(0)))
+            finished["at"] = time.monotonic()
+
+        holder = threading.Thread(target=asyncio.run, args=(hold_both_slots(),), daemon=True)
+        holder.start()
+        self.assertTrue(holding.wait(5))
+        waiter = threading.Thread(target=wait_for_slot, daemon=True)
+        started = time.monotonic()
+        waiter.start()
+        holder.join(5)
+        waiter.join(5)
+
+        self.assertFalse(waiter.is_alive())
+        self.assertLess(finished["at"] - started, 2)
+        self.assertEqual(scheduler.state_for("token").in_flight, 0)
+
+
+@override_settings(GITHUB_WEBHOOK_SECRET="hook-secret", SNAPSHOT_REBUILD_DEBOUNCE=30)
+class GitHubWebhookTests(TestCase):
+    url = "/api/github/webhook"
+
+    def setUp(self):
+        user = User.objects.create(username="hook", access_token="token")
+        self.repo = Repository.objects.create(
+            user=user, repo_id=99, name="site", full_name="owner/site"
+        )
+        self.branch = Branch.objects.create(
+            repository=self.repo, name="main", last_commit_sha="a" * 40
+        )
+
+    def _post(self, payload, event="push", signature=None):
+        body = json.dumps(payload).encode()
+        if signature is None:
+            signature = "sha256=" + hmac.new(b"hook-secret", body, hashlib.sha256).hexdigest()
+        headers = {"X-GitHub-Event": event}
+        if signature:
+            headers["X-Hub-Signature-256"] = signature
+        return self.client.post(
+            self.url, data=body, content_type="application/json", headers=headers
+        )
+
+    def _push(self, after, ref="refs/heads/main", **extra):
+        return {
+            "ref": ref,
+            "after": after,
+            "repository": {"id": 99, "full_name": "owner/site"},
+            **extra,
+        }
+
+    def test_missing_or_bad_signature_is_rejected(self):
+        for signature in ["", "sha256=" + "0" * 64, "sha1=abc"]:
+            with self.subTest(signature=signature):
+                response = self._post(self._push("b" * 40), signature=signature)
+                self.assertEqual(response.status_code, 401)
+        self.branch.refresh_from_db()
+        self.assertEqual(self.branch.last_commit_sha, "a" * 40)
+
+    @override_settings(GITHUB_WEBHOOK_SECRET="")
+    def test_unconfigured_secret_rejects_everything(self):
+        self.assertEqual(self._post(self._push("b" * 40)).status_code, 401)
+
+    def test_push_moves_branch_head(self):
+        response = self._post(self._push("b" * 40))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"status": "ok", "event": "push", "branches": 1})
+        self.branch.refresh_from_db()
+        self.assertEqual(self.branch.last_commit_sha, "b" * 40)
+        # Never previewed, so nothing is rebuilt
+        self.assertFalse(Job.objects.exists())
+
+    def test_push_to_previewed_branch_queues_a_delayed_snapshot(self):
+        RepositoryCodeState.objects.create(
+            repository=self.repo, branch=self.branch, commit_sha="a" * 40
+        )
+
+        self._post(self._push("b" * 40))
+        self._post(self._push("b" * 40))
+
+        job = Job.objects.get()
+        self.assertEqual(job.kind, Job.KIND_SNAPSHOT)
+        self.assertEqual(job.payload, {"branch_id": self.branch.id, "commit_sha": "b" * 40})
+        self.assertGreater((job.run_at - job.created_at).total_seconds(), 25)
+
+    def test_deleted_branch_is_removed(self):
+        response = self._post(self._push("0" * 40, deleted=True))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Branch.objects.filter(pk=self.branch.pk).exists())
+
+    def test_ignored_events_and_refs(self):
+        response = self._post({"zen": "hi"}, event="ping")
+        self.assertEqual(response.json(), {"status": "ok", "event": "ping"})
+
+        response = self._post({"action": "opened"}, event="issues")
+        self.assertEqual(response.json(), {"status": "ignored", "event": "issues"})
+
+        response = self._post(self._push("b" * 40, ref="refs/tags/v1"))
+        self.assertEqual(response.json()["branches"], 0)
+        self.branch.refresh_from_db()
+        self.assertEqual(self.branch.last_commit_sha, "a" * 40)
+
+    def test_malformed_payloads(self):
+        response = self._post({"ref": "refs/heads/main", "after": "b" * 40})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["branches"], 0)
+
+        self.assertEqual(self._post(["not", "an", "object"]).status_code, 400)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("accounts.services.resilience.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_opens_after_threshold_then_lets_one_probe_through(self):
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+        self.assertFalse(breaker.record_failure())
+        self.assertFalse(breaker.record_failure())
+        self.assertTrue(breaker.record_failure())
+        self.assertFalse(breaker.allow())
+
+        self.now += 31
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow())
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        breaker.record_failure()
+        self.now += 31
+        self.assertTrue(breaker.allow())
+
+        breaker.record_failure()
+
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.retry_in(), 30)
+
+    def test_success_resets_the_failure_count(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_retry_budget_is_a_share_of_recent_requests(self):
+        budget = RetryBudget(ratio=0.2, min_per_window=2, window=60)
+        for _ in range(20):
+            budget.record_request()
+
+        spent = sum(budget.try_spend() for _ in range(10))
+
+        self.assertEqual(spent, 4)
+        # A new window starts over
+        self.now += 61
+        self.assertTrue(budget.try_spend())
+
+
+class ResilientCallerTests(SimpleTestCase):
+    url = "https://api.github.com/repos/owner/site/git/blobs/" + "a" * 40
+    endpoint = "api.github.com/repos/:owner/:repo/git/blobs"
+
+    def setUp(self):
+        patcher = mock.patch.object(ResilientCaller, "_backoff", lambda self, attempt: 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _caller(self, max_attempts=3, failure_threshold=100, budget_ratio=1.0):
+        return ResilientCaller(
+            max_attempts=max_attempts,
+            base_delay=0.1,
+            max_delay=1,
+            failure_threshold=failure_threshold,
+            reset_timeout=30,
+            budget_ratio=budget_ratio,
+        )
+
+    def _sender(self, *statuses):
+        sent = []
+
+        async def send():
+            status = statuses[min(len(sent), len(statuses) - 1)]
+            sent.append(status)
+            return httpx.Response(status)
+
+        return send, sent
+
+    def test_transient_failures_are_retried(self):
+        send, sent = self._sender(502, 503, 200)
+
+        response = asyncio.run(self._caller().call(self.url, send))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sent, [502, 503, 200])
+
+    def test_retry_false_sends_once(self):
+        send, sent = self._sender(502)
+
+        response = asyncio.run(self._caller().call(self.url, send, retry=False))
+
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(len(sent), 1)
+
+    def test_budget_caps_retries(self):
+        caller = self._caller(max_attempts=5, budget_ratio=0)
+        caller._budget(self.endpoint).min_per_window = 2
+        send, sent = self._sender(500)
+
+        async def run():
+            return [(await caller.call(self.url, send)).status_code for _ in range(2)]
+
+        self.assertEqual(asyncio.run(run()), [500, 500])
+        # Two retries in the window, then every call is sent once
+        self.assertEqual(len(sent), 4)
+        self.assertEqual(caller.stats["retries"], 2)
+        self.assertEqual(caller.stats["budget_exhausted"], 2)
+
+    def test_open_circuit_rejects_without_sending(self):
+        caller = self._caller(max_attempts=1, failure_threshold=2)
+        send, sent = self._sender(500)
+
+        async def run():
+            for _ in range(2):
+                await caller.call(self.url, send)
+            await caller.call(self.url, send)
+
+        with self.assertRaises(CircuitOpenError):
+            asyncio.run(run())
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(caller.stats["circuit_opened"], 1)
+
+    def test_cancelled_probe_is_released(self):
+        caller = self._caller(failure_threshold=1)
+        breaker = caller.breaker(self.endpoint)
+        breaker.record_failure()
+        breaker.opened_at -= 31
+
+        async def run():
+            sending = asyncio.Event()
+
+            async def hang():
+                sending.set()
+                await asyncio.Event().wait()
+
+            probe = asyncio.create_task(caller.call(self.url, hang))
+            await sending.wait()
+            # Only the probe may be in flight while half-open
+            with self.assertRaises(CircuitOpenError):
+                await caller.call(self.url, hang)
+            probe.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await probe
+            send, sent = self._sender(200)
+            return await caller.call(self.url, send)
+
+        self.assertEqual(asyncio.run(run()).status_code, 200)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class SingleFlightTests(SimpleTestCase):
+    url = "https://api.github.com/repos/owner/site/git/trees/main"
+
+    def _client(self):
+        sent = []
+
+        async def handler(request):
+            sent.append(request.headers.get("Authorization"))
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json={"sha": "main"})
+
+        transport = httpx.MockTransport(handler)
+        patcher = mock.patch.object(
+            github_client, "_build_client", lambda: httpx.AsyncClient(transport=transport)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return sent
+
+    def _get_all(self, *calls):
+        async def run():
+            return await asyncio.gather(
+                *(github_client.get(self.url, **kwargs) for kwargs in calls)
+            )
+
+        return asyncio.run(run())
+
+    def test_concurrent_identical_gets_share_one_call(self):
+        sent = self._client()
+
+        responses = self._get_all(*[{"token": "a"}] * 3)
+
+        self.assertEqual(sent, ["Bearer a"])
+        self.assertEqual([r.json() for r in responses], [{"sha": "main"}] * 3)
+
+    def test_calls_are_shared_per_token_unless_public(self):
+        sent = self._client()
+        self._get_all({"token": "a"}, {"token": "b"})
+        self.assertEqual(sorted(sent), ["Bearer a", "Bearer b"])
+
+        sent.clear()
+        self._get_all({"token": "a", "public": True}, {"token": "b", "public": True})
+        self.assertEqual(len(sent), 1)
+
+    def test_posts_are_never_shared(self):
+        sent = self._client()
+
+        async def run():
+            await asyncio.gather(*(github_client.post(self.url, token="a") for _ in range(2)))
+
+        asyncio.run(run())
+        self.assertEqual(len(sent), 2)
+
+    def test_error_reaches_every_waiter(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def fail():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        async def run():
+            return await asyncio.gather(
+                *(flight.do("key", fail) for _ in range(3)), return_exceptions=True
+            )
+
+        results = asyncio.run(run())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([type(r) for r in results], [ValueError] * 3)
+        self.assertEqual(flight.stats, {"calls": 1, "coalesced": 2})
+
+    def test_cancelled_leader_does_not_wedge_followers(self):
+        flight = SingleFlight()
+
+        async def run():
+            started, done = asyncio.Event(), asyncio.Event()
+
+            async def slow():
+                started.set()
+                await done.wait()
+                return "result"
+
+            leader = asyncio.create_task(flight.do("key", slow))
+            await started.wait()
+            follower = asyncio.create_task(flight.do("key", slow))
+            await asyncio.sleep(0)
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            done.set()
+            result = await asyncio.wait_for(follower, 1)
+            # Finished calls are forgotten, the next one runs again
+            again = await flight.do("key", lambda: asyncio.sleep(0, "fresh"))
+            return result, again
+
+        self.assertEqual(asyncio.run(run()), ("result", "fresh"))
+
+
+def _writes(queries) -> list:
+    return [
+        query["sql"]
+        for query in queries
+        if query["sql"].split(None, 1)[0].upper() in {"INSERT", "UPDATE", "DELETE"}
+    ]
+
+
+class UpsertTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username="sync", access_token="token")
+        self.repo = Repository.objects.create(
+            user=user, repo_id=5, name="site", full_name="owner/site"
+        )
+
+    def _branch(self, name, sha, protected=False):
+        return Branch(
+            repository=self.repo,
+            name=name,
+            protected=protected,
+            last_commit_sha=sha,
+            last_commit_url=f"https://api.github.com/commits/{sha}",
+        )
+
+    def _upsert(self, branches):
+        with CaptureQueriesContext(connection) as queries:
+            result = async_to_sync(aupsert)(
+                Branch,
+                branches,
+                unique_fields=["repository", "name"],
+                update_fields=["protected", "last_commit_sha", "last_commit_url"],
+                existing=self.repo.branches.all(),
+            )
+        return result, _writes(queries)
+
+    def test_inserts_new_rows(self):
+        result, writes = self._upsert([self._branch("main", "a" * 40), self._branch("dev", "b" * 40)])
+
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(
+            dict(self.repo.branches.values_list("name", "last_commit_sha")),
+            {"main": "a" * 40, "dev": "b" * 40},
+        )
+        self.assertEqual([branch.name for branch in result], ["main", "dev"])
+
+    def test_only_changed_rows_are_written(self):
+        self._upsert([self._branch("main", "a" * 40), self._branch("dev", "b" * 40)])
+        main = Branch.objects.get(name="main")
+
+        result, writes = self._upsert([self._branch("main", "a" * 40), self._branch("dev", "c" * 40)])
+
+        self.assertEqual(len(writes), 1)
+        self.assertIn("c" * 40, writes[0])
+        self.assertNotIn("a" * 40, writes[0])
+        # Unchanged rows come back as they are stored
+        self.assertEqual(result[0].pk, main.pk)
+        self.assertEqual(Branch.objects.get(name="dev").last_commit_sha, "c" * 40)
+
+        _, writes = self._upsert([self._branch("main", "a" * 40), self._branch("dev", "c" * 40)])
+        self.assertEqual(writes, [])
+
+    def test_branch_sync_deletes_vanished_branches(self):
+        self._upsert([self._branch("main", "a" * 40), self._branch("old", "b" * 40)])
+
+        async_to_sync(GitHubService()._update_branches_in_db)(
+            self.repo, [{"name": "main", "commit": {"sha": "a" * 40, "url": "u"}}]
+        )
+
+        self.assertEqual(list(self.repo.branches.values_list("name", flat=True)), ["main"])
+
+    def test_m2m_sync_changes_only_the_difference(self):
+        keep, drop, add = (Topic.objects.create(name=name) for name in ("keep", "drop", "add"))
+        self.repo.topics.set([keep, drop])
+
+        with CaptureQueriesContext(connection) as queries:
+            async_to_sync(async_sync_m2m)(self.repo.topics, [keep, add])
+
+        self.assertEqual(set(self.repo.topics.values_list("name", flat=True)), {"keep", "add"})
+        self.assertEqual(len(_writes(queries)), 2)
+
+    def test_unchanged_topics_are_not_written(self):
+        sync = async_to_sync(GitHubService()._update_topics_in_db)
+        sync(self.repo, ["django", "python"])
+        self.assertEqual(set(self.repo.topics.values_list("name", flat=True)), {"django", "python"})
+
+        with CaptureQueriesContext(connection) as queries:
+            sync(self.repo, ["python", "django"])
+        self.assertEqual(_writes(queries), [])
+
+        sync(self.repo, ["python", "web"])
+        self.assertEqual(set(self.repo.topics.values_list("name", flat=True)), {"python", "web"})
+        # Topics are shared between repositories and never deleted
+        self.assertTrue(Topic.objects.filter(name="django").exists())
+
+
+def _stored_token(user) -> str:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT access_token FROM accounts_user WHERE id = %s", [user.pk])
+        return cursor.fetchone()[0]
+
+
+class LazyEncryptedFieldTests(TestCase):
+    def setUp(self):
+        decrypted_cache.clear()
+        self.user = User.objects.create(username="enc", access_token="gho_secret")
+        patcher = mock.patch("accounts.fields.decrypt_str", side_effect=decrypt_str)
+        self.decrypt = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stored_encrypted_and_read_back(self):
+        stored = _stored_token(self.user)
+        self.assertNotIn("gho_secret", stored)
+        self.assertEqual(decrypt_str(stored), "gho_secret")
+        self.assertEqual(User.objects.get(pk=self.user.pk).access_token, "gho_secret")
+
+    def test_decrypted_on_first_access_only(self):
+        user = User.objects.get(pk=self.user.pk)
+        self.assertIsInstance(user.__dict__["access_token"], Ciphertext)
+        self.assertTrue(user.has_access_token)
+        self.decrypt.assert_not_called()
+
+        self.assertEqual(user.access_token, "gho_secret")
+        self.assertEqual(user.access_token, "gho_secret")
+        self.assertEqual(self.decrypt.call_count, 1)
+
+        # Loading the row again hits the decrypted value cache
+        self.assertEqual(User.objects.get(pk=self.user.pk).access_token, "gho_secret")
+        self.assertEqual(self.decrypt.call_count, 1)
+
+    def test_saving_without_reading_keeps_the_ciphertext(self):
+        stored = _stored_token(self.user)
+        user = User.objects.get(pk=self.user.pk)
+        user.bio = "hello"
+        user.save()
+
+        self.decrypt.assert_not_called()
+        self.assertEqual(_stored_token(self.user), stored)
+
+    def test_new_token_is_not_served_from_the_cache(self):
+        self.assertEqual(User.objects.get(pk=self.user.pk).access_token, "gho_secret")
+
+        User.objects.filter(pk=self.user.pk).update(access_token=encrypt_str("gho_new").decode())
+
+        self.assertEqual(User.objects.get(pk=self.user.pk).access_token, "gho_new")
+        self.assertEqual(self.decrypt.call_count, 2)
+
+    def test_empty_token_is_stored_empty(self):
+        self.user.access_token = ""
+        self.user.save()
+
+        self.assertEqual(_stored_token(self.user), "")
+        user = User.objects.get(pk=self.user.pk)
+        self.assertFalse(user.has_access_token)
+        self.assertEqual(user.access_token, "")
+        self.decrypt.assert_not_called()
+
+    def test_plaintext_from_before_encryption_is_read_as_is(self):
+        User.objects.filter(pk=self.user.pk).update(access_token="gho_plain")
+        self.assertEqual(User.objects.get(pk=self.user.pk).access_token, "gho_plain")
+
+
+class StoreEmptyTokensMigrationTests(TransactionTestCase):
+    before = [("accounts", "0017_repository_warmup_fields")]
+    after = [("accounts", "0018_store_empty_tokens_unencrypted")]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_encrypted_empty_tokens_are_cleared(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        User = executor.loader.project_state(self.before).apps.get_model("accounts", "User")
+        tokens = {
+            "empty": encrypt_str("").decode(),
+            "token": encrypt_str("gho_x").decode(),
+            "plain": "gho_plain",
+            "blank": "",
+        }
+        users = {name: User.objects.create(username=name) for name in tokens}
+        with connection.cursor() as cursor:
+            for name, stored in tokens.items():
+                cursor.execute(
+                    "UPDATE accounts_user SET access_token = %s WHERE id = %s",
+                    [stored, users[name].pk],
+                )
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.after)
+
+        self.assertEqual(
+            {name: _stored_token(user) for name, user in users.items()},
+            {**tokens, "empty": ""},
+        )
+
+
+def _patch_transport(test, handler):
+    """Send the pooled GitHub client's requests to ``handler`` for this test"""
+    transport = httpx.MockTransport(handler)
+    patcher = mock.patch.object(
+        github_client, "_build_client", lambda: httpx.AsyncClient(transport=transport)
+    )
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+class ConditionalRequestCacheTests(SimpleTestCase):
+    url = "https://api.github.com/user/repos"
+
+    def _cache(self, max_entries=100, max_bytes=1000):
+        return ConditionalRequestCache(max_entries=max_entries, max_bytes=max_bytes, ttl=3600)
+
+    def test_revalidates_with_etag_and_serves_304_from_cache(self):
+        sent = []
+
+        def handler(request):
+            sent.append(request.headers.get("If-None-Match"))
+            if request.headers.get("If-None-Match") == '"v1"':
+                return httpx.Response(304)
+            return httpx.Response(
+                200, json=[{"id": 1}], headers={"ETag": '"v1"', "Link": "<next>; rel=\"next\""}
+            )
+
+        _patch_transport(self, handler)
+        cache = self._cache()
+        service = GitHubService()
+
+        async def twice():
+            return [await service._request("token", self.url) for _ in range(2)]
+
+        with mock.patch("accounts.services.github_service.response_cache", cache):
+            first, second = asyncio.run(twice())
+
+        self.assertEqual(sent, [None, '"v1"'])
+        self.assertEqual(first, second)
+        self.assertEqual(second, ([{"id": 1}], '<next>; rel="next"'))
+        self.assertEqual(cache.stats["hits"], 1)
+        self.assertEqual(cache.stats["misses"], 1)
+
+    def test_entries_are_per_token(self):
+        cache = self._cache()
+        self.assertNotEqual(
+            cache.make_key("a", self.url), cache.make_key("b", self.url)
+        )
+        self.assertNotEqual(
+            cache.make_key("a", self.url, {"page": 1}), cache.make_key("a", self.url, {"page": 2})
+        )
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = self._cache(max_entries=2)
+
+        async def run():
+            await cache.aset("a", "1", "A")
+            await cache.aset("b", "2", "B")
+            await cache.aget("a")
+            await cache.aset("c", "3", "C")
+            return [await cache.aget(key) for key in "abc"]
+
+        a, b, c = asyncio.run(run())
+        self.assertEqual((a.body, b, c.body), ("A", None, "C"))
+        self.assertEqual(cache.stats["evictions"], 1)
+
+    def test_bounded_by_body_bytes(self):
+        cache = self._cache(max_bytes=1000)
+
+        async def run():
+            for key in "abc":
+                await cache.aset(key, "1", key, size=400)
+            # Too large to keep at all, and it pushes nothing else out
+            await cache.aset("huge", "1", "huge", size=5000)
+            return [await cache.aget(key) for key in ("a", "b", "c", "huge")]
+
+        self.assertEqual(
+            [entry and entry.body for entry in asyncio.run(run())], [None, "b", "c", None]
+        )
+        self.assertEqual(cache.stats["bytes"], 800)
+        self.assertEqual(cache.stats["too_large"], 1)
+
+    def test_replacing_an_entry_frees_its_bytes(self):
+        cache = self._cache(max_bytes=1000)
+
+        async def run():
+            await cache.aset("a", "1", "old", size=900)
+            await cache.aset("a", "2", "new", size=100)
+            await cache.aset("b", "1", "b", size=800)
+            return await cache.aget("a")
+
+        self.assertEqual(asyncio.run(run()).body, "new")
+        self.assertEqual(cache.stats["bytes"], 900)
+
+
+class PaginationTests(SimpleTestCase):
+    def _pages(self, pages: dict, fail: set = ()):
+        """Serve /user/repos pages from ``pages``; pages in ``fail`` answer 404 late"""
+        sent = []
+
+        async def handler(request):
+            page = int(request.url.params["page"])
+            sent.append(dict(request.url.params))
+            if page in fail:
+                await asyncio.sleep(0.05)
+                return httpx.Response(404, json={"message": "Not Found"})
+            headers = {}
+            if len(pages) > 1:
+                headers["Link"] = (
+                    f'<https://api.github.com/user/repos?page={page + 1}>; rel="next", '
+                    f'<https://api.github.com/user/repos?page={len(pages)}>; rel="last"'
+                )
+            return httpx.Response(200, json=pages[page], headers=headers)
+
+        _patch_transport(self, handler)
+        return sent
+
+    def test_follows_link_header_to_the_last_page(self):
+        sent = self._pages({1: [{"id": 1}, {"id": 2}], 2: [{"id": 3}], 3: [{"id": 4}]})
+
+        repos = asyncio.run(GitHubService().get_all_repos("token"))
+
+        self.assertEqual(sorted(repo["id"] for repo in repos), [1, 2, 3, 4])
+        self.assertEqual(sorted(params["page"] for params in sent), ["1", "2", "3"])
+        for params in sent:
+            self.assertEqual((params["per_page"], params["sort"]), ("100", "updated"))
+
+    def test_single_page_without_link_header(self):
+        sent = self._pages({1: [{"id": 1}]})
+
+        repos = asyncio.run(GitHubService().get_all_repos("token"))
+
+        self.assertEqual(repos, [{"id": 1}])
+        self.assertEqual(len(sent), 1)
+
+    def test_items_key_unwraps_each_page(self):
+        def handler(request):
+            return httpx.Response(200, json={"names": ["django", "python"]})
+
+        _patch_transport(self, handler)
+
+        topics = asyncio.run(GitHubService().get_repo_topics("token", "owner/site"))
+
+        self.assertEqual(topics, ["django", "python"])
+
+    def test_error_mid_way_returns_pages_fetched_so_far(self):
+        self._pages({1: [{"id": 1}], 2: [{"id": 2}], 3: [], 4: [{"id": 4}]}, fail={3})
+
+        with self.assertLogs("accounts.services.github_service", "ERROR"):
+            repos = asyncio.run(GitHubService().get_all_repos("token"))
+
+        self.assertEqual(sorted(repo["id"] for repo in repos), [1, 2, 4])
+
+    def test_error_on_first_page_returns_nothing(self):
+        self._pages({1: []}, fail={1})
+
+        with self.assertLogs("accounts.services.github_service", "ERROR"):
+            self.assertEqual(asyncio.run(GitHubService().get_all_repos("token")), [])
+
+
+def _graphql_node(branches: dict, topics=("web",), cursor=None) -> dict:
+    """A repository node as the metadata query returns it"""
+    return {
+        "pushedAt": "2026-01-02T03:04:05Z",
+        "viewerPermission": "WRITE",
+        "licenseInfo": {
+            "key": "mit",
+            "name": "MIT License",
+            "spdxId": "MIT",
+            "url": "https://api.github.com/licenses/mit",
+            "id": "L1",
+        },
+        "repositoryTopics": {"nodes": [{"topic": {"name": name}} for name in topics]},
+        "refs": {
+            "pageInfo": {"hasNextPage": cursor is not None, "endCursor": cursor},
+            "nodes": [
+                {
+                    "name": name,
+                    "branchProtectionRule": {"id": "P"} if name == "main" else None,
+                    "target": {"oid": sha},
+                }
+                for name, sha in branches.items()
+            ],
+        },
+    }
+
+
+class GraphQLMetadataTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username="gql", access_token="token")
+        self.repos = [
+            Repository.objects.create(
+                user=user, repo_id=10 + index, name=name, full_name=f"owner/{name}"
+            )
+            for index, name in enumerate(["site", "docs"])
+        ]
+        self.queries = []
+
+    def _respond(self, respond):
+        def handler(request):
+            self.assertEqual(str(request.url), GRAPHQL_URL)
+            body = json.loads(request.content)
+            self.queries.append(body)
+            return httpx.Response(200, json=respond(body))
+
+        _patch_transport(self, handler)
+
+    def _sync(self, repos=None):
+        return async_to_sync(GitHubService().sync_repository_metadata)("token", repos or self.repos)
+
+    def test_batched_query_aliases_each_repository(self):
+        self._respond(
+            lambda body: {
+                "data": {
+                    "r0": _graphql_node({"main": "a" * 40, "dev": "b" * 40}, topics=("web", "css")),
+                    "r1": _graphql_node({"main": "c" * 40}),
+                }
+            }
+        )
+
+        synced = self._sync()
+
+        self.assertEqual(len(self.queries), 1)
+        query, variables = self.queries[0]["query"], self.queries[0]["variables"]
+        self.assertIn("r0: repository(owner: $owner0, name: $name0)", query)
+        self.assertIn("r1: repository(owner: $owner1, name: $name1)", query)
+        self.assertEqual(
+            variables, {"owner0": "owner", "name0": "site", "owner1": "owner", "name1": "docs"}
+        )
+
+        site, docs = self.repos
+        self.assertEqual(
+            {branch.name: branch.last_commit_sha for branch in synced[site.id]},
+            {"main": "a" * 40, "dev": "b" * 40},
+        )
+        self.assertTrue(Branch.objects.get(repository=site, name="main").protected)
+        self.assertFalse(Branch.objects.get(repository=site, name="dev").protected)
+        self.assertEqual(
+            Branch.objects.get(repository=docs, name="main").last_commit_url,
+            f"https://api.github.com/repos/owner/docs/commits/{'c' * 40}",
+        )
+        self.assertEqual(set(site.topics.values_list("name", flat=True)), {"web", "css"})
+        self.assertEqual(License.objects.get(repository=site).spdx_id, "MIT")
+        permission = RepositoryPermission.objects.get(repository=site)
+        self.assertEqual((permission.push, permission.admin), (True, False))
+        site.refresh_from_db()
+        self.assertEqual(site.pushed_at.isoformat(), "2026-01-02T03:04:05+00:00")
+        self.assertIsNotNone(site.metadata_synced_at)
+
+    def test_branches_past_the_first_page_are_fetched_by_cursor(self):
+        def respond(body):
+            if body["variables"].get("cursor") == "page2":
+                return {"data": {"repository": _graphql_node({"dev": "b" * 40})}}
+            return {"data": {"r0": _graphql_node({"main": "a" * 40}, cursor="page2")}}
+
+        self._respond(respond)
+
+        synced = self._sync(self.repos[:1])
+
+        self.assertEqual(self.queries[1]["variables"], {"owner": "owner", "name": "site", "cursor": "page2"})
+        self.assertEqual(sorted(b.name for b in synced[self.repos[0].id]), ["dev", "main"])
+
+    def test_repositories_left_out_by_partial_errors_are_not_synced(self):
+        self._respond(
+            lambda body: {
+                "data": {"r0": None, "r1": _graphql_node({"main": "c" * 40})},
+                "errors": [{"path": ["r0"], "message": "Could not resolve to a Repository"}],
+            }
+        )
+
+        synced = self._sync()
+
+        self.assertEqual(list(synced), [self.repos[1].id])
+        self.assertFalse(self.repos[0].branches.exists())
+
+    def test_incomplete_branch_listing_keeps_stored_branches(self):
+        site = self.repos[0]
+        Branch.objects.create(repository=site, name="dev", last_commit_sha="b" * 40)
+
+        def respond(body):
+            if "cursor" in body["variables"]:
+                return {"data": None, "errors": [{"message": "Something went wrong"}]}
+            return {"data": {"r0": _graphql_node({"main": "a" * 40}, cursor="page2")}}
+
+        self._respond(respond)
+
+        self.assertEqual(self._sync([site]), {})
+        self.assertEqual(list(site.branches.values_list("name", flat=True)), ["dev"])
+
+    def test_nulled_field_skips_the_repository(self):
+        node = _graphql_node({"main": "a" * 40})
+        node["refs"] = None
+        self._respond(lambda body: {"data": {"r0": node}, "errors": [{"path": ["r0", "refs"]}]})
+
+        self.assertEqual(self._sync(self.repos[:1]), {})
@@ -45,7 +45,8 @@ INSTALLED_APPS = [
     'accounts',
     'telegram_bot',
     'preview',
-    'aihub'
+    'aihub',
+    'jobs',
 ]
 
 NINJA_JWT = {
@@ -143,4 +144,125 @@ GITHUB_CLIENT_ID = config("GITHUB_CLIENT_ID")
 GITHUB_CLIENT_SECRET = config("GITHUB_CLIENT_SECRET")
 GITHUB_REDIRECT_URI = config("GITHUB_REDIRECT_URI")
 FIELD_ENCRYPTION_KEY = config("FERNET_KEY")
-SERVER_URL = config("SERVER_URL")
\ No newline at end of file
+SERVER_URL = config("SERVER_URL")
+
+# GITHUB HTTP CLIENT
+# Point at GitHub Enterprise (https://host/api/v3) or a local fake
+GITHUB_API_URL = config("GITHUB_API_URL", default="https://api.github.com").rstrip("/")
+# Git smart HTTP endpoint the packfile fetcher talks to
+GITHUB_GIT_URL = config("GITHUB_GIT_URL", default="https://github.com").rstrip("/")
+GITHUB_HTTP2 = config("GITHUB_HTTP2", default=True, cast=bool)
+GITHUB_HTTP_TIMEOUT = config("GITHUB_HTTP_TIMEOUT", default=10.0, cast=float)
+GITHUB_HTTP_MAX_CONNECTIONS = config("GITHUB_HTTP_MAX_CONNECTIONS", default=20, cast=int)
+GITHUB_HTTP_MAX_KEEPALIVE = config("GITHUB_HTTP_MAX_KEEPALIVE", default=10, cast=int)
+GITHUB_HTTP_KEEPALIVE_EXPIRY = config(
+    "GITHUB_HTTP_KEEPALIVE_EXPIRY", default=30.0, cast=float
+)
+
+# GITHUB RESPONSE CACHE
+GITHUB_CACHE_MAX_ENTRIES = config("GITHUB_CACHE_MAX_ENTRIES", default=2048, cast=int)
+GITHUB_CACHE_MAX_BYTES = config("GITHUB_CACHE_MAX_BYTES", default=64 * 1024 * 1024, cast=int)
+GITHUB_CACHE_TTL = config("GITHUB_CACHE_TTL", default=3600, cast=int)
+GITHUB_CACHE_DB_TIER = config("GITHUB_CACHE_DB_TIER", default=False, cast=bool)
+
+# GITHUB RATE LIMIT SCHEDULER
+GITHUB_INITIAL_CONCURRENCY = config("GITHUB_INITIAL_CONCURRENCY", default=8, cast=int)
+GITHUB_MAX_CONCURRENCY = config("GITHUB_MAX_CONCURRENCY", default=32, cast=int)
+GITHUB_MAX_REQUEUES = config("GITHUB_MAX_REQUEUES", default=5, cast=int)
+
+# GITHUB PAGINATION
+GITHUB_PAGINATION_CONCURRENCY = config(
+    "GITHUB_PAGINATION_CONCURRENCY", default=8, cast=int
+)
+
+# SNAPSHOT INGEST
+SNAPSHOT_INGEST_MODE = config("SNAPSHOT_INGEST_MODE", default="tarball")  # or "blobs"
+SNAPSHOT_BATCH_SIZE = config("SNAPSHOT_BATCH_SIZE", default=500, cast=int)
+# Batches are also cut at this many bytes of file content
+SNAPSHOT_BATCH_MAX_BYTES = config(
+    "SNAPSHOT_BATCH_MAX_BYTES", default=8 * 1024 * 1024, cast=int
+)
+# File contents held in memory by an ingest before writers catch up
+SNAPSHOT_MEMORY_BUDGET = config(
+    "SNAPSHOT_MEMORY_BUDGET", default=64 * 1024 * 1024, cast=int
+)
+SNAPSHOT_FETCH_CONCURRENCY = config("SNAPSHOT_FETCH_CONCURRENCY", default=16, cast=int)
+SNAPSHOT_TREE_CONCURRENCY = config("SNAPSHOT_TREE_CONCURRENCY", default=8, cast=int)
+# "pack" fetches changed files of an update as one git packfile, "api" blob by blob
+SNAPSHOT_FETCH_MODE = config("SNAPSHOT_FETCH_MODE", default="api")
+SNAPSHOT_PACK_SPOOL_BYTES = config(
+    "SNAPSHOT_PACK_SPOOL_BYTES", default=32 * 1024 * 1024, cast=int
+)
+SNAPSHOT_PACK_MAX_HAVES = config("SNAPSHOT_PACK_MAX_HAVES", default=32, cast=int)
+
+# SNAPSHOT COMPRESSION
+# "zstd" (falls back to "zlib" without the zstandard package), "zlib" or "none"
+SNAPSHOT_COMPRESSION = config("SNAPSHOT_COMPRESSION", default="zstd")
+SNAPSHOT_ZSTD_LEVEL = config("SNAPSHOT_ZSTD_LEVEL", default=3, cast=int)
+SNAPSHOT_ZLIB_LEVEL = config("SNAPSHOT_ZLIB_LEVEL", default=6, cast=int)
+# Contents smaller than this are stored as they are
+SNAPSHOT_COMPRESSION_MIN_BYTES = config("SNAPSHOT_COMPRESSION_MIN_BYTES", default=256, cast=int)
+SNAPSHOT_COMPRESSION_WORKERS = config("SNAPSHOT_COMPRESSION_WORKERS", default=4, cast=int)
+SNAPSHOT_COMPRESSION_DICT_SIZE = config(
+    "SNAPSHOT_COMPRESSION_DICT_SIZE", default=112 * 1024, cast=int
+)
+# How often processes look for a newly trained dictionary, in seconds
+SNAPSHOT_COMPRESSION_DICT_REFRESH = config(
+    "SNAPSHOT_COMPRESSION_DICT_REFRESH", default=600, cast=float
+)
+
+# GITHUB RETRIES AND CIRCUIT BREAKER
+GITHUB_RETRY_ATTEMPTS = config("GITHUB_RETRY_ATTEMPTS", default=4, cast=int)
+GITHUB_RETRY_BASE_DELAY = config("GITHUB_RETRY_BASE_DELAY", default=0.5, cast=float)
+GITHUB_RETRY_MAX_DELAY = config("GITHUB_RETRY_MAX_DELAY", default=20.0, cast=float)
+GITHUB_RETRY_BUDGET_RATIO = config("GITHUB_RETRY_BUDGET_RATIO", default=0.2, cast=float)
+GITHUB_CIRCUIT_FAILURE_THRESHOLD = config(
+    "GITHUB_CIRCUIT_FAILURE_THRESHOLD", default=10, cast=int
+)
+GITHUB_CIRCUIT_RESET_TIMEOUT = config(
+    "GITHUB_CIRCUIT_RESET_TIMEOUT", default=30.0, cast=float
+)
+SNAPSHOT_HYDRATION = config("SNAPSHOT_HYDRATION", default="eager")  # or "lazy"
+SNAPSHOT_EAGER_MAX_BYTES = config("SNAPSHOT_EAGER_MAX_BYTES", default=256 * 1024, cast=int)
+SNAPSHOT_REBUILD_DEBOUNCE = config("SNAPSHOT_REBUILD_DEBOUNCE", default=2.0, cast=float)
+
+# REPOSITORY WARM-UP AFTER LOGIN
+REPO_WARMUP_COUNT = config("REPO_WARMUP_COUNT", default=10, cast=int)
+# Leave this many requests of the user's quota untouched
+REPO_WARMUP_MIN_QUOTA = config("REPO_WARMUP_MIN_QUOTA", default=500, cast=int)
+# Branch keyboards render from the DB while metadata is younger than this
+REPO_METADATA_MAX_AGE = config("REPO_METADATA_MAX_AGE", default=900.0, cast=float)
+
+# GITHUB WEBHOOKS
+GITHUB_WEBHOOK_SECRET = config("GITHUB_WEBHOOK_SECRET", default="")
+
+# BACKGROUND JOBS
+JOB_WORKER_CONCURRENCY = config("JOB_WORKER_CONCURRENCY", default=4, cast=int)
+JOB_POLL_INTERVAL = config("JOB_POLL_INTERVAL", default=1.0, cast=float)
+JOB_MAX_ATTEMPTS = config("JOB_MAX_ATTEMPTS", default=3, cast=int)
+JOB_RETRY_BASE_DELAY = config("JOB_RETRY_BASE_DELAY", default=10.0, cast=float)
+JOB_LEASE_TIMEOUT = config("JOB_LEASE_TIMEOUT", default=600.0, cast=float)
+# Speculative jobs (e.g. prebuilding the default branch of a selected repo)
+JOB_SPECULATIVE_PER_USER = config("JOB_SPECULATIVE_PER_USER", default=1, cast=int)
+JOB_SPECULATIVE_SLOTS = config("JOB_SPECULATIVE_SLOTS", default=1, cast=int)
+
+# ACCESS TOKEN DECRYPTION
+DECRYPTED_TOKEN_CACHE_TTL = config("DECRYPTED_TOKEN_CACHE_TTL", default=300.0, cast=float)
+DECRYPTED_TOKEN_CACHE_MAX_ENTRIES = config(
+    "DECRYPTED_TOKEN_CACHE_MAX_ENTRIES", default=1024, cast=int
+)
+
+# GITHUB APP
+# Optional: with an app id and key, repository contents are read with
+# installation tokens instead of the user's OAuth token
+GITHUB_APP_ID = config("GITHUB_APP_ID", default="")
+# PEM private key; newlines may be written as \n in .env
+GITHUB_APP_PRIVATE_KEY = config("GITHUB_APP_PRIVATE_KEY", default="").replace("\\n", "\n")
+# Mint a new installation token this many seconds before the old one expires
+GITHUB_APP_TOKEN_REFRESH_MARGIN = config(
+    "GITHUB_APP_TOKEN_REFRESH_MARGIN", default=300.0, cast=float
+)
+# How long to remember that a repository has no installation
+GITHUB_APP_INSTALLATION_CACHE_TTL = config(
+    "GITHUB_APP_INSTALLATION_CACHE_TTL", default=600.0, cast=float
+)
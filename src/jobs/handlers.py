@@ -0,0 +1,83 @@
+import logging
+
+from accounts.models import Branch, User
+from accounts.services.github_service import GitHubService
+from preview.models import RepositoryCodeState
+from preview.services import hydrate_code_state, update_codebase
+from telegram_bot.utils import notify_user
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+github_service = GitHubService()
+
+
+async def notify_subscribers(job: Job, message: str):
+    """Message every Telegram chat that asked to hear about this job"""
+    # Re-read: chats may have subscribed while the job was running
+    payload = await Job.objects.values_list("payload", flat=True).aget(pk=job.pk)
+    for chat_id in payload.get("notify", []):
+        try:
+            await notify_user(chat_id, message)
+        except Exception:
+            pass  # already logged by notify_user
+
+
+async def run_snapshot(job: Job):
+    """Build or refresh the snapshot of a branch at payload["commit_sha"]"""
+    payload = job.payload
+    branch = await Branch.objects.select_related("repository__user").aget(
+        pk=payload["branch_id"]
+    )
+    commit_sha = payload["commit_sha"]
+
+    # Pushes enqueue one job per head; nobody is waiting on a superseded one
+    if branch.last_commit_sha != commit_sha and not payload.get("notify"):
+        logger.info(f"Skipping snapshot of {branch} at {commit_sha[:8]}, head moved")
+        return
+
+    repo = branch.repository
+    await update_codebase(repo.user, repo, branch, commit_sha, repo.user.access_token)
+    logger.info(f"Snapshot of {branch} is at {commit_sha}")
+    await notify_subscribers(
+        job,
+        f"🌿 Branch set to {branch.name}\nNow run /preview to view your application.",
+    )
+
+
+async def run_sync_repos(job: Job):
+    """Fetch and upsert every repository of a user"""
+    user = await User.objects.aget(pk=job.payload["user_id"])
+    repos = await github_service.get_all_repos(user.access_token)
+    synced = await github_service.update_repository(user, repos)
+    logger.info(f"Repositories synced for {user}: {len(synced)} repositories")
+    try:
+        warmed = await github_service.warm_up_repositories(user, synced)
+        logger.info(f"Warmed up {len(warmed)} repositories for {user}")
+    except Exception as e:
+        # Only a head start; /select_repo syncs whatever isn't warm
+        logger.warning(f"Warm-up failed for {user}: {e}")
+    await notify_subscribers(job, "✅ Your repositories have been synced!")
+
+
+async def run_hydrate_snapshot(job: Job):
+    """Fill in the files a previewable code state is still missing"""
+    code_state = await RepositoryCodeState.objects.select_related(
+        "repository__user"
+    ).filter(pk=job.payload["code_state_id"]).afirst()
+    if code_state is None:
+        logger.info(f"Code state {job.payload['code_state_id']} is gone, nothing to hydrate")
+        return
+    await hydrate_code_state(code_state)
+
+
+HANDLERS = {
+    Job.KIND_SNAPSHOT: run_snapshot,
+    Job.KIND_SYNC_REPOS: run_sync_repos,
+    Job.KIND_HYDRATE_SNAPSHOT: run_hydrate_snapshot,
+}
+
+FAILURE_MESSAGES = {
+    Job.KIND_SNAPSHOT: "❌ Failed to set up the codebase. Please try again.",
+    Job.KIND_SYNC_REPOS: "❌ Failed to sync your repositories. Please try /login again.",
+}
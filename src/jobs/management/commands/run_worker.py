@@ -0,0 +1,37 @@
+import asyncio
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from jobs.worker import Worker
+
+
+class Command(BaseCommand):
+    help = 'Runs a background job worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.JOB_WORKER_CONCURRENCY,
+            help="Jobs run at once by this worker",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.JOB_POLL_INTERVAL,
+            help="Seconds to wait between polls when the queue is empty",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Starting job worker...")
+        asyncio.run(self._run(options["concurrency"], options["poll_interval"]))
+
+    async def _run(self, concurrency, poll_interval):
+        worker = Worker(concurrency=concurrency, poll_interval=poll_interval)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            # Finish the running jobs, claim no new ones
+            loop.add_signal_handler(sig, worker.stop)
+        await worker.run()
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('snapshot', 'Snapshot'), ('sync_repos', 'Sync repositories'), ('hydrate_snapshot', 'Hydrate snapshot')], max_length=50),
+        ),
+    ]
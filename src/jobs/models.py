@@ -0,0 +1,68 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CANCELLED = "cancelled"
+
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_DONE, "Done"),
+        (STATUS_FAILED, "Failed"),
+        (STATUS_CANCELLED, "Cancelled"),
+    ]
+    ACTIVE_STATUSES = [STATUS_QUEUED, STATUS_RUNNING]
+
+    KIND_SNAPSHOT = "snapshot"
+    KIND_SYNC_REPOS = "sync_repos"
+    KIND_HYDRATE_SNAPSHOT = "hydrate_snapshot"
+
+    KIND_CHOICES = [
+        (KIND_SNAPSHOT, "Snapshot"),
+        (KIND_SYNC_REPOS, "Sync repositories"),
+        (KIND_HYDRATE_SNAPSHOT, "Hydrate snapshot"),
+    ]
+
+    # Higher runs first
+    PRIORITY_INTERACTIVE = 10
+    PRIORITY_BACKGROUND = 0
+    # Work started on a guess of what a user will ask for next
+    PRIORITY_SPECULATIVE = -10
+
+    kind = models.CharField(max_length=50, choices=KIND_CHOICES)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED
+    )
+    priority = models.IntegerField(default=PRIORITY_BACKGROUND)
+    # Only one queued or running job may hold a given key
+    dedup_key = models.CharField(max_length=255, null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, null=True, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "-priority", "run_at"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["dedup_key"],
+                condition=models.Q(status__in=["queued", "running"]),
+                name="unique_active_job_dedup_key",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.kind}#{self.pk} ({self.status})"
@@ -0,0 +1,214 @@
+import logging
+import random
+from datetime import timedelta
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_key(branch, commit_sha: str) -> str:
+    """Dedup key of a snapshot job: one per (repository, branch, commit)"""
+    return f"snapshot:{branch.repository_id}:{branch.name}:{commit_sha}"
+
+
+async def enqueue(
+    kind: str,
+    payload: dict,
+    priority: int = Job.PRIORITY_BACKGROUND,
+    dedup_key: Optional[str] = None,
+    delay: float = 0,
+    max_attempts: Optional[int] = None,
+    notify: Optional[int] = None,
+) -> Job:
+    """
+    Queue a job. If a queued or running job already holds ``dedup_key``, that
+    job is returned instead and its priority is raised to ``priority`` if lower.
+    ``notify`` is a Telegram chat to message when the job is done, also when
+    it attaches to an existing job.
+    """
+    if notify is not None:
+        payload = {**payload, "notify": [notify]}
+    job = Job(
+        kind=kind,
+        payload=payload,
+        priority=priority,
+        dedup_key=dedup_key,
+        run_at=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+    )
+    if dedup_key is None:
+        await job.asave()
+        return job
+
+    try:
+        await sync_to_async(_save_atomic)(job)
+        logger.info(f"Queued {job}")
+        return job
+    except IntegrityError:
+        existing = await Job.objects.filter(
+            dedup_key=dedup_key, status__in=Job.ACTIVE_STATUSES
+        ).afirst()
+        if existing is None:
+            # The holder finished in between, try once more
+            await sync_to_async(_save_atomic)(job)
+            return job
+        if existing.priority < priority:
+            await Job.objects.filter(pk=existing.pk, priority__lt=priority).aupdate(
+                priority=priority
+            )
+            existing.priority = priority
+        if notify is not None:
+            await sync_to_async(_subscribe)(existing, notify)
+        logger.info(f"Job {dedup_key} already queued as {existing}")
+        return existing
+
+
+def _save_atomic(job: Job):
+    # Own savepoint so a dedup conflict doesn't break an outer transaction
+    with transaction.atomic():
+        job.save()
+
+
+def _subscribe(job: Job, chat_id: int):
+    with transaction.atomic():
+        payload = (
+            Job.objects.select_for_update()
+            .values_list("payload", flat=True)
+            .get(pk=job.pk)
+        )
+        notify = payload.setdefault("notify", [])
+        if chat_id not in notify:
+            notify.append(chat_id)
+            Job.objects.filter(pk=job.pk).update(payload=payload)
+        job.payload = payload
+
+
+async def speculate(
+    kind: str, payload: dict, dedup_key: str, owner: int
+) -> Optional[Job]:
+    """
+    Queue work on a guess of what user ``owner`` asks for next, at the lowest
+    priority. Their earlier guesses that haven't started are cancelled, and
+    nothing is queued while JOB_SPECULATIVE_PER_USER of them are running.
+    A real request with the same dedup key attaches to the job and raises
+    its priority, after which it no longer counts as speculative.
+    """
+    await cancel_speculative(owner, keep=dedup_key)
+    running = await _speculative(owner).filter(status=Job.STATUS_RUNNING).acount()
+    if running >= settings.JOB_SPECULATIVE_PER_USER:
+        logger.info(f"Not speculating {dedup_key}, {running} guesses already running")
+        return None
+    return await enqueue(
+        kind,
+        {**payload, "speculative_for": owner},
+        priority=Job.PRIORITY_SPECULATIVE,
+        dedup_key=dedup_key,
+    )
+
+
+def _speculative(owner: int):
+    return Job.objects.filter(
+        priority=Job.PRIORITY_SPECULATIVE, payload__speculative_for=owner
+    )
+
+
+async def cancel_speculative(owner: int, keep: Optional[str] = None) -> int:
+    """Cancel the queued guesses of user ``owner``, except the one holding ``keep``"""
+    return await (
+        _speculative(owner)
+        .filter(status=Job.STATUS_QUEUED)
+        .exclude(dedup_key=keep)
+        .aupdate(status=Job.STATUS_CANCELLED, finished_at=timezone.now())
+    )
+
+
+def claim(worker_id: str, min_priority: Optional[int] = None) -> Optional[Job]:
+    """
+    Lock and return the most urgent runnable job, or None.
+    SKIP LOCKED lets any number of workers poll the table without blocking
+    each other. Running jobs whose lease expired (their worker died) are
+    picked up again. With ``min_priority`` less urgent jobs are left queued.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.JOB_LEASE_TIMEOUT)
+    with transaction.atomic():
+        runnable = Job.objects.select_for_update(skip_locked=True).filter(
+            Q(status=Job.STATUS_QUEUED, run_at__lte=now)
+            | Q(status=Job.STATUS_RUNNING, locked_at__lt=stale)
+        )
+        if min_priority is not None:
+            runnable = runnable.filter(priority__gte=min_priority)
+        job = runnable.order_by("-priority", "run_at", "id").first()
+        if job is None:
+            return None
+        job.status = Job.STATUS_RUNNING
+        job.attempts += 1
+        job.locked_by = worker_id
+        job.locked_at = now
+        job.save(
+            update_fields=["status", "attempts", "locked_by", "locked_at", "updated_at"]
+        )
+        return job
+
+
+def heartbeat(worker_id: str, job_ids):
+    """Extend the lease of the jobs this worker is running"""
+    Job.objects.filter(
+        pk__in=job_ids, locked_by=worker_id, status=Job.STATUS_RUNNING
+    ).update(locked_at=timezone.now())
+
+
+def _owned(job: Job):
+    # A job whose lease expired may have been claimed by another worker since
+    return Job.objects.filter(
+        pk=job.pk, status=Job.STATUS_RUNNING, locked_by=job.locked_by
+    )
+
+
+def complete(job: Job):
+    _owned(job).update(
+        status=Job.STATUS_DONE,
+        finished_at=timezone.now(),
+        locked_by=None,
+        updated_at=timezone.now(),
+    )
+
+
+def fail(job: Job, error: str) -> bool:
+    """Record a failure; requeue with jittered exponential backoff if attempts remain"""
+    now = timezone.now()
+    if job.attempts >= job.max_attempts:
+        _owned(job).update(
+            status=Job.STATUS_FAILED,
+            last_error=error,
+            finished_at=now,
+            locked_by=None,
+            updated_at=now,
+        )
+        return False
+
+    delay = settings.JOB_RETRY_BASE_DELAY * 2 ** (job.attempts - 1)
+    delay = random.uniform(delay / 2, delay)
+    _owned(job).update(
+        status=Job.STATUS_QUEUED,
+        last_error=error,
+        run_at=now + timedelta(seconds=delay),
+        locked_by=None,
+        updated_at=now,
+    )
+    return True
+
+
+async def cancel(dedup_key: str) -> int:
+    """Cancel the queued job holding ``dedup_key``; running jobs are left to finish"""
+    return await Job.objects.filter(
+        dedup_key=dedup_key, status=Job.STATUS_QUEUED
+    ).aupdate(status=Job.STATUS_CANCELLED, finished_at=timezone.now())
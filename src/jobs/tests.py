@@ -0,0 +1,136 @@
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from . import queue
+from .models import Job
+from .worker import Worker
+
+
+@override_settings(JOB_LEASE_TIMEOUT=600, JOB_RETRY_BASE_DELAY=10, JOB_MAX_ATTEMPTS=3)
+class JobQueueTests(TestCase):
+    def _job(self, priority=Job.PRIORITY_BACKGROUND, run_in=0, **fields):
+        return Job.objects.create(
+            kind=Job.KIND_SNAPSHOT,
+            priority=priority,
+            run_at=timezone.now() + timedelta(seconds=run_in),
+            **fields,
+        )
+
+    def test_claims_by_priority_then_run_at(self):
+        later = self._job(run_in=-10)
+        earlier = self._job(run_in=-60)
+        urgent = self._job(priority=Job.PRIORITY_INTERACTIVE, run_in=-1)
+        self._job(priority=Job.PRIORITY_INTERACTIVE, run_in=60)  # not due yet
+
+        claimed = [queue.claim("worker") for _ in range(4)]
+
+        self.assertEqual([job and job.pk for job in claimed], [urgent.pk, earlier.pk, later.pk, None])
+        self.assertEqual(claimed[0].status, Job.STATUS_RUNNING)
+        self.assertEqual(claimed[0].attempts, 1)
+        self.assertEqual(claimed[0].locked_by, "worker")
+
+    def test_min_priority_leaves_less_urgent_jobs_queued(self):
+        self._job(priority=Job.PRIORITY_SPECULATIVE)
+
+        self.assertIsNone(queue.claim("worker", min_priority=Job.PRIORITY_BACKGROUND))
+        self.assertIsNotNone(queue.claim("worker"))
+
+    def test_expired_lease_is_reclaimed(self):
+        job = self._job()
+        first = queue.claim("dead")
+        self.assertIsNone(queue.claim("other"))
+
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(seconds=601))
+        second = queue.claim("other")
+
+        self.assertEqual(second.pk, job.pk)
+        self.assertEqual(second.attempts, 2)
+        # The worker that lost the lease can no longer finish the job
+        queue.complete(first)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.STATUS_RUNNING)
+        queue.complete(second)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.STATUS_DONE)
+
+    def test_heartbeat_keeps_the_lease(self):
+        job = self._job()
+        queue.claim("alive")
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(seconds=601))
+
+        queue.heartbeat("alive", [job.pk])
+
+        self.assertIsNone(queue.claim("other"))
+
+    def test_enqueue_deduplicates_active_jobs(self):
+        enqueue = async_to_sync(queue.enqueue)
+        first = enqueue(Job.KIND_SNAPSHOT, {"n": 1}, dedup_key="snapshot:1")
+        again = enqueue(Job.KIND_SNAPSHOT, {"n": 2}, dedup_key="snapshot:1")
+
+        self.assertEqual(again.pk, first.pk)
+        self.assertEqual(Job.objects.count(), 1)
+
+        # A duplicate can raise the priority but never lower it
+        enqueue(Job.KIND_SNAPSHOT, {}, priority=Job.PRIORITY_INTERACTIVE, dedup_key="snapshot:1")
+        enqueue(Job.KIND_SNAPSHOT, {}, priority=Job.PRIORITY_SPECULATIVE, dedup_key="snapshot:1")
+        self.assertEqual(Job.objects.get().priority, Job.PRIORITY_INTERACTIVE)
+
+        # Once the job is finished the key is free again
+        queue.complete(queue.claim("worker"))
+        fresh = enqueue(Job.KIND_SNAPSHOT, {}, dedup_key="snapshot:1")
+        self.assertNotEqual(fresh.pk, first.pk)
+
+    def test_enqueue_subscribes_chats_to_the_existing_job(self):
+        enqueue = async_to_sync(queue.enqueue)
+        enqueue(Job.KIND_SNAPSHOT, {}, dedup_key="snapshot:1", notify=1)
+        enqueue(Job.KIND_SNAPSHOT, {}, dedup_key="snapshot:1", notify=2)
+        enqueue(Job.KIND_SNAPSHOT, {}, dedup_key="snapshot:1", notify=1)
+
+        self.assertEqual(Job.objects.get().payload["notify"], [1, 2])
+
+    def test_failures_back_off_then_give_up(self):
+        job = self._job()
+
+        for attempt in range(1, 3):
+            claimed = queue.claim("worker")
+            self.assertEqual(claimed.attempts, attempt)
+            before = timezone.now()
+            self.assertTrue(queue.fail(claimed, "boom"))
+
+            job.refresh_from_db()
+            self.assertEqual(job.status, Job.STATUS_QUEUED)
+            self.assertEqual(job.last_error, "boom")
+            # Jittered between half and all of 10s * 2 ** (attempt - 1)
+            delay = (job.run_at - before).total_seconds()
+            self.assertGreaterEqual(delay, 5 * 2 ** (attempt - 1) - 1)
+            self.assertLessEqual(delay, 10 * 2 ** (attempt - 1))
+            self.assertIsNone(queue.claim("worker"))
+            Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+
+        self.assertFalse(queue.fail(queue.claim("worker"), "boom"))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertEqual(job.attempts, 3)
+        self.assertIsNotNone(job.finished_at)
+        self.assertIsNone(queue.claim("worker"))
+
+
+class WorkerTests(TestCase):
+    def test_old_connections_are_closed_around_each_job(self):
+        calls = []
+        Job.objects.create(kind=Job.KIND_SNAPSHOT)
+        job = queue.claim("worker")
+
+        async def handler(job):
+            calls.append("handler")
+
+        worker = Worker(concurrency=1, poll_interval=1)
+        with mock.patch.dict("jobs.worker.HANDLERS", {Job.KIND_SNAPSHOT: handler}), mock.patch(
+            "jobs.worker.close_old_connections", lambda: calls.append("close")
+        ):
+            async_to_sync(worker._execute)(job)
+
+        self.assertEqual(calls, ["close", "handler", "close"])
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.STATUS_DONE)
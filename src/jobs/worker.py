@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+import socket
+import traceback
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import queue
+from .handlers import FAILURE_MESSAGES, HANDLERS, notify_subscribers
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    """
+    Polls the job table and runs up to ``concurrency`` jobs at once on one
+    event loop. Scale out by starting more worker processes; SKIP LOCKED keeps
+    them from claiming the same job.
+    """
+
+    def __init__(self, concurrency: int, poll_interval: float):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._running = {}
+        self._jobs = {}
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    async def run(self):
+        logger.info(f"Worker {self.worker_id} started, concurrency {self.concurrency}")
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            while not self._stopping.is_set():
+                claimed = await self._fill_slots()
+                if not claimed:
+                    try:
+                        await asyncio.wait_for(
+                            self._stopping.wait(), timeout=self.poll_interval
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+            if self._running:
+                logger.info(f"Waiting for {len(self._running)} running jobs")
+                await asyncio.gather(*self._running.values(), return_exceptions=True)
+        finally:
+            heartbeat.cancel()
+            logger.info(f"Worker {self.worker_id} stopped")
+
+    async def _fill_slots(self) -> int:
+        claimed = 0
+        while len(self._running) < self.concurrency and not self._stopping.is_set():
+            # Keep slots free for real requests once guesses fill their share
+            min_priority = None
+            if self._speculative >= settings.JOB_SPECULATIVE_SLOTS:
+                min_priority = Job.PRIORITY_BACKGROUND
+            job = await sync_to_async(queue.claim)(self.worker_id, min_priority)
+            if job is None:
+                break
+            claimed += 1
+            self._running[job.pk] = asyncio.create_task(self._execute(job))
+            self._jobs[job.pk] = job
+        if self._running and len(self._running) >= self.concurrency:
+            # Wake up as soon as a slot frees up
+            await asyncio.wait(
+                list(self._running.values()), return_when=asyncio.FIRST_COMPLETED
+            )
+        return claimed
+
+    async def _execute(self, job: Job):
+        handler = HANDLERS.get(job.kind)
+        # As Django does around each request: drop connections that broke or
+        # outlived CONN_MAX_AGE, the worker itself never exits
+        await sync_to_async(close_old_connections)()
+        try:
+            if handler is None:
+                raise ValueError(f"No handler for job kind {job.kind!r}")
+            logger.info(f"Running {job} (attempt {job.attempts}/{job.max_attempts})")
+            await handler(job)
+            await sync_to_async(queue.complete)(job)
+        except Exception as e:
+            logger.error(f"{job} failed: {e}")
+            error = traceback.format_exc()
+            retried = await sync_to_async(queue.fail)(job, error)
+            if not retried and job.kind in FAILURE_MESSAGES:
+                await notify_subscribers(job, FAILURE_MESSAGES[job.kind])
+        finally:
+            self._running.pop(job.pk, None)
+            self._jobs.pop(job.pk, None)
+            await sync_to_async(close_old_connections)()
+
+    @property
+    def _speculative(self) -> int:
+        return sum(
+            job.priority == Job.PRIORITY_SPECULATIVE for job in self._jobs.values()
+        )
+
+    async def _heartbeat(self):
+        interval = settings.JOB_LEASE_TIMEOUT / 3
+        while True:
+            await asyncio.sleep(interval)
+            if self._running:
+                await sync_to_async(queue.heartbeat)(
+                    self.worker_id, list(self._running)
+                )
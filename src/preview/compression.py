@@ -0,0 +1,163 @@
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Optional, Tuple
+
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:  # zlib only
+    zstandard = None
+
+NONE = ""
+ZLIB = "zlib"
+ZSTD = "zstd"
+
+
+class BlobCodec:
+    """
+    Compresses blob contents for storage: zstd, primed with a dictionary
+    trained on stored blobs when there is one, else zlib. Contents too small
+    to gain anything, or that don't shrink, are stored as they are.
+
+    Both zstd and zlib release the GIL, so ``compress_many`` really runs on
+    ``workers`` threads. zstd (de)compressors are not thread-safe and are
+    kept per thread.
+    """
+
+    def __init__(
+        self,
+        codec: str,
+        zstd_level: int,
+        zlib_level: int,
+        min_bytes: int,
+        workers: int,
+    ):
+        if codec == ZSTD and zstandard is None:
+            codec = ZLIB
+        self.codec = codec
+        self.zstd_level = zstd_level
+        self.zlib_level = zlib_level
+        self.min_bytes = min_bytes
+        self.workers = workers
+        self._dictionaries = {}  # id -> zstandard.ZstdCompressionDict
+        self._local = threading.local()
+        self._pool = None
+        self._pool_guard = threading.Lock()
+        self._counters = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, **amounts):
+        with self._lock:
+            self._counters.update(amounts)
+
+    def dictionary(self, dictionary_id: int, load: Callable[[], bytes]):
+        """The zstd dictionary with this id; ``load`` returns its bytes on first use"""
+        found = self._dictionaries.get(dictionary_id)
+        if found is None:
+            found = zstandard.ZstdCompressionDict(bytes(load()))
+            self._dictionaries[dictionary_id] = found
+        return found
+
+    def _zstd(self, kind: str, dictionary_id: Optional[int], dictionary):
+        cache = self._local.__dict__.setdefault(kind, {})
+        found = cache.get(dictionary_id)
+        if found is None:
+            if kind == "compressors":
+                found = zstandard.ZstdCompressor(level=self.zstd_level, dict_data=dictionary)
+            else:
+                found = zstandard.ZstdDecompressor(dict_data=dictionary)
+            cache[dictionary_id] = found
+        return found
+
+    def compress(
+        self, data: bytes, dictionary_id: Optional[int] = None, dictionary=None
+    ) -> Tuple[str, Optional[int], bytes]:
+        """
+        Returns (codec, dictionary id, stored bytes). ``dictionary`` is only
+        used by zstd; the id is None when it wasn't.
+        """
+        if self.codec == NONE or len(data) < self.min_bytes:
+            return NONE, None, data
+
+        started = time.perf_counter()
+        if self.codec == ZSTD:
+            if dictionary is None:
+                dictionary_id = None
+            compressed = self._zstd("compressors", dictionary_id, dictionary).compress(data)
+            codec = ZSTD
+        else:
+            compressed = zlib.compress(data, self.zlib_level)
+            codec, dictionary_id = ZLIB, None
+        self._count(
+            compressed=1,
+            bytes_in=len(data),
+            bytes_out=min(len(compressed), len(data)),
+            compress_ns=int((time.perf_counter() - started) * 1e9),
+        )
+
+        if len(compressed) >= len(data):
+            self._count(incompressible=1)
+            return NONE, None, data
+        return codec, dictionary_id, compressed
+
+    def decompress(self, codec: str, data: bytes, dictionary_id: Optional[int] = None, dictionary=None) -> bytes:
+        if codec == NONE:
+            return data
+        started = time.perf_counter()
+        if codec == ZSTD:
+            result = self._zstd("decompressors", dictionary_id, dictionary).decompress(data)
+        elif codec == ZLIB:
+            result = zlib.decompress(data)
+        else:
+            raise ValueError(f"Unknown blob codec {codec!r}")
+        self._count(
+            decompressed=1,
+            decompress_ns=int((time.perf_counter() - started) * 1e9),
+        )
+        return result
+
+    def compress_many(self, jobs: Iterable[Callable]) -> list:
+        """Run compression jobs (no-argument callables) on the worker threads"""
+        jobs = list(jobs)
+        if len(jobs) < 2 or self.workers < 2:
+            return [job() for job in jobs]
+        with self._pool_guard:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="blob-codec"
+                )
+        return list(self._pool.map(lambda job: job(), jobs))
+
+    def train(self, samples: list, size: int) -> bytes:
+        """Train a zstd dictionary on sample contents"""
+        if zstandard is None:
+            raise RuntimeError("zstandard is not installed")
+        return zstandard.train_dictionary(size, samples).as_bytes()
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        compress_ns = counters.pop("compress_ns", 0)
+        decompress_ns = counters.pop("decompress_ns", 0)
+        bytes_in = counters.get("bytes_in", 0)
+        return {
+            **counters,
+            "codec": self.codec,
+            "ratio": round(bytes_in / counters["bytes_out"], 2) if bytes_in else None,
+            "compress_ms": round(compress_ns / 1e6, 3),
+            "decompress_ms": round(decompress_ns / 1e6, 3),
+        }
+
+
+blob_codec = BlobCodec(
+    codec=settings.SNAPSHOT_COMPRESSION,
+    zstd_level=settings.SNAPSHOT_ZSTD_LEVEL,
+    zlib_level=settings.SNAPSHOT_ZLIB_LEVEL,
+    min_bytes=settings.SNAPSHOT_COMPRESSION_MIN_BYTES,
+    workers=settings.SNAPSHOT_COMPRESSION_WORKERS,
+)
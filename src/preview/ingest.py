@@ -0,0 +1,123 @@
+import asyncio
+from typing import Callable, Iterable
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+# Rough per-row cost beyond the content itself: model instance, path, SHA
+ROW_OVERHEAD = 512
+
+_FLUSH = object()
+_DONE = object()
+
+
+def row_bytes(row) -> int:
+    """Estimated memory a RepositoryFile row holds until it is written"""
+    # Content rides along in a Blob not stored yet; held blobs are only a SHA
+    blob = row._meta.get_field("blob").get_cached_value(row, None)
+    content = blob.content if blob is not None else row.content
+    return len(content or "") + ROW_OVERHEAD
+
+
+class IngestWriter:
+    """
+    Consumer end of an ingest pipeline. Producers ``put`` rows as contents
+    arrive; one writer task flushes them in batches of at most ``max_rows``
+    rows or ``max_bytes`` content bytes, each batch in its own transaction.
+
+    Rows count against ``budget`` from ``put`` until their batch is written,
+    and ``put`` waits while the budget is spent, so producers can never run
+    more than ``budget`` bytes ahead of the database. A row larger than the
+    whole budget is let through once nothing else is held.
+
+    Used as ``async with IngestWriter(...) as writer``; leaving the block
+    writes what is left and raises the first write error, if any.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[list], None],
+        max_rows: int,
+        max_bytes: int,
+        budget: int,
+    ):
+        self.write = write
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.budget = budget
+        self.rows_written = 0
+        self.peak_held = 0
+        self._held = 0
+        self._queue = asyncio.Queue()
+        self._room = asyncio.Condition()
+        self._error = None
+        self._task = None
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            return False
+        self._queue.put_nowait(_DONE)
+        await self._task
+        if self._error is not None:
+            raise self._error
+        return False
+
+    def _fits(self, size: int) -> bool:
+        return self._error is not None or not self._held or self._held + size <= self.budget
+
+    async def put(self, row, size: int = None):
+        size = row_bytes(row) if size is None else size
+        async with self._room:
+            if not self._fits(size):
+                # Have the writer flush what it holds instead of waiting for a full batch
+                self._queue.put_nowait(_FLUSH)
+                await self._room.wait_for(lambda: self._fits(size))
+            if self._error is not None:
+                raise self._error
+            self._held += size
+            self.peak_held = max(self.peak_held, self._held)
+        self._queue.put_nowait((row, size))
+
+    async def put_many(self, rows: Iterable):
+        for row in rows:
+            await self.put(row)
+
+    async def _run(self):
+        batch, batch_bytes = [], 0
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is _DONE or item is _FLUSH:
+                    await self._flush(batch, batch_bytes)
+                    batch, batch_bytes = [], 0
+                    if item is _DONE:
+                        return
+                    continue
+                row, size = item
+                batch.append(row)
+                batch_bytes += size
+                if len(batch) >= self.max_rows or batch_bytes >= self.max_bytes:
+                    await self._flush(batch, batch_bytes)
+                    batch, batch_bytes = [], 0
+        except Exception as e:
+            self._error = e
+            async with self._room:
+                self._room.notify_all()
+
+    async def _flush(self, batch: list, batch_bytes: int):
+        if batch:
+            await sync_to_async(self._write_atomic)(batch)
+            self.rows_written += len(batch)
+        async with self._room:
+            self._held -= batch_bytes
+            self._room.notify_all()
+
+    def _write_atomic(self, batch: list):
+        with transaction.atomic():
+            self.write(batch)
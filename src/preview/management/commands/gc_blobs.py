@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from preview.models import Blob, RepositoryFile
+
+
+class Command(BaseCommand):
+    help = "Delete blobs no file points at anymore"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--recount",
+            action="store_true",
+            help="Recompute every blob's reference count from the file rows first",
+        )
+
+    def handle(self, *args, **options):
+        if options["recount"]:
+            references = (
+                RepositoryFile.objects.filter(blob=OuterRef("pk"))
+                .values("blob")
+                .annotate(count=Count("id"))
+                .values("count")
+            )
+            updated = Blob.objects.update(ref_count=Coalesce(Subquery(references), 0))
+            self.stdout.write(f"Recounted references of {updated} blobs")
+
+        # The count can be stale for a moment while an ingest is writing
+        referenced = RepositoryFile.objects.filter(blob=OuterRef("pk"))
+        deleted, _ = (
+            Blob.objects.filter(ref_count=0)
+            .exclude(Exists(referenced))
+            .delete()
+        )
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} unreferenced blobs"))
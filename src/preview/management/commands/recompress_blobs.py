@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from preview.compression import NONE, ZSTD, blob_codec
+from preview.models import Blob, BlobDictionary
+
+
+class Command(BaseCommand):
+    help = "Compress stored blobs in batches, optionally training a new zstd dictionary first"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument(
+            "--train",
+            action="store_true",
+            help="Train a new dictionary on a sample of stored blobs first",
+        )
+        parser.add_argument(
+            "--samples",
+            type=int,
+            default=2000,
+            help="Number of text blobs to train the dictionary on",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Also recompress blobs that are compressed already (e.g. with an older dictionary)",
+        )
+
+    def handle(self, *args, **options):
+        if options["train"]:
+            self._train(options["samples"])
+
+        # Look up the latest dictionary now rather than when the cache expires
+        BlobDictionary._current = None
+        dictionary_id, dictionary = BlobDictionary.current()
+        blobs = Blob.objects.all() if options["all"] else Blob.objects.filter(codec=NONE)
+        fields = ["content", "data", "codec", "dictionary", "stored_bytes"]
+
+        last_sha, count, before, after = "", 0, 0, 0
+        while True:
+            batch = list(
+                blobs.filter(sha__gt=last_sha).order_by("sha")[: options["batch_size"]]
+            )
+            if not batch:
+                break
+            last_sha = batch[-1].sha
+            before += sum(self._stored_size(blob) for blob in batch)
+            blob_codec.compress_many(
+                lambda blob=blob: blob.pack(dictionary_id, dictionary) for blob in batch
+            )
+            with transaction.atomic():
+                Blob.objects.bulk_update(batch, fields)
+            after += sum(blob.stored_bytes for blob in batch)
+            count += len(batch)
+            self.stdout.write(f"{count} blobs: {before} -> {after} bytes")
+
+        ratio = f"{before / after:.2f}x" if after else "n/a"
+        self.stdout.write(
+            self.style.SUCCESS(f"Recompressed {count} blobs, {before} -> {after} bytes ({ratio})")
+        )
+        self.stdout.write(str(blob_codec.stats))
+
+    @staticmethod
+    def _stored_size(blob) -> int:
+        if blob.codec == NONE:
+            return len(blob.content.encode("utf-8"))
+        return len(blob.data)
+
+    def _train(self, samples: int):
+        if blob_codec.codec != ZSTD:
+            raise CommandError("Dictionaries are only used with zstd compression")
+        sample = [
+            blob.get_bytes()
+            for blob in Blob.objects.filter(is_binary=False).order_by("sha")[:samples]
+        ]
+        try:
+            data = blob_codec.train(sample, settings.SNAPSHOT_COMPRESSION_DICT_SIZE)
+        except Exception as e:
+            raise CommandError(f"Could not train a dictionary on {len(sample)} blobs: {e}")
+        dictionary = BlobDictionary.objects.create(data=data, sample_count=len(sample))
+        self.stdout.write(f"Trained dictionary {dictionary.pk} ({len(data)} bytes) on {len(sample)} blobs")
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preview', '0005_repositoryfile_repository'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repositoryfile',
+            name='blob_sha',
+            field=models.CharField(blank=True, db_index=True, help_text='Git blob SHA of the file content', max_length=40, null=True),
+        ),
+    ]
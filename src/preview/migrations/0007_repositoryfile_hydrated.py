@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preview', '0006_repositoryfile_blob_sha'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repositoryfile',
+            name='hydrated',
+            field=models.BooleanField(default=True, help_text='False while the content has not been fetched from GitHub yet'),
+        ),
+    ]
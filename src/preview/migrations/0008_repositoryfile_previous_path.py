@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preview', '0007_repositoryfile_hydrated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repositoryfile',
+            name='previous_path',
+            field=models.CharField(blank=True, help_text='Path the file had in the previous code state, for renames', max_length=500, null=True),
+        ),
+        migrations.AlterField(
+            model_name='repositoryfile',
+            name='change_type',
+            field=models.CharField(choices=[('added', 'Added'), ('modified', 'Modified'), ('removed', 'Removed'), ('renamed', 'Renamed'), ('unchanged', 'Unchanged')], default='unchanged', max_length=20),
+        ),
+    ]
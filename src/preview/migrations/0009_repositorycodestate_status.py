@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:46
+
+from django.db import migrations, models
+
+
+def mark_existing_complete(apps, schema_editor):
+    # Code states built before progressive ingest were stored in full
+    RepositoryCodeState = apps.get_model("preview", "RepositoryCodeState")
+    RepositoryCodeState.objects.update(status="complete")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preview', '0008_repositoryfile_previous_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repositorycodestate',
+            name='entry_path',
+            field=models.CharField(blank=True, help_text='Page the preview opens on', max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name='repositorycodestate',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('previewable', 'Previewable'), ('complete', 'Complete')], default='pending', help_text='Previewable once the entry page and its assets are stored', max_length=20),
+        ),
+        migrations.RunPython(mark_existing_complete, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preview', '0009_repositorycodestate_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('sha', models.CharField(max_length=40, primary_key=True, serialize=False)),
+                ('content', models.TextField(help_text='UTF-8 text, or base64 for binary files')),
+                ('is_binary', models.BooleanField(default=False)),
+                ('size_bytes', models.PositiveIntegerField(default=0)),
+                ('ref_count', models.PositiveIntegerField(default=0, help_text='Number of file rows pointing at this blob')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='repositoryfile',
+            name='blob',
+            field=models.ForeignKey(blank=True, help_text='Stored content; empty while the file is pending', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='files', to='preview.blob'),
+        ),
+    ]
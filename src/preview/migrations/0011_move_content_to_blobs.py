@@ -0,0 +1,75 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:58
+
+import base64
+import hashlib
+
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 500
+
+
+def _blob_sha(content, is_binary):
+    data = base64.b64decode(content) if is_binary else content.encode("utf-8")
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def move_content_to_blobs(apps, schema_editor):
+    # Rows stored their content inline; share it through one blob per SHA
+    Blob = apps.get_model("preview", "Blob")
+    RepositoryFile = apps.get_model("preview", "RepositoryFile")
+
+    last_id = 0
+    while True:
+        rows = list(
+            RepositoryFile.objects.filter(id__gt=last_id, content__isnull=False)
+            .order_by("id")[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        blobs = {}
+        for row in rows:
+            sha = row.blob_sha or _blob_sha(row.content, row.is_binary)
+            blobs.setdefault(
+                sha,
+                Blob(
+                    sha=sha,
+                    content=row.content,
+                    is_binary=row.is_binary,
+                    size_bytes=row.size_bytes,
+                ),
+            )
+            row.blob_sha = row.blob_id = sha
+            row.content = None
+        Blob.objects.bulk_create(blobs.values(), ignore_conflicts=True)
+        RepositoryFile.objects.bulk_update(rows, ["blob_sha", "blob", "content"])
+        last_id = rows[-1].id
+
+    references = (
+        RepositoryFile.objects.filter(blob=OuterRef("pk"))
+        .values("blob")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    Blob.objects.update(ref_count=Coalesce(Subquery(references), 0))
+
+
+def move_content_inline(apps, schema_editor):
+    RepositoryFile = apps.get_model("preview", "RepositoryFile")
+    Blob = apps.get_model("preview", "Blob")
+    RepositoryFile.objects.filter(blob__isnull=False).update(
+        content=Subquery(Blob.objects.filter(pk=OuterRef("blob")).values("content")),
+        blob=None,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preview', '0010_blob'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_content_to_blobs, move_content_inline),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.4 on 2026-10-17 05:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preview', '0011_move_content_to_blobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlobDictionary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField()),
+                ('sample_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='codec',
+            field=models.CharField(blank=True, choices=[('', 'None'), ('zlib', 'zlib'), ('zstd', 'zstd')], default='', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='data',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='stored_bytes',
+            field=models.PositiveIntegerField(default=0, help_text='Bytes the content takes up in the database'),
+        ),
+        migrations.AlterField(
+            model_name='blob',
+            name='content',
+            field=models.TextField(blank=True, default='', help_text='UTF-8 text, or base64 for binary files; empty when compressed'),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='dictionary',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='blobs', to='preview.blobdictionary'),
+        ),
+    ]
@@ -1,6 +1,13 @@
+import base64
+import time
+
+from django.conf import settings
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Greatest
 from accounts.models import Repository
 from accounts.models import Branch
+from .compression import NONE, ZSTD, blob_codec
 
 
 class RepositoryCodeState(models.Model):
@@ -8,6 +15,11 @@ class RepositoryCodeState(models.Model):
     Represents the current state of code for a specific repository.
     """
 
+    STATUS_PENDING = "pending"
+    STATUS_PREVIEWABLE = "previewable"
+    STATUS_COMPLETE = "complete"
+    VISIBLE_STATUSES = [STATUS_PREVIEWABLE, STATUS_COMPLETE]
+
     repository = models.ForeignKey(
         Repository,
         on_delete=models.CASCADE,
@@ -24,6 +36,22 @@ class RepositoryCodeState(models.Model):
     )
     commit_sha = models.CharField(max_length=40, db_index=True, null=True)
     is_initial = models.BooleanField(default=False)
+    status = models.CharField(
+        max_length=20,
+        choices=[
+            (STATUS_PENDING, "Pending"),
+            (STATUS_PREVIEWABLE, "Previewable"),
+            (STATUS_COMPLETE, "Complete"),
+        ],
+        default=STATUS_PENDING,
+        help_text="Previewable once the entry page and its assets are stored",
+    )
+    entry_path = models.CharField(
+        max_length=500,
+        null=True,
+        blank=True,
+        help_text="Page the preview opens on",
+    )
     created_at = models.DateTimeField(
         auto_now_add=True, help_text="Timestamp when the record was created"
     )
@@ -39,6 +67,147 @@ class RepositoryCodeState(models.Model):
         return f"Code state for {self.repository.name} ({self.commit_sha[:8]})"
 
 
+class BlobDictionary(models.Model):
+    """
+    zstd dictionary trained on stored blobs. New blobs are compressed with
+    the latest one; blobs keep pointing at the one they were compressed with.
+    """
+
+    data = models.BinaryField()
+    sample_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # (dictionary id, zstd dictionary, checked at) shared by the process
+    _current = None
+
+    def __str__(self):
+        return f"Dictionary {self.pk} ({len(self.data)} bytes, {self.sample_count} samples)"
+
+    @classmethod
+    def current(cls):
+        """(id, zstd dictionary) of the latest dictionary, or (None, None); checked every few minutes"""
+        cached = cls._current
+        if cached is not None and cached[2] + settings.SNAPSHOT_COMPRESSION_DICT_REFRESH > time.monotonic():
+            return cached[0], cached[1]
+        latest = cls.objects.order_by("-created_at", "-pk").values("pk", "data").first()
+        if latest is None or blob_codec.codec != ZSTD:
+            cls._current = (None, None, time.monotonic())
+        else:
+            cls._current = (
+                latest["pk"],
+                blob_codec.dictionary(latest["pk"], lambda: latest["data"]),
+                time.monotonic(),
+            )
+        return cls._current[0], cls._current[1]
+
+    @classmethod
+    def load(cls, dictionary_id):
+        return blob_codec.dictionary(
+            dictionary_id,
+            lambda: cls.objects.values_list("data", flat=True).get(pk=dictionary_id),
+        )
+
+
+class Blob(models.Model):
+    """
+    File content stored once, keyed by its git blob SHA and shared by every
+    file row (across code states, branches and users) that has it.
+    """
+
+    sha = models.CharField(max_length=40, primary_key=True)
+    content = models.TextField(
+        blank=True,
+        default="",
+        help_text="UTF-8 text, or base64 for binary files; empty when compressed",
+    )
+    # Raw file bytes, compressed with ``codec``
+    data = models.BinaryField(null=True, blank=True)
+    codec = models.CharField(
+        max_length=8,
+        blank=True,
+        default=NONE,
+        choices=[(NONE, "None"), ("zlib", "zlib"), ("zstd", "zstd")],
+    )
+    dictionary = models.ForeignKey(
+        BlobDictionary,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="blobs",
+    )
+    stored_bytes = models.PositiveIntegerField(
+        default=0, help_text="Bytes the content takes up in the database"
+    )
+    is_binary = models.BooleanField(default=False)
+    size_bytes = models.PositiveIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(
+        default=0, help_text="Number of file rows pointing at this blob"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha[:8]} ({self.size_bytes} bytes, {self.ref_count} refs)"
+
+    def get_bytes(self) -> bytes:
+        """The file's raw bytes, decompressed on first use"""
+        raw = getattr(self, "_raw", None)
+        if raw is None:
+            if self.codec == NONE:
+                raw = base64.b64decode(self.content) if self.is_binary else self.content.encode("utf-8")
+            else:
+                dictionary = BlobDictionary.load(self.dictionary_id) if self.dictionary_id else None
+                raw = blob_codec.decompress(self.codec, bytes(self.data), self.dictionary_id, dictionary)
+            self._raw = raw
+        return raw
+
+    def get_content(self) -> str:
+        """UTF-8 text, or base64 for binary files"""
+        if self.codec == NONE:
+            return self.content
+        raw = self.get_bytes()
+        return base64.b64encode(raw).decode("ascii") if self.is_binary else raw.decode("utf-8")
+
+    def pack(self, dictionary_id=None, dictionary=None):
+        """Compress the content into ``data``, or leave it inline when that doesn't pay off"""
+        raw = self.get_bytes()
+        codec, dictionary_id, stored = blob_codec.compress(raw, dictionary_id, dictionary)
+        if codec == NONE:
+            self.content = self.get_content()
+            self.data = None
+            self.dictionary_id = None
+            self.stored_bytes = len(self.content) if self.is_binary else len(raw)
+        else:
+            self.content = ""
+            self.data = stored
+            self.dictionary_id = dictionary_id
+            self.stored_bytes = len(stored)
+        self.codec = codec
+        # Keep only the stored form while the blob waits to be written
+        self._raw = None
+        return self
+
+    @staticmethod
+    def pack_many(blobs):
+        """Compress blobs with the latest dictionary on the codec's worker threads"""
+        dictionary_id, dictionary = BlobDictionary.current()
+        blob_codec.compress_many(
+            lambda blob=blob: blob.pack(dictionary_id, dictionary) for blob in blobs
+        )
+
+    @staticmethod
+    def adjust_ref_counts(counts, delta=1):
+        """Add ``delta`` references per count in ``counts`` ({blob sha: count})"""
+        by_count = {}
+        for sha, count in counts.items():
+            if sha:
+                by_count.setdefault(count, []).append(sha)
+        for count, shas in by_count.items():
+            for start in range(0, len(shas), 500):
+                Blob.objects.filter(sha__in=shas[start : start + 500]).update(
+                    ref_count=Greatest(F("ref_count") + delta * count, 0)
+                )
+
+
 class RepositoryFile(models.Model):
     repository = models.ForeignKey(
         Repository,
@@ -54,6 +223,13 @@ class RepositoryFile(models.Model):
         help_text="The code state this file belongs to",
     )
     path = models.CharField(max_length=500)
+    blob_sha = models.CharField(
+        max_length=40,
+        null=True,
+        blank=True,
+        db_index=True,
+        help_text="Git blob SHA of the file content",
+    )
     file_type = models.CharField(
         max_length=10,
         choices=[("html", "HTML"), ("css", "CSS"), ("js", "JavaScript")],
@@ -61,18 +237,38 @@ class RepositoryFile(models.Model):
         blank=True,
     )
     size_bytes = models.PositiveIntegerField(default=0)
+    blob = models.ForeignKey(
+        Blob,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="files",
+        help_text="Stored content; empty while the file is pending",
+    )
+    # Inline content of rows stored before blobs were shared
     content = models.TextField(null=True, blank=True)
     is_binary = models.BooleanField(default=False)
+    hydrated = models.BooleanField(
+        default=True,
+        help_text="False while the content has not been fetched from GitHub yet",
+    )
     change_type = models.CharField(
         max_length=20,
         choices=[
             ("added", "Added"),
             ("modified", "Modified"),
             ("removed", "Removed"),
+            ("renamed", "Renamed"),
             ("unchanged", "Unchanged"),
         ],
         default="unchanged",
     )
+    previous_path = models.CharField(
+        max_length=500,
+        null=True,
+        blank=True,
+        help_text="Path the file had in the previous code state, for renames",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -88,19 +284,30 @@ class RepositoryFile(models.Model):
     def save(self, *args, **kwargs):
         # Auto-detect type
         if not self.file_type or self.file_type == "other":
-            ext = self.get_file_extension()
-            self.file_type = {
-                "html": "html",
-                "htm": "html",
-                "css": "css",
-                "js": "js",
-                "jsx": "js",
-            }.get(ext, "other")
+            self.file_type = self.detect_file_type(self.path)
 
         # Calculate size
-        self.size_bytes = len(self.content.encode("utf-8"))
+        if self.content is not None:
+            self.size_bytes = len(self.content.encode("utf-8"))
 
         super().save(*args, **kwargs)
 
+    def get_content(self):
+        """The file's content, from its blob or the legacy inline column"""
+        if self.blob_id is not None:
+            return self.blob.get_content()
+        return self.content
+
     def get_file_extension(self):
         return self.path.split(".")[-1].lower() if "." in self.path else ""
+
+    @staticmethod
+    def detect_file_type(path):
+        ext = path.split(".")[-1].lower() if "." in path else ""
+        return {
+            "html": "html",
+            "htm": "html",
+            "css": "css",
+            "js": "js",
+            "jsx": "js",
+        }.get(ext, "other")
@@ -0,0 +1,92 @@
+import logging
+import tempfile
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from dulwich.client import HttpGitClient
+from dulwich.object_format import SHA1
+from dulwich.pack import PackData, PackInflater
+
+logger = logging.getLogger(__name__)
+
+
+class _HaveWalker:
+    """
+    Graph walker that advertises a fixed list of commits as "have".
+    We keep file contents, not git objects, so there is no history to walk:
+    the server works out everything reachable from these commits itself.
+    """
+
+    def __init__(self, haves: Iterable[str]):
+        self._haves = iter([sha.encode("ascii") for sha in haves])
+        self.acked = set()
+
+    def __next__(self) -> Optional[bytes]:
+        return next(self._haves, None)
+
+    next = __next__
+
+    def ack(self, sha: bytes):
+        self.acked.add(sha)
+
+    def nak(self):
+        pass
+
+
+def _client(token: Optional[str]) -> HttpGitClient:
+    credentials = {"username": "x-access-token", "password": token} if token else {}
+    return HttpGitClient(
+        f"{settings.GITHUB_GIT_URL}/",
+        # Thin packs may delta against objects we only claim to have
+        thin_packs=False,
+        quiet=True,
+        timeout=settings.GITHUB_HTTP_TIMEOUT,
+        **credentials,
+    )
+
+
+def fetch_pack_blobs(
+    full_name: str,
+    token: Optional[str],
+    want: str,
+    haves: Iterable[str],
+    blob_shas: Iterable[str],
+) -> Dict[str, bytes]:
+    """
+    Fetch commit ``want`` over git smart HTTP in a single packfile, telling
+    the server which commits we already hold so it only sends new objects.
+    Returns the contents of the blobs in ``blob_shas`` the pack contained;
+    blobs reachable from a "have" are left out by the server.
+
+    Blocking; run it in a thread.
+    """
+    blob_shas = set(blob_shas)
+    walker = _HaveWalker(haves)
+    with tempfile.SpooledTemporaryFile(
+        max_size=settings.SNAPSHOT_PACK_SPOOL_BYTES
+    ) as spool:
+        _client(token).fetch_pack(
+            f"{full_name}.git",
+            lambda refs, depth=None: [want.encode("ascii")],
+            walker,
+            spool.write,
+        )
+        size = spool.tell()
+        if not size:
+            return {}
+        spool.seek(0)
+
+        blobs = {}
+        pack = PackData.from_file(spool, SHA1, size)
+        for obj in PackInflater.for_pack_data(pack):
+            if obj.type_name != b"blob":
+                continue
+            sha = obj.id.decode("ascii")
+            if sha in blob_shas:
+                blobs[sha] = obj.as_raw_string()
+
+    logger.info(
+        f"{full_name}@{want[:8]}: {size} byte pack, {len(blobs)}/{len(blob_shas)} "
+        f"wanted blobs, {len(walker.acked)} haves acknowledged"
+    )
+    return blobs
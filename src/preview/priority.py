@@ -0,0 +1,79 @@
+import posixpath
+import re
+from typing import Iterable, List, Optional
+from urllib.parse import unquote, urlsplit
+
+# Where static sites and common build setups keep their entry page, best first
+ENTRY_PAGE_CANDIDATES = [
+    "index.html",
+    "index.htm",
+    "public/index.html",
+    "src/index.html",
+    "docs/index.html",
+    "dist/index.html",
+    "build/index.html",
+]
+
+_HTML_REF = re.compile(
+    r"""<(?:link|script|img|source|video|audio|iframe|embed|input)\b[^>]*?"""
+    r"""\s(?:src|href|poster)\s*=\s*(?P<q>["']?)(?P<url>[^"'\s>]+)(?P=q)""",
+    re.IGNORECASE,
+)
+_HTML_SRCSET = re.compile(r"""\ssrcset\s*=\s*(["'])(?P<urls>[^"']+)\1""", re.IGNORECASE)
+_CSS_URL = re.compile(r"""url\(\s*(["']?)(?P<url>[^)"']+)\1\s*\)""", re.IGNORECASE)
+_CSS_IMPORT = re.compile(r"""@import\s+(["'])(?P<url>[^"']+)\1""", re.IGNORECASE)
+
+
+def find_entry_page(paths: Iterable[str]) -> Optional[str]:
+    """Pick the page a preview opens on: a known location, else the shallowest HTML file"""
+    paths = set(paths)
+    for candidate in ENTRY_PAGE_CANDIDATES:
+        if candidate in paths:
+            return candidate
+    pages = [p for p in paths if p.lower().endswith((".html", ".htm"))]
+    if not pages:
+        return None
+    return min(pages, key=lambda p: (p.count("/"), p))
+
+
+def extract_references(text: str, kind: str) -> List[str]:
+    """Raw asset URLs referenced by an HTML page or a stylesheet"""
+    if kind == "css":
+        return [m.group("url") for m in _CSS_IMPORT.finditer(text)] + [
+            m.group("url") for m in _CSS_URL.finditer(text)
+        ]
+    refs = [m.group("url") for m in _HTML_REF.finditer(text)]
+    for match in _HTML_SRCSET.finditer(text):
+        refs.extend(part.split()[0] for part in match.group("urls").split(",") if part.strip())
+    # Inline <style> blocks and style attributes
+    refs.extend(m.group("url") for m in _CSS_URL.finditer(text))
+    return refs
+
+
+def resolve_reference(
+    ref: str, base_path: str, paths, site_root: str = ""
+) -> Optional[str]:
+    """
+    Map a URL found in ``base_path`` to a file of the tree, or None for
+    external URLs and files that don't exist. Root-absolute URLs are tried
+    against the repo root and against ``site_root`` (the entry page's
+    directory), since sites served from public/ or docs/ use them that way.
+    """
+    parts = urlsplit(ref.strip())
+    if parts.scheme or parts.netloc or not parts.path:
+        return None
+    url_path = unquote(parts.path)
+    base_dir = posixpath.dirname(base_path)
+
+    if url_path.startswith("/"):
+        candidates = [url_path.lstrip("/"), posixpath.join(site_root, url_path.lstrip("/"))]
+    else:
+        candidates = [posixpath.join(base_dir, url_path)]
+
+    for candidate in candidates:
+        candidate = posixpath.normpath(candidate)
+        if candidate.startswith(".."):
+            continue
+        if candidate in paths:
+            return candidate
+    return None
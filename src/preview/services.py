@@ -1,55 +1,564 @@
 from .models import *
-import httpx
 import base64
 import asyncio
+import codecs
+import hashlib
 import logging
+import posixpath
+import threading
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from accounts.services.github_app import github_app
+from accounts.services.github_client import GITHUB_API_URL, github_client
+from accounts.services.single_flight import request_key, single_flight
+from .ingest import IngestWriter
+from .packfetch import fetch_pack_blobs
+from .priority import extract_references, find_entry_page, resolve_reference
+from .tarball import iter_tarball_files
+from .trees import TreeStreamParser, diff_trees, iter_tree_entries
 
 async def _make_request(
-    access_token: str, url: str, params: dict = None, headers: dict = None
+    access_token: str,
+    url: str,
+    params: dict = None,
+    headers: dict = None,
+    public: bool = False,
 ) -> dict:
-    headers = {"Accept": "application/vnd.github.v3+json"}
     """Async helper method to make GitHub API requests"""
     if headers is None:
-        headers = {**headers, "Authorization": f"Bearer {access_token}"}
-    else:
-        headers = {**headers, "Authorization": f"Bearer {access_token}"}
+        headers = {"Accept": "application/vnd.github.v3+json"}
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, headers=headers, params=params, timeout=10)
-        response.raise_for_status()
-        return response.json()
+    response = await github_client.get(
+        url, token=access_token, headers=headers, params=params, public=public
+    )
+    response.raise_for_status()
+    return response.json()
 
 
-async def get_file_content(owner, repo, path, ref, token):
-    url = f"https://api.github.com/repos/{owner}/{repo}/contents/{path}?ref={ref}"
+def _decode_content(data: bytes):
+    """Return (content, is_binary); binary files are kept base64 encoded"""
     try:
-        data = await _make_request(url=url, access_token=token)
-        if data.get("encoding") == "base64":
-            decoded = base64.b64decode(data["content"])
-            try:
-                decoded_text = decoded.decode("utf-8")
-                return decoded_text, False  # not binary
-            except UnicodeDecodeError:
-                return None, True  # binary file
-        return None, True
-    except Exception as e:
-        logging.error(f"Failed to fetch content for {path}: {str(e)}")
-        return None, True
+        return data.decode("utf-8"), False  # not binary
+    except UnicodeDecodeError:
+        return base64.b64encode(data).decode("ascii"), True  # binary file
+
+
+def git_blob_sha(data: bytes) -> str:
+    """SHA-1 git assigns to a blob with this content"""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def _blob_from_bytes(blob_sha, data: bytes) -> dict:
+    content, is_binary = _decode_content(data)
+    return {
+        "blob_sha": blob_sha,
+        "content": content,
+        "is_binary": is_binary,
+        "size_bytes": len(data),
+    }
+
+
+def _pending_blob(blob_sha, size) -> dict:
+    """Placeholder for a blob whose content is fetched on first request"""
+    return {
+        "blob_sha": blob_sha,
+        "content": None,
+        "is_binary": False,
+        "size_bytes": size or 0,
+        "hydrated": False,
+    }
+
+
+def _new_blob(blob: dict) -> Blob:
+    return Blob(
+        sha=blob["blob_sha"],
+        content=blob["content"],
+        is_binary=blob["is_binary"],
+        size_bytes=blob["size_bytes"],
+    )
+
+
+def _attach_blob(file, blob: dict):
+    """Point a file row at its content: a new Blob to store, or one already held"""
+    if blob.get("content") is not None:
+        file.blob = _new_blob(blob)
+    elif file.hydrated:
+        file.blob_id = blob["blob_sha"]
+    return file
+
+
+def _build_file(repo_obj, code_state, path, blob: dict, change_type):
+    file = RepositoryFile(
+        repository=repo_obj,
+        code_state=code_state,
+        path=path,
+        blob_sha=blob["blob_sha"],
+        is_binary=blob["is_binary"],
+        file_type=RepositoryFile.detect_file_type(path),
+        size_bytes=blob["size_bytes"],
+        hydrated=blob.get("hydrated", True),
+        change_type=change_type,
+    )
+    return _attach_blob(file, blob)
+
+
+def _is_eager(path, size):
+    """Small files and the types a preview needs are fetched up front"""
+    return (size or 0) <= settings.SNAPSHOT_EAGER_MAX_BYTES or (
+        RepositoryFile.detect_file_type(path) != "other"
+    )
+
+
+async def get_blob_content(full_name, blob_sha, token):
+    """
+    Fetch a blob by SHA, pinned to exact content rather than a moving branch.
+    The raw media type skips the base64 JSON envelope (and its 1 MB limit); bytes
+    are validated as UTF-8 incrementally while they stream in.
+    """
+    url = f"{GITHUB_API_URL}/repos/{full_name}/git/blobs/{blob_sha}"
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks, text_parts = [], []
+    is_text = True
+
+    async with github_client.stream(
+        "GET", url, token=token, headers={"Accept": "application/vnd.github.raw"}
+    ) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            chunks.append(chunk)
+            if is_text:
+                try:
+                    text_parts.append(decoder.decode(chunk))
+                except UnicodeDecodeError:
+                    is_text = False
+                    text_parts = []
+
+    size = sum(len(chunk) for chunk in chunks)
+    if is_text:
+        try:
+            text_parts.append(decoder.decode(b"", final=True))
+            return {
+                "blob_sha": blob_sha,
+                "content": "".join(text_parts),
+                "is_binary": False,
+                "size_bytes": size,
+            }
+        except UnicodeDecodeError:
+            pass
+
+    return {
+        "blob_sha": blob_sha,
+        "content": base64.b64encode(b"".join(chunks)).decode("ascii"),
+        "is_binary": True,
+        "size_bytes": size,
+    }
+
+
+async def _load_known_blobs(blob_shas) -> dict:
+    """Stored blobs with their content, keyed by blob SHA; for small sets"""
+    blob_shas = list(set(blob_shas))
+    known = {}
+    for start in range(0, len(blob_shas), 500):
+        rows = [
+            row async for row in Blob.objects.filter(sha__in=blob_shas[start : start + 500])
+        ]
+        # Decompressed off the event loop
+        contents = await sync_to_async(lambda: [row.get_content() for row in rows])()
+        for row, content in zip(rows, contents):
+            known[row.sha] = {
+                "blob_sha": row.sha,
+                "content": content,
+                "is_binary": row.is_binary,
+                "size_bytes": row.size_bytes,
+            }
+    return known
 
 
-async def _fetch_contents(owner, repo, paths, branch_name, github_token):
-    """Fetch multiple file contents in parallel"""
+async def _iter_held_blobs(blob_shas):
+    """
+    Yield the blobs we already hold, without their content: rows only need
+    to point at them, so nothing is read or written again.
+    """
+    blob_shas = list(set(blob_shas))
+    for start in range(0, len(blob_shas), 500):
+        rows = Blob.objects.filter(sha__in=blob_shas[start : start + 500]).values(
+            "sha", "is_binary", "size_bytes"
+        )
+        async for row in rows.aiterator(chunk_size=500):
+            yield {
+                "blob_sha": row["sha"],
+                "is_binary": row["is_binary"],
+                "size_bytes": row["size_bytes"],
+            }
+
+
+async def _fetch_blobs(full_name, blob_shas, github_token) -> dict:
+    """
+    Fetch blobs in parallel, skipping the ones we already hold.
+    Concurrency is bounded by the per-token rate limit scheduler in the GitHub client.
+    """
+    blob_shas = set(blob_shas)
+    blobs = await _load_known_blobs(blob_shas)
+    missing = [sha for sha in blob_shas if sha not in blobs]
+    logging.info(
+        f"{full_name}: reusing {len(blobs)} stored blobs, fetching {len(missing)}"
+    )
+
+    # Errors have already been retried by the GitHub client; the first one that
+    # still fails aborts the snapshot instead of storing a broken file
     tasks = [
-        get_file_content(owner, repo, path, branch_name, github_token) for path in paths
+        asyncio.create_task(get_blob_content(full_name, sha, github_token))
+        for sha in missing
     ]
-    return await asyncio.gather(*tasks)
+    try:
+        fetched = await asyncio.gather(*tasks)
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        raise
+    blobs.update(zip(missing, fetched))
+    return blobs
 
 
-async def create_initial_snapshot(user, repo_obj, branch_obj, commit_sha, github_token):
-    owner = user.github_login
-    repo = repo_obj.name
+async def _stream_blobs(full_name, blob_shas, github_token):
+    """
+    Yield (blob_sha, blob) as downloads finish, with at most
+    SNAPSHOT_FETCH_CONCURRENCY in flight. A slow consumer holds back new
+    downloads, so finished but unconsumed blobs stay bounded too.
+    """
+    remaining = iter(blob_shas)
+    in_flight = {}
+
+    def start_more():
+        for sha in remaining:
+            task = asyncio.create_task(get_blob_content(full_name, sha, github_token))
+            in_flight[task] = sha
+            if len(in_flight) >= settings.SNAPSHOT_FETCH_CONCURRENCY:
+                break
+
+    start_more()
+    try:
+        while in_flight:
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield in_flight.pop(task), task.result()
+            start_more()
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+
+def _writer(write) -> IngestWriter:
+    return IngestWriter(
+        write,
+        max_rows=settings.SNAPSHOT_BATCH_SIZE,
+        max_bytes=settings.SNAPSHOT_BATCH_MAX_BYTES,
+        budget=settings.SNAPSHOT_MEMORY_BUDGET,
+    )
+
+
+def _store_new_blobs(rows):
+    """Insert the Blobs attached to rows; ones somebody else stored meanwhile are kept"""
+    new = {}
+    for row in rows:
+        blob = RepositoryFile.blob.field.get_cached_value(row, None)
+        if blob is not None:
+            new.setdefault(blob.sha, blob)
+    Blob.pack_many(new.values())
+    Blob.objects.bulk_create(new.values(), ignore_conflicts=True)
+
+
+def _insert_files(rows):
+    _store_new_blobs(rows)
+    RepositoryFile.objects.bulk_create(rows)
+    Blob.adjust_ref_counts(Counter(row.blob_id for row in rows))
+
+
+def _update_contents(rows):
+    # Only rows still pending are updated, they held no reference before. One
+    # hydrated on demand meanwhile already counts as a reference and is left be
+    pending = set(
+        RepositoryFile.objects.select_for_update()
+        .filter(pk__in=[row.pk for row in rows], hydrated=False)
+        .values_list("pk", flat=True)
+    )
+    rows = [row for row in rows if row.pk in pending]
+    _store_new_blobs(rows)
+    RepositoryFile.objects.bulk_update(rows, ["blob", "is_binary", "size_bytes", "hydrated"])
+    Blob.adjust_ref_counts(Counter(row.blob_id for row in rows))
+
+
+async def _fetch_pack(repo_obj, new_sha, blob_shas, github_token) -> dict:
+    """
+    Fetch the given blobs of new_sha as one packfile, advertising the commits
+    of the repo's stored code states as "have". Returns what the pack held;
+    anything else (or everything, if the fetch fails) is left to the blob API.
+    """
+    if settings.SNAPSHOT_FETCH_MODE != "pack" or not blob_shas:
+        return {}
+    haves = [
+        sha
+        async for sha in RepositoryCodeState.objects.filter(repository=repo_obj)
+        .exclude(commit_sha=new_sha)
+        .order_by("-created_at")
+        .values_list("commit_sha", flat=True)[: settings.SNAPSHOT_PACK_MAX_HAVES]
+    ]
+    try:
+        packed = await asyncio.to_thread(
+            fetch_pack_blobs, repo_obj.full_name, github_token, new_sha, haves, blob_shas
+        )
+    except Exception as e:
+        logging.warning(f"{repo_obj.full_name}: pack fetch failed, using blob API: {e!r}")
+        return {}
+    return {sha: _blob_from_bytes(sha, data) for sha, data in packed.items()}
+
+
+async def _read_tree(full_name, tree_sha, github_token, recursive, public=False):
+    """
+    Stream one git/trees listing and return (entries, truncated).
+    Identical concurrent listings share one download.
+    """
+    url = f"{GITHUB_API_URL}/repos/{full_name}/git/trees/{tree_sha}"
+    if recursive:
+        url += "?recursive=1"
+    headers = {"Accept": "application/vnd.github.v3+json"}
+
+    async def read():
+        parser = TreeStreamParser()
+        async with github_client.stream(
+            "GET", url, token=github_token, headers=headers
+        ) as response:
+            response.raise_for_status()
+            entries = [
+                entry
+                async for entry in iter_tree_entries(response.aiter_text(), parser)
+                if entry.type in ("blob", "tree")
+            ]
+        return entries, parser.truncated
+
+    key = request_key("GET", url, None, headers, github_token, public)
+    return await single_flight.do(key, read)
+
+
+async def _fetch_tree(full_name, commit_sha, github_token, public=False):
+    """
+    Return {path: (blob_sha, size)} for the commit's whole tree.
+    The recursive listing is parsed as it streams in. When GitHub truncates
+    it, the directory is listed on its own level and every subdirectory is
+    walked concurrently by tree SHA, so large monorepos come in complete.
+    """
+    tree = {}
+    semaphore = asyncio.Semaphore(settings.SNAPSHOT_TREE_CONCURRENCY)
+
+    async def walk(tree_sha, prefix, recursive=True):
+        async with semaphore:
+            entries, truncated = await _read_tree(
+                full_name, tree_sha, github_token, recursive, public
+            )
+        if truncated and recursive:
+            logging.info(f"Tree {full_name}:{prefix or '/'} is truncated, walking subtrees")
+            return await walk(tree_sha, prefix, recursive=False)
+        if truncated:
+            logging.warning(f"Directory {full_name}:{prefix} is too large to list")
+
+        subtrees = []
+        for entry in entries:
+            path = prefix + entry.path
+            if entry.type == "blob":
+                tree[path] = (entry.sha, entry.size)
+            elif not recursive:
+                subtrees.append((entry.sha, path + "/"))
+
+        tasks = [asyncio.create_task(walk(sha, path)) for sha, path in subtrees]
+        try:
+            await asyncio.gather(*tasks)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    await walk(commit_sha, "")
+    return tree
+
+
+def _reference_kind(path):
+    lower = path.lower()
+    if lower.endswith((".html", ".htm")):
+        return "html"
+    if lower.endswith(".css"):
+        return "css"
+    return None
+
+
+async def _fetch_critical(full_name, tree, github_token):
+    """
+    Fetch what a first preview needs, in order: the entry page, then the assets
+    it references, then whatever its stylesheets pull in.
+    Returns (entry_path, blobs keyed by SHA).
+    """
+    entry_path = find_entry_page(tree)
+    if entry_path is None:
+        return None, {}
+    site_root = posixpath.dirname(entry_path)
+
+    blobs = {}
+    seen = {entry_path}
+    wave = [entry_path]
+    # entry page -> its assets -> stylesheet imports and images
+    for _ in range(3):
+        if not wave:
+            break
+        blobs.update(
+            await _fetch_blobs(full_name, [tree[path][0] for path in wave], github_token)
+        )
+        next_wave = []
+        for path in wave:
+            blob = blobs[tree[path][0]]
+            kind = _reference_kind(path)
+            if kind is None or blob["is_binary"]:
+                continue
+            for ref in extract_references(blob["content"], kind):
+                target = resolve_reference(ref, path, tree, site_root)
+                if target is not None and target not in seen:
+                    seen.add(target)
+                    next_wave.append(target)
+        wave = next_wave
+
+    logging.info(f"{full_name}: {len(seen)} files needed to preview {entry_path}")
+    return entry_path, blobs
+
+
+async def _schedule_hydration(code_state):
+    """Queue the background job that fills in a code state's pending files"""
+    # Imported here, the jobs app's handlers import this module
+    from jobs.models import Job
+    from jobs.queue import enqueue
+
+    await enqueue(
+        Job.KIND_HYDRATE_SNAPSHOT,
+        {"code_state_id": code_state.id},
+        dedup_key=f"hydrate_snapshot:{code_state.id}",
+    )
+
+
+async def _mark_ingested(code_state, entry_path=None):
+    """Previewable while files are pending, complete once none are"""
+    has_pending = await code_state.files.filter(hydrated=False).aexists()
+    code_state.entry_path = entry_path or code_state.entry_path
+    code_state.status = (
+        RepositoryCodeState.STATUS_PREVIEWABLE
+        if has_pending
+        else RepositoryCodeState.STATUS_COMPLETE
+    )
+    await code_state.asave(update_fields=["entry_path", "status", "updated_at"])
+    if has_pending:
+        await _schedule_hydration(code_state)
+
+
+async def _fill_from_tarball(repo_obj, code_state, pending, github_token, writer):
+    """
+    Stream the commit's tarball and store the contents of pending files.
+    One request for the whole tree instead of one per file. Export attributes
+    (export-subst, eol) can make a member differ from its blob: those stay
+    pending for the blob API rather than entering the shared blob store.
+    """
+    url = f"{GITHUB_API_URL}/repos/{repo_obj.full_name}/tarball/{code_state.commit_sha}"
+
+    async with github_client.stream(
+        "GET", url, token=github_token
+    ) as response:
+        response.raise_for_status()
+        async for path, data in iter_tarball_files(response.aiter_bytes()):
+            if path not in pending:
+                continue
+            file_id, blob_sha, _ = pending[path]
+            if git_blob_sha(data) != blob_sha:
+                logging.info(f"{repo_obj.full_name}: archived {path} differs from its blob")
+                continue
+            del pending[path]
+            await writer.put(_hydrated_row(file_id, _blob_from_bytes(blob_sha, data)))
+
+
+async def _fill_from_blobs(repo_obj, pending, github_token, writer):
+    """Fetch the pending files' blobs, storing each as soon as it arrives"""
+    files_by_sha = {}
+    for file_id, blob_sha, _ in pending.values():
+        files_by_sha.setdefault(blob_sha, []).append(file_id)
+    async for blob_sha, blob in _stream_blobs(
+        repo_obj.full_name, list(files_by_sha), github_token
+    ):
+        await writer.put_many(
+            _hydrated_row(file_id, blob) for file_id in files_by_sha[blob_sha]
+        )
+
+
+def _hydrated_row(file_id, blob):
+    file = RepositoryFile(
+        pk=file_id,
+        is_binary=blob["is_binary"],
+        size_bytes=blob["size_bytes"],
+        hydrated=True,
+    )
+    return _attach_blob(file, blob)
+
+
+async def hydrate_code_state(code_state):
+    """
+    Fill in the files a code state was stored without, then mark it complete.
+    With lazy hydration, large files a preview doesn't need stay pending until
+    somebody requests them.
+    """
+    repo_obj = code_state.repository
+    pending = {}
+    rows = code_state.files.filter(hydrated=False).values_list(
+        "path", "id", "blob_sha", "size_bytes"
+    )
+    async for path, file_id, blob_sha, size in rows:
+        if settings.SNAPSHOT_HYDRATION != "lazy" or _is_eager(path, size):
+            pending[path] = (file_id, blob_sha, size)
+
+    logging.info(f"Hydrating {len(pending)} pending files of {code_state}")
+    github_token = await github_app.token_for_repo(
+        repo_obj.full_name, repo_obj.user.access_token
+    )
+    async with _writer(_update_contents) as writer:
+        # Blobs another snapshot stored meanwhile only need to be pointed at
+        files_by_sha = {}
+        for path, (file_id, blob_sha, _) in pending.items():
+            files_by_sha.setdefault(blob_sha, []).append((path, file_id))
+        async for blob in _iter_held_blobs(files_by_sha):
+            for path, file_id in files_by_sha[blob["blob_sha"]]:
+                del pending[path]
+                await writer.put(_hydrated_row(file_id, blob))
+
+        if pending and settings.SNAPSHOT_INGEST_MODE == "tarball":
+            await _fill_from_tarball(repo_obj, code_state, pending, github_token, writer)
+        # Also picks up anything the tarball didn't contain
+        if pending:
+            await _fill_from_blobs(repo_obj, pending, github_token, writer)
+    logging.info(
+        f"Hydrated {writer.rows_written} files of {code_state}, "
+        f"peak {writer.peak_held} bytes held"
+    )
+
+    await RepositoryCodeState.objects.filter(pk=code_state.pk).aupdate(
+        status=RepositoryCodeState.STATUS_COMPLETE
+    )
+    code_state.status = RepositoryCodeState.STATUS_COMPLETE
+
 
+async def create_initial_snapshot(user, repo_obj, branch_obj, commit_sha, github_token):
+    """
+    Store a commit progressively. The entry page and the assets it references
+    are fetched first and every other file is recorded as pending, so the code
+    state becomes previewable in seconds; a background job fills in the rest.
+    Rows are written in bounded batches as they are produced.
+    """
     # Create initial code state
+    await _discard_unfinished(repo_obj, branch_obj, commit_sha)
     code_state = await RepositoryCodeState.objects.acreate(
         repository=repo_obj,
         branch=branch_obj,
@@ -57,51 +566,229 @@ async def create_initial_snapshot(user, repo_obj, branch_obj, commit_sha, github
         is_initial=True,
     )
 
-    # Get repo tree (recursive)
-    tree_url = f"https://api.github.com/repos/{owner}/{repo}/git/trees/{commit_sha}?recursive=1"
-    tree_data = await _make_request(url=tree_url, access_token=github_token)
+    try:
+        tree = await _fetch_tree(
+            repo_obj.full_name, commit_sha, github_token, public=not repo_obj.private
+        )
+        entry_path, blobs = await _fetch_critical(repo_obj.full_name, tree, github_token)
+
+        unstored = {}
+        for path, (sha, _) in tree.items():
+            unstored.setdefault(sha, []).append((path, "added"))
+
+        async with _writer(_insert_files) as writer:
+            for sha, blob in blobs.items():
+                await writer.put_many(
+                    _files_for_blob(repo_obj, code_state, unstored.pop(sha), blob)
+                )
+            # Files we already hold from other snapshots cost nothing to store now
+            async for blob in _iter_held_blobs(unstored):
+                await writer.put_many(
+                    _files_for_blob(repo_obj, code_state, unstored.pop(blob["blob_sha"]), blob)
+                )
+            for sha, paths in unstored.items():
+                await writer.put_many(
+                    _files_for_blob(
+                        repo_obj, code_state, paths, _pending_blob(sha, tree[paths[0][0]][1])
+                    )
+                )
+    except Exception:
+        # Don't leave a half-filled code state behind, it would never be rebuilt
+        await code_state.adelete()
+        raise
 
-    # Collect all file paths first
-    file_paths = [
-        item["path"] for item in tree_data.get("tree", []) if item["type"] == "blob"
+    await _mark_ingested(code_state, entry_path)
+    return code_state
+
+
+def _files_for_blob(repo_obj, code_state, paths, blob: dict):
+    """Rows for every (path, change_type) holding this blob"""
+    return [
+        _build_file(repo_obj, code_state, path, blob, change_type)
+        for path, change_type in paths
     ]
 
-    # Fetch all contents in parallel
-    contents = await _fetch_contents(
-        owner, repo, file_paths, branch_obj.name, github_token
+
+async def _stored_tree(code_state) -> dict:
+    """{path: blob_sha} of a stored code state, without removed entries"""
+    tree, legacy = {}, []
+    rows = code_state.files.exclude(change_type="removed").values_list(
+        "path", "blob_sha"
     )
+    async for path, blob_sha in rows:
+        if blob_sha:
+            tree[path] = blob_sha
+        else:
+            legacy.append(path)
 
-    # Prepare files for bulk creation
-    files_to_create = [
-        RepositoryFile(
-            repository=repo_obj,
-            code_state=code_state,
-            path=path,
-            content=content if not is_binary else None,
-            is_binary=is_binary,
-            change_type="added",
+    # Files stored before blob SHAs were recorded: hash their content
+    for start in range(0, len(legacy), 1000):
+        rows = code_state.files.filter(path__in=legacy[start : start + 1000]).values_list(
+            "path", "content", "is_binary"
         )
-        for path, (content, is_binary) in zip(file_paths, contents)
-    ]
+        async for path, content, is_binary in rows:
+            if content is None:
+                # Binary or failed files were stored without content, so we can't
+                # tell what they held. No real SHA is empty: they diff as changed.
+                tree[path] = ""
+                continue
+            data = base64.b64decode(content) if is_binary else content.encode("utf-8")
+            tree[path] = git_blob_sha(data)
+    return tree
+
+
+async def _copy_files(repo_obj, old_state, code_state, old_tree, diff, writer):
+    """Carry unchanged and renamed files over from the previous code state"""
+    sources = {path: (path, "unchanged", None) for path in diff.unchanged}
+    sources.update(
+        (old_path, (new_path, "renamed", old_path)) for old_path, new_path in diff.renamed
+    )
+    old_paths = list(sources)
+
+    for start in range(0, len(old_paths), settings.SNAPSHOT_BATCH_SIZE):
+        rows = old_state.files.filter(
+            path__in=old_paths[start : start + settings.SNAPSHOT_BATCH_SIZE]
+        )
+        async for row in rows.aiterator(chunk_size=100):
+            path, change_type, previous_path = sources[row.path]
+            await writer.put(
+                RepositoryFile(
+                    repository=repo_obj,
+                    code_state=code_state,
+                    path=path,
+                    blob_sha=old_tree[row.path],
+                    blob_id=row.blob_id,
+                    content=row.content,
+                    is_binary=row.is_binary,
+                    file_type=RepositoryFile.detect_file_type(path),
+                    size_bytes=row.size_bytes,
+                    hydrated=row.hydrated,
+                    change_type=change_type,
+                    previous_path=previous_path,
+                )
+            )
+
+
+async def _store_changed(repo_obj, code_state, new_tree, changed, lazy_shas, github_token, writer):
+    """
+    Store added and modified files: from storage when we hold the blob, else
+    from a packfile or the blob API as each one arrives. Large files under
+    lazy hydration are recorded as pending.
+    """
+    unstored = {}
+    for path, change_type in changed:
+        unstored.setdefault(new_tree[path][0], []).append((path, change_type))
+
+    async def store(blob):
+        paths = unstored.pop(blob["blob_sha"])
+        await writer.put_many(_files_for_blob(repo_obj, code_state, paths, blob))
+
+    async for blob in _iter_held_blobs(unstored):
+        await store(blob)
+    packed = await _fetch_pack(
+        repo_obj, code_state.commit_sha, set(unstored) - lazy_shas, github_token
+    )
+    for blob in packed.values():
+        await store(blob)
+    del packed
+
+    missing = [sha for sha in unstored if sha not in lazy_shas]
+    logging.info(f"{repo_obj.full_name}: fetching {len(missing)} changed blobs")
+    async for _, blob in _stream_blobs(repo_obj.full_name, missing, github_token):
+        await store(blob)
+
+    for sha, paths in list(unstored.items()):
+        size = new_tree[paths[0][0]][1]
+        await writer.put_many(
+            _files_for_blob(repo_obj, code_state, paths, _pending_blob(sha, size))
+        )
+
+
+async def _latest_built_state(repo_obj, branch_obj, **filters):
+    """
+    The branch's most recent code state whose rows are all written. Pending
+    states are still being ingested (or were abandoned halfway) and must not
+    be diffed against or reused.
+    """
+    return await RepositoryCodeState.objects.filter(
+        repository=repo_obj,
+        branch=branch_obj,
+        status__in=RepositoryCodeState.VISIBLE_STATUSES,
+        **filters,
+    ).order_by("-created_at").afirst()
 
-    # Bulk create all files
-    await RepositoryFile.objects.abulk_create(files_to_create)
+
+async def _discard_unfinished(repo_obj, branch_obj, commit_sha):
+    """
+    Delete a pending state left at this commit by an ingest that died
+    halfway. Snapshot jobs are deduplicated per commit, so it isn't being
+    built by anyone else, and it would block the new one.
+    """
+    await RepositoryCodeState.objects.filter(
+        repository=repo_obj,
+        branch=branch_obj,
+        commit_sha=commit_sha,
+        status=RepositoryCodeState.STATUS_PENDING,
+    ).adelete()
+
+
+async def _reuse_state(repo_obj, branch_obj, commit_sha):
+    """
+    A force-push may return the branch to a commit we built before: make that
+    code state the branch's current one again instead of rebuilding it.
+    """
+    code_state = await _latest_built_state(repo_obj, branch_obj, commit_sha=commit_sha)
+    if code_state is not None:
+        logging.info(f"{repo_obj.full_name}: reusing stored code state at {commit_sha[:8]}")
+        await RepositoryCodeState.objects.filter(pk=code_state.pk).aupdate(
+            created_at=timezone.now()
+        )
     return code_state
 
 
 async def create_incremental_snapshot(
     user, repo_obj, branch_obj, old_sha, new_sha, github_token
 ):
-    owner = user.github_login
-    repo = repo_obj.name
+    """
+    Build the code state of new_sha from the stored one of old_sha by diffing
+    the two trees locally by path and blob SHA.
+    Only the new tree and the changed blobs are fetched. Nothing depends on
+    old_sha being an ancestor of new_sha, so force-pushes diff the same way.
+    """
+    full_name = repo_obj.full_name
+    reused = await _reuse_state(repo_obj, branch_obj, new_sha)
+    if reused is not None:
+        return reused
+    old_state = await _latest_built_state(repo_obj, branch_obj, commit_sha=old_sha)
+    if old_state is None:
+        logging.warning(
+            f"{full_name}: no stored code state at {old_sha[:8]}, rebuilding"
+        )
+        return await create_initial_snapshot(
+            user, repo_obj, branch_obj, new_sha, github_token
+        )
+
+    new_tree = await _fetch_tree(
+        full_name, new_sha, github_token, public=not repo_obj.private
+    )
+    old_tree = await _stored_tree(old_state)
+    diff = diff_trees(old_tree, {path: sha for path, (sha, _) in new_tree.items()})
+    logging.info(
+        f"{full_name} {old_sha[:8]}...{new_sha[:8]}: {len(diff.added)} added, "
+        f"{len(diff.modified)} modified, {len(diff.removed)} removed, "
+        f"{len(diff.renamed)} renamed, {len(diff.unchanged)} unchanged"
+    )
 
-    # Get changed files list
-    compare_url = (
-        f"https://api.github.com/repos/{owner}/{repo}/compare/{old_sha}...{new_sha}"
+    changed = [(path, "added") for path in diff.added]
+    changed += [(path, "modified") for path in diff.modified]
+    lazy_shas = (
+        {new_tree[path][0] for path, _ in changed if not _is_eager(path, new_tree[path][1])}
+        if settings.SNAPSHOT_HYDRATION == "lazy"
+        else set()
     )
-    compare_data = await _make_request(url=compare_url, access_token=github_token)
 
-    # Create new code state
+    # Stays pending, and out of the views, until every row is written
+    await _discard_unfinished(repo_obj, branch_obj, new_sha)
     code_state = await RepositoryCodeState.objects.acreate(
         repository=repo_obj,
         branch=branch_obj,
@@ -109,63 +796,39 @@ async def create_incremental_snapshot(
         is_initial=False,
     )
 
-    # Separate files by type for parallel fetching
-    modified_files = [
-        f["filename"]
-        for f in compare_data.get("files", [])
-        if f["status"] in ("added", "modified")
-    ]
-    removed_files = [
-        f["filename"] for f in compare_data.get("files", []) if f["status"] == "removed"
-    ]
-
-    # Fetch contents in parallel only for modified/added files
-    contents = await _fetch_contents(
-        owner, repo, modified_files, branch_obj.name, github_token
-    )
-
-    # Prepare files for bulk creation
-    files_to_create = [
-        RepositoryFile(
-            repository=repo_obj,
-            code_state=code_state,
-            path=path,
-            content=content if not is_binary else None,
-            is_binary=is_binary,
-            change_type="modified",  # Will be updated below
-        )
-        for path, (content, is_binary) in zip(modified_files, contents)
-    ]
-
-    # Add removed files
-    files_to_create.extend(
-        RepositoryFile(
-            repository=repo_obj,
-            code_state=code_state,
-            path=path,
-            content=None,
-            is_binary=False,
-            change_type="removed",
-        )
-        for path in removed_files
-    )
-
-    # Set correct change types (since we separated files earlier)
-    file_status_map = {
-        f["filename"]: f["status"] for f in compare_data.get("files", [])
-    }
-    for file in files_to_create:
-        file.change_type = file_status_map[file.path]
+    try:
+        async with _writer(_insert_files) as writer:
+            # Removed files are kept as markers so the state records the whole diff
+            await writer.put_many(
+                RepositoryFile(
+                    repository=repo_obj,
+                    code_state=code_state,
+                    path=path,
+                    blob_sha=old_tree[path] or None,
+                    content=None,
+                    is_binary=False,
+                    file_type=RepositoryFile.detect_file_type(path),
+                    change_type="removed",
+                )
+                for path in diff.removed
+            )
+            await _copy_files(repo_obj, old_state, code_state, old_tree, diff, writer)
+            await _store_changed(
+                repo_obj, code_state, new_tree, changed, lazy_shas, github_token, writer
+            )
+    except Exception:
+        await code_state.adelete()
+        raise
 
-    # Bulk create all files
-    await RepositoryFile.objects.abulk_create(files_to_create)
+    await _mark_ingested(code_state, find_entry_page(new_tree))
     return code_state
 
 
 async def update_codebase(user, repo_obj, branch_obj, commit_sha, github_token):
-    code_state = await RepositoryCodeState.objects.filter(
-        repository=repo_obj, branch=branch_obj
-    ).afirst()
+    # Contents are read as the GitHub App when it is installed on the repo
+    github_token = await github_app.token_for_repo(repo_obj.full_name, github_token)
+    # Diff against the newest state that was fully ingested, never a pending one
+    code_state = await _latest_built_state(repo_obj, branch_obj)
     # if code_state:
     #     await RepositoryCodeState.objects.filter(
     #         repository=repo_obj, branch=branch_obj
@@ -179,3 +842,88 @@ async def update_codebase(user, repo_obj, branch_obj, commit_sha, github_token):
         return await create_incremental_snapshot(
             user, repo_obj, branch_obj, code_state.commit_sha, commit_sha, github_token
         )
+
+
+async def hydrate_file(file):
+    """Fetch and persist the content of a file that was recorded without it"""
+    repo_obj = file.repository
+    known = await _load_known_blobs([file.blob_sha])
+    blob = known.get(file.blob_sha)
+    if blob is None:
+        github_token = await github_app.token_for_repo(
+            repo_obj.full_name, repo_obj.user.access_token
+        )
+        blob = await get_blob_content(repo_obj.full_name, file.blob_sha, github_token)
+        dictionary_id, dictionary = await sync_to_async(BlobDictionary.current)()
+        stored = await asyncio.to_thread(_new_blob(blob).pack, dictionary_id, dictionary)
+        await Blob.objects.abulk_create([stored], ignore_conflicts=True)
+    updated = await RepositoryFile.objects.filter(pk=file.pk, hydrated=False).aupdate(
+        blob_id=blob["blob_sha"],
+        is_binary=blob["is_binary"],
+        size_bytes=blob["size_bytes"],
+        hydrated=True,
+    )
+    if updated:
+        await sync_to_async(Blob.adjust_ref_counts)({blob["blob_sha"]: 1})
+    file.blob = _new_blob(blob)
+    file.is_binary = blob["is_binary"]
+    file.size_bytes = blob["size_bytes"]
+    file.hydrated = True
+    return file
+
+
+_hydration_locks = {}
+_hydration_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _hydration_lock(file_id):
+    """
+    Per-file lock shared by concurrent sync callers. The entry lives as long
+    as somebody holds or waits on it, so a late caller never gets a new lock
+    while another one is still queued on the old one.
+    """
+    with _hydration_locks_guard:
+        entry = _hydration_locks.setdefault(file_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _hydration_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _hydration_locks[file_id]
+
+
+async def _hydrate_files(files):
+    semaphore = asyncio.Semaphore(settings.SNAPSHOT_FETCH_CONCURRENCY)
+
+    async def hydrate(file):
+        async with semaphore:
+            return await hydrate_file(file)
+
+    return await asyncio.gather(*(hydrate(file) for file in files))
+
+
+def hydrate_files_sync(file_ids):
+    """
+    Hydrate files from a sync view, all on one event loop (and so one pooled
+    client). Concurrent requests for the same file wait for the first one
+    instead of downloading the blob again. Returns the files by id.
+    """
+    # Always locked in the same order, so overlapping batches can't deadlock
+    file_ids = sorted(set(file_ids))
+    with ExitStack() as stack:
+        for file_id in file_ids:
+            stack.enter_context(_hydration_lock(file_id))
+        files = RepositoryFile.objects.select_related("repository__user").in_bulk(file_ids)
+        pending = [file for file in files.values() if not file.hydrated]
+        if pending:
+            async_to_sync(_hydrate_files)(pending)
+        return files
+
+
+def hydrate_file_sync(file_id):
+    """Hydrate a single file from a sync view, see hydrate_files_sync"""
+    return hydrate_files_sync([file_id])[file_id]
@@ -0,0 +1,17 @@
+from django.db.models import Count
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from .models import Blob, RepositoryCodeState
+
+
+@receiver(pre_delete, sender=RepositoryCodeState)
+def release_blobs(sender, instance, **kwargs):
+    """Drop the references a code state's files hold on their blobs"""
+    counts = (
+        instance.files.filter(blob__isnull=False)
+        .values("blob_id")
+        .annotate(count=Count("id"))
+        .values_list("blob_id", "count")
+    )
+    Blob.adjust_ref_counts(dict(counts), delta=-1)
@@ -0,0 +1,154 @@
+import zlib
+from typing import AsyncIterator, List, Optional, Tuple
+
+BLOCK_SIZE = 512
+
+# Tar entry types we care about; everything else (dirs, links, devices) is skipped
+REGULAR_TYPES = (b"0", b"\0", b"7")
+PAX_HEADER = b"x"
+PAX_GLOBAL_HEADER = b"g"
+GNU_LONGNAME = b"L"
+
+
+def _nts(field: bytes) -> str:
+    """Null-terminated bytes -> str"""
+    return field.split(b"\0", 1)[0].decode("utf-8", errors="replace")
+
+
+def _parse_size(field: bytes) -> int:
+    # GNU base-256 encoding for sizes that do not fit in 11 octal digits
+    if field[0] & 0x80:
+        return int.from_bytes(field[1:], "big")
+    field = field.split(b"\0", 1)[0].strip()
+    return int(field, 8) if field else 0
+
+
+def _parse_pax(data: bytes) -> dict:
+    """Parse "<len> key=value\\n" pax records"""
+    records = {}
+    pos = 0
+    while pos < len(data):
+        space = data.index(b" ", pos)
+        length = int(data[pos:space])
+        key, _, value = data[space + 1 : pos + length - 1].partition(b"=")
+        records[key.decode("utf-8")] = value.decode("utf-8", errors="replace")
+        pos += length
+    return records
+
+
+def _padded(size: int) -> int:
+    return (size + BLOCK_SIZE - 1) // BLOCK_SIZE * BLOCK_SIZE
+
+
+class TarGzStreamParser:
+    """
+    Incremental parser for .tar.gz streams.
+
+    Compressed chunks go in through ``feed`` and complete regular files come out
+    as (path, bytes) pairs, so an archive is never held in memory or on disk
+    as a whole, only the entry currently being read.
+    """
+
+    def __init__(self, strip_components: int = 0):
+        self.strip_components = strip_components
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._buffer = bytearray()
+        self._header: Optional[dict] = None
+        self._pending_path: Optional[str] = None
+        self._pending_size: Optional[int] = None
+        self.finished = False
+
+    def feed(self, chunk: bytes) -> List[Tuple[str, bytes]]:
+        if self.finished:
+            return []
+        self._buffer += self._decompressor.decompress(chunk)
+        return self._drain()
+
+    def close(self) -> List[Tuple[str, bytes]]:
+        if self.finished:
+            return []
+        self._buffer += self._decompressor.flush()
+        return self._drain()
+
+    def _drain(self) -> List[Tuple[str, bytes]]:
+        files = []
+        while not self.finished:
+            if self._header is None:
+                if len(self._buffer) < BLOCK_SIZE:
+                    break
+                block = bytes(self._buffer[:BLOCK_SIZE])
+                del self._buffer[:BLOCK_SIZE]
+                if block == b"\0" * BLOCK_SIZE:
+                    self.finished = True
+                    break
+                self._header = self._parse_header(block)
+                continue
+
+            size = self._header["size"]
+            if len(self._buffer) < _padded(size):
+                break
+            data = bytes(self._buffer[:size])
+            del self._buffer[: _padded(size)]
+            entry = self._complete_entry(data)
+            if entry is not None:
+                files.append(entry)
+        return files
+
+    def _parse_header(self, block: bytes) -> dict:
+        name = _nts(block[0:100])
+        prefix = _nts(block[345:500]) if block[257:262] == b"ustar" else ""
+        if prefix:
+            name = f"{prefix}/{name}"
+        size = _parse_size(block[124:136])
+        typeflag = block[156:157]
+
+        if typeflag in REGULAR_TYPES:
+            if self._pending_path is not None:
+                name = self._pending_path
+            if self._pending_size is not None:
+                size = self._pending_size
+        return {"name": name, "size": size, "type": typeflag}
+
+    def _complete_entry(self, data: bytes) -> Optional[Tuple[str, bytes]]:
+        header, self._header = self._header, None
+        typeflag = header["type"]
+
+        if typeflag == PAX_HEADER:
+            records = _parse_pax(data)
+            self._pending_path = records.get("path")
+            self._pending_size = int(records["size"]) if "size" in records else None
+            return None
+        if typeflag == GNU_LONGNAME:
+            self._pending_path = data.rstrip(b"\0").decode("utf-8", errors="replace")
+            return None
+        if typeflag == PAX_GLOBAL_HEADER:
+            return None
+
+        self._pending_path = None
+        self._pending_size = None
+        if typeflag not in REGULAR_TYPES:
+            return None
+
+        parts = header["name"].split("/")[self.strip_components :]
+        path = "/".join(parts)
+        if not path:
+            return None
+        return path, data
+
+
+async def iter_tarball_files(
+    chunks: AsyncIterator[bytes], strip_components: int = 1
+) -> AsyncIterator[Tuple[str, bytes]]:
+    """
+    Yield (path, bytes) for each regular file of a streamed .tar.gz.
+    GitHub archives wrap everything in a "<owner>-<repo>-<sha>/" directory,
+    which is stripped by default.
+    """
+    parser = TarGzStreamParser(strip_components=strip_components)
+    async for chunk in chunks:
+        for entry in parser.feed(chunk):
+            yield entry
+        if parser.finished:
+            return
+    for entry in parser.close():
+        yield entry
@@ -1,3 +1,833 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import io
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+import tracemalloc
+import unittest
+from unittest import mock
+from wsgiref.simple_server import WSGIRequestHandler, make_server
 
-# Create your tests here.
+import httpx
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from accounts.models import Branch, Repository, User
+from accounts.services.github_client import github_client
+from . import compression
+from .compression import BlobCodec
+from .models import Blob, BlobDictionary, RepositoryCodeState, RepositoryFile
+from .packfetch import fetch_pack_blobs
+from .services import git_blob_sha, hydrate_code_state, update_codebase
+from .tarball import TarGzStreamParser, iter_tarball_files
+from .trees import TreeEntry, TreeStreamParser, diff_trees, iter_tree_entries
+
+FILE_SIZE = 32 * 1024
+
+
+def _file_content(index: int) -> bytes:
+    # Distinct per file, so no blob is shared between files
+    line = f"/* file {index} */ body {{ margin: {index}px; }}\n".encode()
+    return (line * (FILE_SIZE // len(line) + 1))[:FILE_SIZE]
+
+
+@override_settings(
+    SNAPSHOT_INGEST_MODE="blobs",
+    SNAPSHOT_HYDRATION="eager",
+    SNAPSHOT_BATCH_SIZE=500,
+    SNAPSHOT_BATCH_MAX_BYTES=128 * 1024,
+    SNAPSHOT_MEMORY_BUDGET=512 * 1024,
+    SNAPSHOT_FETCH_CONCURRENCY=4,
+)
+class BoundedIngestMemoryTests(TransactionTestCase):
+    """Hydrating a snapshot keeps peak memory flat however large the repo is"""
+
+    def setUp(self):
+        self.user = User.objects.create(username="ingest", access_token="token")
+
+    def _pending_state(self, name: str, file_count: int):
+        repo = Repository.objects.create(
+            user=self.user,
+            repo_id=file_count,
+            name=name,
+            full_name=f"ingest/{name}",
+            default_branch="main",
+        )
+        branch = Branch.objects.create(repository=repo, name="main", last_commit_sha="c" * 40)
+        code_state = RepositoryCodeState.objects.create(
+            repository=repo, branch=branch, commit_sha="c" * 40
+        )
+        blobs = {git_blob_sha(_file_content(i)): i for i in range(file_count)}
+        RepositoryFile.objects.bulk_create(
+            RepositoryFile(
+                repository=repo,
+                code_state=code_state,
+                path=f"css/{index}.css",
+                blob_sha=sha,
+                size_bytes=FILE_SIZE,
+                hydrated=False,
+            )
+            for sha, index in blobs.items()
+        )
+        return RepositoryCodeState.objects.select_related("repository__user").get(
+            pk=code_state.pk
+        ), blobs
+
+    def _peak_hydrating(self, name: str, file_count: int) -> int:
+        code_state, blobs = self._pending_state(name, file_count)
+
+        def handler(request):
+            index = blobs[request.url.path.rsplit("/", 1)[1]]
+            return httpx.Response(200, content=_file_content(index))
+
+        transport = httpx.MockTransport(handler)
+        with mock.patch.object(
+            github_client, "_build_client", lambda: httpx.AsyncClient(transport=transport)
+        ):
+            tracemalloc.start()
+            try:
+                asyncio.run(hydrate_code_state(code_state))
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        self.assertFalse(code_state.files.filter(hydrated=False).exists())
+        self.assertEqual(code_state.files.filter(size_bytes=FILE_SIZE).count(), file_count)
+        return peak
+
+    def test_peak_memory_does_not_grow_with_repo_size(self):
+        small = self._peak_hydrating("small", 100)  # 3.2 MB of content
+        large = self._peak_hydrating("large", 800)  # 25.6 MB of content
+
+        # The larger repo holds eight times the content; memory stays put
+        self.assertLess(large, small * 2)
+        self.assertLess(large, 800 * FILE_SIZE / 4)
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _git_http_backend(project_root: str, requests: list):
+    """WSGI app serving the repositories under project_root with ``git http-backend``"""
+
+    def app(environ, start_response):
+        body = environ["wsgi.input"].read(int(environ.get("CONTENT_LENGTH") or 0))
+        env = {key: value for key, value in environ.items() if isinstance(value, str)}
+        env.update(GIT_PROJECT_ROOT=project_root, GIT_HTTP_EXPORT_ALL="1")
+        requests.append(environ["PATH_INFO"])
+        output = subprocess.run(
+            ["git", "http-backend"], input=body, env=env, capture_output=True, check=True
+        ).stdout
+        head, _, payload = output.partition(b"\r\n\r\n")
+        status, headers = "200 OK", []
+        for line in head.decode().split("\r\n"):
+            name, _, value = line.partition(": ")
+            if name.lower() == "status":
+                status = value
+            else:
+                headers.append((name, value))
+        start_response(status, headers)
+        return [payload]
+
+    return app
+
+
+@unittest.skipUnless(shutil.which("git"), "needs git")
+class PackFetchTests(TransactionTestCase):
+    """Incremental fetches over git smart HTTP, against a local git http-backend"""
+
+    FIRST = {
+        "index.html": b"<h1>first</h1>\n",
+        "src/f1.txt": b"one\n",
+        "old.txt": b"moved later\n",
+        "keep.css": b"body { margin: 0; }\n",
+    }
+    SECOND = {
+        "index.html": b"<h1>first</h1>\n",
+        "src/f1.txt": b"one, changed\n",
+        "moved.txt": b"moved later\n",
+        "keep.css": b"body { margin: 0; }\n",
+        "new.txt": b"brand new\n",
+    }
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        work = os.path.join(self.root, "work")
+        self.commits = [self._commit(work, files) for files in (self.FIRST, self.SECOND)]
+        subprocess.run(
+            ["git", "clone", "-q", "--bare", work, os.path.join(self.root, "owner", "site.git")],
+            check=True,
+        )
+
+        self.git_requests = []
+        server = make_server(
+            "127.0.0.1",
+            0,
+            _git_http_backend(self.root, self.git_requests),
+            handler_class=_QuietHandler,
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.git_url = f"http://127.0.0.1:{server.server_port}"
+
+    def _git(self, work, *args) -> str:
+        return subprocess.run(
+            ["git", "-C", work, "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+
+    def _commit(self, work, files: dict) -> str:
+        if not os.path.exists(work):
+            subprocess.run(["git", "init", "-q", work], check=True)
+        self._git(work, "rm", "-rq", "--ignore-unmatch", ".")
+        for path, data in files.items():
+            target = os.path.join(work, path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as fh:
+                fh.write(data)
+        self._git(work, "add", "-A")
+        self._git(work, "commit", "-qm", "snapshot")
+        return self._git(work, "rev-parse", "HEAD")
+
+    def _changed_blobs(self) -> set:
+        first = {git_blob_sha(data) for data in self.FIRST.values()}
+        return {git_blob_sha(data) for data in self.SECOND.values()} - first
+
+    def test_pack_only_holds_objects_the_haves_lack(self):
+        first, second = self.commits
+        wanted = {git_blob_sha(data) for data in self.SECOND.values()}
+
+        with override_settings(GITHUB_GIT_URL=self.git_url):
+            incremental = fetch_pack_blobs("owner/site", None, second, [first], wanted)
+            full = fetch_pack_blobs("owner/site", None, second, [], wanted)
+
+        self.assertEqual(set(incremental), self._changed_blobs())
+        self.assertEqual(incremental[git_blob_sha(b"brand new\n")], b"brand new\n")
+        self.assertEqual(set(full), wanted)
+
+    def test_incremental_snapshot_stores_new_blobs_from_the_pack(self):
+        first, second = self.commits
+        trees = {
+            first: {path: git_blob_sha(data) for path, data in self.FIRST.items()},
+            second: {path: git_blob_sha(data) for path, data in self.SECOND.items()},
+        }
+        contents = {
+            git_blob_sha(data): data
+            for files in (self.FIRST, self.SECOND)
+            for data in files.values()
+        }
+        api_blobs = []
+
+        def handler(request):
+            sha = request.url.path.rsplit("/", 1)[1]
+            if "/git/trees/" in request.url.path:
+                tree = [
+                    {"path": path, "type": "blob", "sha": blob, "size": len(contents[blob])}
+                    for path, blob in trees[sha].items()
+                ]
+                return httpx.Response(200, json={"tree": tree, "truncated": False})
+            api_blobs.append(sha)
+            return httpx.Response(200, content=contents[sha])
+
+        user = User.objects.create(username="pack", access_token="token")
+        repo = Repository.objects.create(
+            user=user, repo_id=1, name="site", full_name="owner/site", private=True
+        )
+        branch = Branch.objects.create(repository=repo, name="main", last_commit_sha=second)
+        transport = httpx.MockTransport(handler)
+
+        async def build():
+            code_state = await update_codebase(user, repo, branch, first, "token")
+            await hydrate_code_state(code_state)
+            api_blobs.clear()
+            with override_settings(SNAPSHOT_FETCH_MODE="pack", GITHUB_GIT_URL=self.git_url):
+                return await update_codebase(user, repo, branch, second, "token")
+
+        with override_settings(SNAPSHOT_INGEST_MODE="blobs"), mock.patch.object(
+            github_client, "_build_client", lambda: httpx.AsyncClient(transport=transport)
+        ):
+            code_state = asyncio.run(build())
+
+        # Both changed blobs came in the pack, none through the blob API
+        self.assertEqual(api_blobs, [])
+        self.assertTrue(self.git_requests)
+        self.assertEqual(
+            set(Blob.objects.values_list("sha", flat=True)), set(contents)
+        )
+        files = {f.path: f for f in code_state.files.select_related("blob")}
+        self.assertEqual(files["new.txt"].get_content(), "brand new\n")
+        self.assertEqual(files["src/f1.txt"].change_type, "modified")
+        self.assertEqual(files["moved.txt"].change_type, "renamed")
+
+
+class DiffTreesTests(SimpleTestCase):
+    """Local tree diff that replaced the compare API"""
+
+    def test_classifies_added_modified_removed_unchanged(self):
+        diff = diff_trees(
+            {"index.html": "a1", "app.js": "b1", "gone.css": "c1"},
+            {"index.html": "a1", "app.js": "b2", "new.css": "d1"},
+        )
+
+        self.assertEqual(diff.unchanged, ["index.html"])
+        self.assertEqual(diff.modified, ["app.js"])
+        self.assertEqual(diff.added, ["new.css"])
+        self.assertEqual(diff.removed, ["gone.css"])
+        self.assertEqual(diff.renamed, [])
+
+    def test_removed_and_added_path_with_same_blob_is_a_rename(self):
+        diff = diff_trees(
+            {"css/old.css": "s1", "index.html": "a1"},
+            {"styles/new.css": "s1", "index.html": "a1"},
+        )
+
+        self.assertEqual(diff.renamed, [("css/old.css", "styles/new.css")])
+        self.assertEqual(diff.added, [])
+        self.assertEqual(diff.removed, [])
+
+    def test_each_removed_blob_pairs_once(self):
+        # One file removed, its content now at two new paths: a rename and a copy
+        diff = diff_trees({"a.txt": "s1"}, {"b.txt": "s1", "c.txt": "s1"})
+
+        self.assertEqual(len(diff.renamed), 1)
+        self.assertEqual(diff.renamed[0][0], "a.txt")
+        self.assertEqual(len(diff.added), 1)
+        self.assertEqual({diff.renamed[0][1], *diff.added}, {"b.txt", "c.txt"})
+        self.assertEqual(diff.removed, [])
+
+    def test_same_blob_kept_at_old_path_is_not_a_rename(self):
+        # The old path still exists, so the new one is a copy
+        diff = diff_trees({"a.txt": "s1"}, {"a.txt": "s1", "b.txt": "s1"})
+
+        self.assertEqual(diff.unchanged, ["a.txt"])
+        self.assertEqual(diff.added, ["b.txt"])
+        self.assertEqual(diff.renamed, [])
+
+    def test_unrelated_base_diffs_by_content_alone(self):
+        # A force-push to a commit with no common history: nothing but the
+        # trees is consulted, so shared blobs are still recognised
+        diff = diff_trees(
+            {"index.html": "a1", "lib/util.js": "u1", "README": "r1"},
+            {"index.html": "a9", "src/util.js": "u1", "LICENSE": "l1"},
+        )
+
+        self.assertEqual(diff.modified, ["index.html"])
+        self.assertEqual(diff.renamed, [("lib/util.js", "src/util.js")])
+        self.assertEqual(diff.added, ["LICENSE"])
+        self.assertEqual(diff.removed, ["README"])
+
+
+@override_settings(SNAPSHOT_INGEST_MODE="blobs")
+class IncrementalSnapshotTests(TransactionTestCase):
+    """Snapshots of a new commit built from the stored one by a local diff"""
+
+    def setUp(self):
+        self.user = User.objects.create(username="diff", access_token="token")
+        self.repo = Repository.objects.create(
+            user=self.user, repo_id=2, name="site", full_name="owner/site"
+        )
+        self.branch = Branch.objects.create(repository=self.repo, name="main")
+        self.commits = {}
+        self.requests = []
+
+    def _handler(self, request):
+        self.requests.append(request.url.path)
+        sha = request.url.path.rsplit("/", 1)[1]
+        if "/git/trees/" in request.url.path:
+            tree = [
+                {"path": path, "type": "blob", "sha": git_blob_sha(data), "size": len(data)}
+                for path, data in self.commits[sha].items()
+            ]
+            return httpx.Response(200, json={"tree": tree, "truncated": False})
+        if "/git/blobs/" in request.url.path:
+            contents = {
+                git_blob_sha(data): data for files in self.commits.values() for data in files.values()
+            }
+            return httpx.Response(200, content=contents[sha])
+        return httpx.Response(404)
+
+    def _update(self, *commit_shas):
+        transport = httpx.MockTransport(self._handler)
+
+        async def run():
+            for commit_sha in commit_shas:
+                code_state = await update_codebase(
+                    self.user, self.repo, self.branch, commit_sha, "token"
+                )
+                await hydrate_code_state(code_state)
+            return code_state
+
+        with mock.patch.object(
+            github_client, "_build_client", lambda: httpx.AsyncClient(transport=transport)
+        ):
+            return asyncio.run(run())
+
+    def test_force_push_to_unrelated_commit(self):
+        self.commits = {
+            "a" * 40: {"index.html": b"<h1>old</h1>", "lib/util.js": b"util()", "README": b"old"},
+            "b" * 40: {"index.html": b"<h1>new</h1>", "src/util.js": b"util()", "LICENSE": b"MIT"},
+        }
+
+        code_state = self._update("a" * 40, "b" * 40)
+
+        self.assertFalse(code_state.is_initial)
+        self.assertFalse([path for path in self.requests if "/compare/" in path])
+        changes = {
+            f.path: (f.change_type, f.previous_path) for f in code_state.files.all()
+        }
+        self.assertEqual(
+            changes,
+            {
+                "index.html": ("modified", None),
+                "src/util.js": ("renamed", "lib/util.js"),
+                "LICENSE": ("added", None),
+                "README": ("removed", None),
+            },
+        )
+        renamed = code_state.files.select_related("blob").get(path="src/util.js")
+        self.assertEqual(renamed.get_content(), "util()")
+
+    def test_pending_state_is_never_the_base(self):
+        self.commits = {
+            "a" * 40: {"index.html": b"<h1>a</h1>"},
+            "b" * 40: {"index.html": b"<h1>b</h1>", "extra.js": b"x()"},
+        }
+        self._update("a" * 40)
+        # Left behind by an ingest that died halfway, newer than the built one
+        RepositoryCodeState.objects.create(
+            repository=self.repo, branch=self.branch, commit_sha="b" * 40
+        )
+
+        code_state = self._update("b" * 40)
+
+        self.assertEqual(code_state.status, RepositoryCodeState.STATUS_COMPLETE)
+        self.assertEqual(
+            dict(code_state.files.values_list("path", "change_type")),
+            {"index.html": "modified", "extra.js": "added"},
+        )
+
+    def test_legacy_rows_without_content_are_refetched(self):
+        logo = b"\x89PNG\r\n\x1a\n\xff\xfe"
+        self.commits = {
+            "b" * 40: {"index.html": b"<h1>a</h1>", "logo.png": logo},
+        }
+        # Stored before blobs were shared: no SHA, and binaries had no content
+        old_state = RepositoryCodeState.objects.create(
+            repository=self.repo,
+            branch=self.branch,
+            commit_sha="a" * 40,
+            is_initial=True,
+            status=RepositoryCodeState.STATUS_COMPLETE,
+        )
+        for path, content, is_binary in [
+            ("index.html", "<h1>a</h1>", False),
+            ("logo.png", None, True),
+            ("gone.png", None, True),
+        ]:
+            RepositoryFile.objects.create(
+                repository=self.repo,
+                code_state=old_state,
+                path=path,
+                content=content,
+                is_binary=is_binary,
+            )
+
+        code_state = self._update("b" * 40)
+
+        self.assertEqual(
+            dict(code_state.files.values_list("path", "change_type")),
+            {"index.html": "unchanged", "logo.png": "modified", "gone.png": "removed"},
+        )
+        refetched = code_state.files.select_related("blob").get(path="logo.png")
+        self.assertTrue(refetched.is_binary)
+        self.assertEqual(base64.b64decode(refetched.get_content()), logo)
+        self.assertIn(f"/repos/owner/site/git/blobs/{git_blob_sha(logo)}", self.requests)
+
+
+def _chunked(data: bytes, size: int) -> list:
+    return [data[start : start + size] for start in range(0, len(data), size)]
+
+
+def _tar_gz(members, format=tarfile.PAX_FORMAT) -> bytes:
+    """Build a .tar.gz from (TarInfo, bytes or None) pairs"""
+    raw = io.BytesIO()
+    with tarfile.open(fileobj=raw, mode="w", format=format) as archive:
+        for info, data in members:
+            if data is not None:
+                info.size = len(data)
+            archive.addfile(info, io.BytesIO(data) if data is not None else None)
+    return gzip.compress(raw.getvalue())
+
+
+def _member(name, type=tarfile.REGTYPE, **attrs) -> tarfile.TarInfo:
+    info = tarfile.TarInfo(name)
+    info.type = type
+    for key, value in attrs.items():
+        setattr(info, key, value)
+    return info
+
+
+class TarballParserTests(SimpleTestCase):
+    """Streaming .tar.gz parser, fed in chunks that split headers and contents"""
+
+    CHUNK_SIZES = (1, 7, 511, 512, 513, 4096)
+
+    def _parse(self, archive: bytes, chunk_size: int, strip_components: int = 1) -> dict:
+        parser = TarGzStreamParser(strip_components=strip_components)
+        files = []
+        for chunk in _chunked(archive, chunk_size):
+            files.extend(parser.feed(chunk))
+        files.extend(parser.close())
+        self.assertTrue(parser.finished)
+        return dict(files)
+
+    def test_keeps_regular_files_only(self):
+        archive = _tar_gz(
+            [
+                (_member("owner-site-abc", tarfile.DIRTYPE), None),
+                (_member("owner-site-abc/index.html"), b"<h1>hi</h1>"),
+                (_member("owner-site-abc/empty.txt"), b""),
+                (_member("owner-site-abc/link", tarfile.SYMTYPE, linkname="index.html"), None),
+                (_member("owner-site-abc/css", tarfile.DIRTYPE), None),
+                (_member("owner-site-abc/css/site.css"), b"body {}" * 200),
+            ]
+        )
+
+        for chunk_size in self.CHUNK_SIZES:
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(
+                    self._parse(archive, chunk_size),
+                    {
+                        "index.html": b"<h1>hi</h1>",
+                        "empty.txt": b"",
+                        "css/site.css": b"body {}" * 200,
+                    },
+                )
+
+    def test_long_names_from_pax_and_gnu_headers(self):
+        long_dir = "owner-site-abc/" + "/".join(["nested-directory"] * 12)
+        name = f"{long_dir}/file-with-a-long-name.js"
+        self.assertGreater(len(name), 100)
+
+        for format in (tarfile.PAX_FORMAT, tarfile.GNU_FORMAT):
+            archive = _tar_gz([(_member(name), b"x()"), (_member("owner-site-abc/a.js"), b"a()")], format)
+            for chunk_size in self.CHUNK_SIZES:
+                with self.subTest(format=format, chunk_size=chunk_size):
+                    files = self._parse(archive, chunk_size)
+                    # The long name applies to its own entry only
+                    self.assertEqual(
+                        files,
+                        {name.split("/", 1)[1]: b"x()", "a.js": b"a()"},
+                    )
+
+    def test_pax_global_header_is_skipped(self):
+        # git archive writes the commit id in a global header first
+        raw = io.BytesIO()
+        with tarfile.open(
+            fileobj=raw, mode="w", format=tarfile.PAX_FORMAT, pax_headers={"comment": "a" * 40}
+        ) as archive:
+            info = _member("owner-site-abc/index.html", size=2)
+            archive.addfile(info, io.BytesIO(b"hi"))
+        archive = gzip.compress(raw.getvalue())
+
+        for chunk_size in self.CHUNK_SIZES:
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self._parse(archive, chunk_size), {"index.html": b"hi"})
+
+    def test_sizes_from_pax_records_and_base256(self):
+        # Sizes too large for the octal field come from a pax record or GNU
+        # base-256; the field is rewritten here so only that source is right
+        data = b"z" * 3000
+        pax = _member("p/big.bin", pax_headers={"size": str(len(data))})
+        for format, member, size_field in (
+            (tarfile.PAX_FORMAT, pax, b"0" * 11 + b"\0"),
+            (tarfile.GNU_FORMAT, _member("p/big.bin"), b"\x80" + len(data).to_bytes(11, "big")),
+        ):
+            with self.subTest(format=format):
+                raw = bytearray(gzip.decompress(_tar_gz([(member, data)], format)))
+                header = raw.find(b"p/big.bin\0")
+                raw[header + 124 : header + 136] = size_field
+                archive = gzip.compress(bytes(raw))
+                for chunk_size in self.CHUNK_SIZES:
+                    self.assertEqual(self._parse(archive, chunk_size), {"big.bin": data})
+
+    def test_stops_at_end_of_archive_marker(self):
+        archive = _tar_gz([(_member("p/a.txt"), b"a")])
+        # Bytes after the end-of-archive blocks are ignored
+        parser = TarGzStreamParser(strip_components=1)
+        files = parser.feed(archive)
+        self.assertTrue(parser.finished)
+        self.assertEqual(files, [("a.txt", b"a")])
+        self.assertEqual(parser.feed(b"garbage"), [])
+
+    def test_iter_tarball_files_strips_the_archive_directory(self):
+        archive = _tar_gz([(_member("owner-site-abc/src/app.js"), b"app()")])
+
+        async def chunks():
+            for chunk in _chunked(archive, 100):
+                yield chunk
+
+        async def collect():
+            return [entry async for entry in iter_tarball_files(chunks())]
+
+        self.assertEqual(asyncio.run(collect()), [("src/app.js", b"app()")])
+
+
+@override_settings(SNAPSHOT_INGEST_MODE="tarball", SNAPSHOT_HYDRATION="eager")
+class TarballHydrationTests(TransactionTestCase):
+    def test_members_that_differ_from_their_blob_are_fetched_by_sha(self):
+        user = User.objects.create(username="tar", access_token="token")
+        repo = Repository.objects.create(user=user, repo_id=3, name="site", full_name="owner/site")
+        branch = Branch.objects.create(repository=repo, name="main")
+        code_state = RepositoryCodeState.objects.create(
+            repository=repo, branch=branch, commit_sha="c" * 40
+        )
+        blobs = {"index.html": b"<h1>hi</h1>", "version.txt": b"$Format:%H$\n"}
+        for path, data in blobs.items():
+            RepositoryFile.objects.create(
+                repository=repo,
+                code_state=code_state,
+                path=path,
+                blob_sha=git_blob_sha(data),
+                size_bytes=len(data),
+                hydrated=False,
+            )
+        # git archive applied export-subst to version.txt
+        archive = _tar_gz(
+            [
+                (_member("owner-site-c/index.html"), blobs["index.html"]),
+                (_member("owner-site-c/version.txt"), b"c" * 40 + b"\n"),
+            ]
+        )
+        requests = []
+
+        def handler(request):
+            requests.append(request.url.path)
+            if "/tarball/" in request.url.path:
+                return httpx.Response(200, content=archive)
+            sha = request.url.path.rsplit("/", 1)[1]
+            return httpx.Response(
+                200, content={git_blob_sha(data): data for data in blobs.values()}[sha]
+            )
+
+        transport = httpx.MockTransport(handler)
+        code_state = RepositoryCodeState.objects.select_related("repository__user").get(
+            pk=code_state.pk
+        )
+        with mock.patch.object(
+            github_client, "_build_client", lambda: httpx.AsyncClient(transport=transport)
+        ):
+            asyncio.run(hydrate_code_state(code_state))
+
+        self.assertEqual(
+            requests,
+            [
+                f"/repos/owner/site/tarball/{'c' * 40}",
+                f"/repos/owner/site/git/blobs/{git_blob_sha(blobs['version.txt'])}",
+            ],
+        )
+        for path, data in blobs.items():
+            self.assertEqual(Blob.objects.get(sha=git_blob_sha(data)).get_bytes(), data)
+
+
+class TreeStreamParserTests(SimpleTestCase):
+    """Incremental git/trees JSON parser, fed text split at every offset"""
+
+    TREE = {
+        "sha": "f" * 40,
+        "url": "https://api.github.com/repos/owner/site/git/trees/" + "f" * 40,
+        "tree": [
+            {"path": "index.html", "mode": "100644", "type": "blob", "sha": "a" * 40, "size": 1234},
+            {"path": "css", "mode": "040000", "type": "tree", "sha": "b" * 40},
+            {"path": "css/s p a c e [x].css", "mode": "100644", "type": "blob", "sha": "c" * 40, "size": 7},
+            {"path": "ünïcode/\"quoted\".js", "mode": "100644", "type": "blob", "sha": "d" * 40, "size": 0},
+        ],
+        "truncated": False,
+    }
+    ENTRIES = [
+        TreeEntry("index.html", "blob", "a" * 40, 1234),
+        TreeEntry("css", "tree", "b" * 40, None),
+        TreeEntry("css/s p a c e [x].css", "blob", "c" * 40, 7),
+        TreeEntry("ünïcode/\"quoted\".js", "blob", "d" * 40, 0),
+    ]
+
+    def _parse(self, text: str, chunk_size: int) -> TreeStreamParser:
+        parser = TreeStreamParser()
+        entries = []
+        for chunk in _chunked(text, chunk_size):
+            entries.extend(parser.feed(chunk))
+        parser.close()
+        self.assertEqual(entries, self.ENTRIES)
+        return parser
+
+    def test_every_chunk_boundary(self):
+        for indent in (None, 2):
+            text = json.dumps(self.TREE, indent=indent, ensure_ascii=False)
+            for chunk_size in range(1, 40):
+                with self.subTest(indent=indent, chunk_size=chunk_size):
+                    parser = self._parse(text, chunk_size)
+                    self.assertFalse(parser.truncated)
+                    self.assertEqual(parser.fields["sha"], "f" * 40)
+
+    def test_split_inside_a_trailing_number(self):
+        # "size": 1234 split after "12" must not be read as 12
+        text = json.dumps({"tree": [self.TREE["tree"][0]], "truncated": True})
+        cut = text.index("1234") + 2
+        parser = TreeStreamParser()
+        entries = parser.feed(text[:cut]) + parser.feed(text[cut:])
+        parser.close()
+        self.assertEqual(entries, self.ENTRIES[:1])
+        self.assertTrue(parser.truncated)
+
+    def test_fields_after_the_tree_array(self):
+        text = json.dumps({"truncated": True, "tree": [], "sha": "e" * 40})
+        parser = TreeStreamParser()
+        for chunk in _chunked(text, 3):
+            self.assertEqual(parser.feed(chunk), [])
+        parser.close()
+        self.assertTrue(parser.truncated)
+        self.assertEqual(parser.fields["sha"], "e" * 40)
+
+    def test_incomplete_response_is_an_error(self):
+        text = json.dumps(self.TREE)
+        parser = TreeStreamParser()
+        parser.feed(text[: len(text) // 2])
+        with self.assertRaises(ValueError):
+            parser.close()
+
+    def test_not_an_object_is_an_error(self):
+        with self.assertRaises(ValueError):
+            TreeStreamParser().feed("[]")
+
+    def test_iter_tree_entries(self):
+        text = json.dumps(self.TREE)
+
+        async def chunks():
+            for chunk in _chunked(text, 64):
+                yield chunk
+
+        async def collect():
+            return [entry async for entry in iter_tree_entries(chunks())]
+
+        self.assertEqual(asyncio.run(collect()), self.ENTRIES)
+
+
+def _source_file(index: int) -> str:
+    return "".join(
+        f".card-{index}-{line} {{ padding: {line}px; color: #{index * line % 4096:03x}; }}\n"
+        for line in range(60)
+    )
+
+
+class BlobCompressionTests(TestCase):
+    """Blob contents survive compression with every codec and read back the same"""
+
+    def setUp(self):
+        # Dictionary lookups are cached per process; start each test clean
+        BlobDictionary._current = None
+
+    def _codec(self, codec: str, min_bytes: int = 64) -> BlobCodec:
+        patcher = mock.patch.object(
+            compression,
+            "blob_codec",
+            BlobCodec(codec=codec, zstd_level=3, zlib_level=6, min_bytes=min_bytes, workers=2),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # models imported the instance by name
+        model_patcher = mock.patch("preview.models.blob_codec", compression.blob_codec)
+        model_patcher.start()
+        self.addCleanup(model_patcher.stop)
+        return compression.blob_codec
+
+    def _stored(self, content: str, is_binary: bool = False) -> Blob:
+        raw = base64.b64decode(content) if is_binary else content.encode("utf-8")
+        blob = Blob(
+            sha=git_blob_sha(raw), content=content, is_binary=is_binary, size_bytes=len(raw)
+        )
+        Blob.pack_many([blob])
+        blob.save()
+        return Blob.objects.get(sha=blob.sha)
+
+    def test_zstd_with_trained_dictionary(self):
+        codec = self._codec("zstd")
+        samples = [_source_file(index).encode() for index in range(200)]
+        BlobDictionary.objects.create(data=codec.train(samples, 8 * 1024), sample_count=200)
+
+        content = _source_file(1000)
+        blob = self._stored(content)
+        # A fresh process only has the dictionary id; it is loaded on first read
+        codec._dictionaries.clear()
+
+        self.assertEqual(blob.codec, compression.ZSTD)
+        self.assertIsNotNone(blob.dictionary_id)
+        self.assertEqual(blob.content, "")
+        self.assertLess(blob.stored_bytes, len(content) / 4)
+        self.assertEqual(blob.get_content(), content)
+        self.assertGreater(codec.stats["ratio"], 4)
+
+    def test_zstd_without_dictionary(self):
+        self._codec("zstd")
+        content = _source_file(1)
+        blob = self._stored(content)
+
+        self.assertEqual(blob.codec, compression.ZSTD)
+        self.assertIsNone(blob.dictionary_id)
+        self.assertEqual(blob.get_content(), content)
+
+    def test_zlib_when_zstandard_is_missing(self):
+        with mock.patch.object(compression, "zstandard", None):
+            codec = self._codec("zstd")
+        self.assertEqual(codec.codec, compression.ZLIB)
+
+        content = _source_file(2)
+        blob = self._stored(content)
+
+        self.assertEqual(blob.codec, compression.ZLIB)
+        self.assertEqual(blob.get_content(), content)
+
+    def test_binary_contents_round_trip(self):
+        self._codec("zstd")
+        data = bytes(range(256)) * 20
+        blob = self._stored(base64.b64encode(data).decode("ascii"), is_binary=True)
+
+        self.assertEqual(blob.codec, compression.ZSTD)
+        self.assertEqual(blob.get_bytes(), data)
+        self.assertEqual(blob.get_content(), base64.b64encode(data).decode("ascii"))
+
+    def test_small_or_incompressible_contents_stay_inline(self):
+        codec = self._codec("zstd")
+        small = self._stored("tiny")
+        noise = os.urandom(2048)
+        random = self._stored(base64.b64encode(noise).decode("ascii"), is_binary=True)
+
+        self.assertEqual((small.codec, small.content), ("", "tiny"))
+        self.assertEqual(random.codec, "")
+        self.assertEqual(random.get_bytes(), noise)
+        self.assertEqual(codec.stats["incompressible"], 1)
+
+    def test_legacy_uncompressed_rows(self):
+        self._codec("zstd")
+        text = Blob.objects.create(sha="1" * 40, content="legacy text")
+        binary = Blob.objects.create(
+            sha="2" * 40, content=base64.b64encode(b"\x00\x01").decode(), is_binary=True
+        )
+
+        text, binary = Blob.objects.get(sha="1" * 40), Blob.objects.get(sha="2" * 40)
+        self.assertEqual(text.get_content(), "legacy text")
+        self.assertEqual(binary.get_bytes(), b"\x00\x01")
+
+        # Compressing a legacy row keeps what it reads back as
+        Blob.pack_many([text])
+        self.assertEqual(text.get_content(), "legacy text")
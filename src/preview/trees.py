@@ -0,0 +1,198 @@
+import json
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class TreeEntry(NamedTuple):
+    """The parts of a git tree entry we keep; urls and modes are dropped"""
+
+    path: str
+    type: str
+    sha: str
+    size: Optional[int]
+
+
+class TreeStreamParser:
+    """
+    Incremental parser for GitHub's git/trees JSON.
+
+    Text goes in through ``feed`` and the entries of the "tree" array come out
+    as TreeEntry tuples as soon as each one is complete, so only the entry
+    being read is ever buffered. Top-level scalars such as "truncated" are
+    collected in ``fields``.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._state = "start"
+        self._key = None
+        self.fields = {}
+        self.finished = False
+
+    @property
+    def truncated(self) -> bool:
+        return bool(self.fields.get("truncated"))
+
+    def feed(self, text: str) -> List[TreeEntry]:
+        self._buffer = self._buffer[self._pos :] + text
+        self._pos = 0
+        entries = []
+        while not self.finished and self._step(entries):
+            pass
+        return entries
+
+    def close(self):
+        if not self.finished:
+            raise ValueError("Incomplete git tree response")
+
+    def _skip(self, chars: str) -> Optional[str]:
+        """Skip whitespace and ``chars``; return the next character, None if out of data"""
+        buffer = self._buffer
+        while self._pos < len(buffer) and buffer[self._pos] in _WHITESPACE + chars:
+            self._pos += 1
+        return buffer[self._pos] if self._pos < len(buffer) else None
+
+    def _decode(self):
+        """Decode one JSON value at the cursor; raise ValueError if it is incomplete"""
+        try:
+            value, end = _decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            raise ValueError
+        # A number at the end of the buffer may still be growing
+        if end == len(self._buffer) and not isinstance(value, (str, dict, list)):
+            raise ValueError
+        self._pos = end
+        return value
+
+    def _step(self, entries: list) -> bool:
+        """Advance by one token; return False when more data is needed"""
+        if self._state == "start":
+            char = self._skip("")
+            if char is None:
+                return False
+            if char != "{":
+                raise ValueError("Expected a JSON object")
+            self._pos += 1
+            self._state = "key"
+            return True
+
+        if self._state == "key":
+            char = self._skip(",")
+            if char is None:
+                return False
+            if char == "}":
+                self._pos += 1
+                self.finished = True
+                return False
+            start = self._pos
+            try:
+                self._key = self._decode()
+            except ValueError:
+                self._pos = start
+                return False
+            self._state = "colon"
+            return True
+
+        if self._state == "colon":
+            char = self._skip("")
+            if char is None:
+                return False
+            self._pos += 1
+            self._state = "value"
+            return True
+
+        if self._state == "value":
+            char = self._skip("")
+            if char is None:
+                return False
+            if self._key == "tree" and char == "[":
+                self._pos += 1
+                self._state = "entries"
+                return True
+            start = self._pos
+            try:
+                self.fields[self._key] = self._decode()
+            except ValueError:
+                self._pos = start
+                return False
+            self._state = "key"
+            return True
+
+        # Inside the "tree" array
+        char = self._skip(",")
+        if char is None:
+            return False
+        if char == "]":
+            self._pos += 1
+            self._state = "key"
+            return True
+        start = self._pos
+        try:
+            item = self._decode()
+        except ValueError:
+            self._pos = start
+            return False
+        entries.append(
+            TreeEntry(item["path"], item["type"], item["sha"], item.get("size"))
+        )
+        return True
+
+
+async def iter_tree_entries(
+    chunks: AsyncIterator[str], parser: TreeStreamParser = None
+) -> AsyncIterator[TreeEntry]:
+    """Yield the entries of a streamed git/trees response as they arrive"""
+    parser = parser or TreeStreamParser()
+    async for chunk in chunks:
+        for entry in parser.feed(chunk):
+            yield entry
+    parser.close()
+
+
+@dataclass
+class TreeDiff:
+    """Difference between two trees given as {path: blob_sha}"""
+
+    added: List[str] = field(default_factory=list)
+    modified: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    # (old_path, new_path)
+    renamed: List[Tuple[str, str]] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+
+
+def diff_trees(old: Dict[str, str], new: Dict[str, str]) -> TreeDiff:
+    """
+    Diff two trees by path and blob SHA.
+    A removed path whose exact blob reappears under an added path is a rename;
+    each removed blob is paired at most once, so copies stay additions.
+    """
+    diff = TreeDiff()
+    for path, sha in new.items():
+        old_sha = old.get(path)
+        if old_sha is None:
+            diff.added.append(path)
+        elif old_sha == sha:
+            diff.unchanged.append(path)
+        else:
+            diff.modified.append(path)
+
+    removed_by_sha = {}
+    for path, sha in old.items():
+        if path not in new:
+            removed_by_sha.setdefault(sha, []).append(path)
+
+    added = []
+    for path in diff.added:
+        sources = removed_by_sha.get(new[path])
+        if sources:
+            diff.renamed.append((sources.pop(), path))
+        else:
+            added.append(path)
+    diff.added = added
+    diff.removed = [path for paths in removed_by_sha.values() for path in paths]
+    return diff
@@ -2,7 +2,8 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse, FileResponse, HttpResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
-from .models import RepositoryCodeState, RepositoryFile
+from .models import Blob, RepositoryCodeState, RepositoryFile
+from .services import hydrate_file_sync, hydrate_files_sync
 import json
 import os, tempfile
 import mimetypes
@@ -10,7 +11,6 @@ from django.utils._os import safe_join
 from urllib.parse import quote
 
 import re
-import base64
 from typing import Tuple, Dict
 
 def _encode_preview_url(repo_id, rel_path):
@@ -62,7 +62,7 @@ def redirect_to_stackblitz(request, repo_id):
     """
     try:
         code_state = RepositoryCodeState.objects.filter(
-            repository_id=repo_id
+            repository_id=repo_id, status__in=RepositoryCodeState.VISIBLE_STATUSES
         ).order_by('-created_at').first()
         
         if not code_state:
@@ -71,12 +71,15 @@ def redirect_to_stackblitz(request, repo_id):
             })
 
         
-        files = code_state.files.all()
+        files = code_state.files.exclude(change_type="removed")
+        # StackBlitz gets every file, so fetch the ones still pending first
+        hydrate_files_sync(files.filter(hydrated=False).values_list("id", flat=True))
+        files = files.select_related("blob")
         
         files_data = {}
         for file in files:
             # if file.path.endswith('.json'): continue
-            files_data[file.path] = file.content
+            files_data[file.path] = file.get_content()
         
         if not files_data:
             files_data['index.html'] = '<h1>No files found.</h1>'
@@ -100,24 +103,42 @@ def redirect_to_stackblitz(request, repo_id):
 # -----------------------
 # Helper: fetch files from DB for latest or specific state
 # -----------------------
-def fetch_files_from_db(repo_id) -> Tuple[RepositoryCodeState, Dict[str, Dict]]:
+def fetch_files_from_db(repo_id, hydrate_path=None) -> Tuple[RepositoryCodeState, Dict[str, Dict]]:
     """
-    Fetch all files for the latest code state of a repo.
+    Fetch all files for the latest previewable code state of a repo.
+    If the file at hydrate_path has not been downloaded yet, fetch it first;
+    an empty hydrate_path stands for the state's entry page.
     Returns (code_state, files) where files is a dict:
-      { "path/in/repo": { "content": str_or_bytes, "is_binary": bool } }
+      { "path/in/repo": { "blob_sha": str_or_None, "is_binary": bool, "pending": bool } }
+    Pending files are still being fetched in the background. Contents are not
+    loaded here: they are read (and decompressed) when a file is written out.
     """
     code_state = RepositoryCodeState.objects.filter(
-        repository_id=repo_id
+        repository_id=repo_id, status__in=RepositoryCodeState.VISIBLE_STATUSES
     ).order_by('-created_at').first()
 
     if not code_state:
         return None, {}
 
+    if hydrate_path == "":
+        hydrate_path = code_state.entry_path
+
+    if hydrate_path:
+        pending_id = code_state.files.filter(
+            path=hydrate_path, hydrated=False
+        ).values_list("id", flat=True).first()
+        if pending_id:
+            hydrate_file_sync(pending_id)
+
     files: Dict[str, Dict] = {}
-    for f in code_state.files.all():
-        files[f.path] = {
-            "content": f.content or "",
-            "is_binary": getattr(f, "is_binary", False),
+    rows = code_state.files.exclude(change_type="removed").values_list(
+        "path", "blob_id", "is_binary", "hydrated"
+    )
+    for path, blob_sha, is_binary, hydrated in rows:
+        files[path] = {
+            "blob_sha": blob_sha,
+            "is_binary": is_binary,
+            "pending": not hydrated,
         }
     
     # small debug log - remove or replace with proper logger if you want
@@ -134,6 +155,10 @@ def get_or_create_tempdir_for_project(code_state: RepositoryCodeState, files: Di
     Creates a temp dir that is unique for this code_state and writes the files into it.
     We use both repository id and code_state id in the directory name to avoid collisions
     and to ensure updates create a fresh directory (so file additions/removals are visible).
+
+    A manifest next to the directory records which blob each file was written
+    from, so later requests only write files that changed since (usually ones
+    hydrated meanwhile) and only those blobs are read and decompressed.
     """
     # base temp folder (system temp)
     base_temp_dir = os.path.join(tempfile.gettempdir(), "repo_previews")
@@ -143,60 +168,68 @@ def get_or_create_tempdir_for_project(code_state: RepositoryCodeState, files: Di
     repo_id = code_state.repository_id if hasattr(code_state, "repository_id") else getattr(code_state, "repository").id
     snapshot_dirname = f"{repo_id}_{code_state.id}"
     project_dir = os.path.join(base_temp_dir, snapshot_dirname)
+    manifest_path = os.path.join(base_temp_dir, f"{snapshot_dirname}.json")
 
-    # Always (re)create the directory for the snapshot to avoid stale files.
-    if os.path.exists(project_dir):
-        # Remove old snapshot directory and recreate - this ensures file deletions are reflected
-        try:
-            # os.remove or shutil.rmtree
-            import shutil
-            shutil.rmtree(project_dir)
-        except Exception:
-            pass
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as fh:
+            written = json.load(fh)
+    except (OSError, ValueError):
+        written = None
+
+    if written is None:
+        # No (readable) manifest: start the snapshot directory over
+        if os.path.exists(project_dir):
+            try:
+                import shutil
+                shutil.rmtree(project_dir)
+            except Exception:
+                pass
+        written = {}
 
     os.makedirs(project_dir, exist_ok=True)
 
-    # Materialize files
-    for path, info in files.items():
-        # normalize path and prevent absolute paths
-        safe_path = path.lstrip("/\\")
-        target_path = os.path.join(project_dir, safe_path)
-        target_dir = os.path.dirname(target_path)
-        if target_dir:
-            os.makedirs(target_dir, exist_ok=True)
-
-        content = info.get("content", "")
-        is_binary = bool(info.get("is_binary", False))
-
+    # Files gone from the snapshot since the last request
+    for path in set(written) - set(files):
         try:
-            if is_binary:
-                # try to decode base64 first (common for storing binaries in text fields)
-                try:
-                    # If content is already bytes-like, skip decoding
-                    if isinstance(content, bytes):
-                        data = content
-                    else:
-                        data = base64.b64decode(content)
-                except Exception:
-                    # fallback: write the raw string as latin-1 bytes
-                    data = (content or "").encode("latin-1")
-                with open(target_path, "wb") as fh:
-                    fh.write(data)
-            else:
-                # text mode
-                with open(target_path, "w", encoding="utf-8", errors="replace") as fh:
-                    fh.write(content or "")
-        except Exception as e:
-            # fail-safe: write as binary if text write errors
+            os.remove(os.path.join(project_dir, path.lstrip("/\\")))
+        except OSError:
+            pass
+        del written[path]
+
+    # Pending files are written empty and again once they are hydrated
+    changed = [
+        path for path, info in files.items()
+        if written.get(path) != (info.get("blob_sha") or "")
+    ]
+    for start in range(0, len(changed), 100):
+        chunk = changed[start : start + 100]
+        blobs = Blob.objects.in_bulk(
+            {files[path]["blob_sha"] for path in chunk if files[path].get("blob_sha")}
+        )
+        for path in chunk:
+            # normalize path and prevent absolute paths
+            safe_path = path.lstrip("/\\")
+            target_path = os.path.join(project_dir, safe_path)
+            target_dir = os.path.dirname(target_path)
+            if target_dir:
+                os.makedirs(target_dir, exist_ok=True)
+
+            blob = blobs.get(files[path].get("blob_sha"))
             try:
                 with open(target_path, "wb") as fh:
-                    if isinstance(content, str):
-                        fh.write(content.encode("utf-8", errors="replace"))
-                    else:
-                        fh.write(content)
-            except Exception:
+                    if blob is not None:
+                        fh.write(blob.get_bytes())
+            except Exception as e:
                 # last resort: skip file but print debug
                 print(f"[preview] failed to write {target_path}: {e}")
+                continue
+            written[path] = blob.sha if blob is not None else ""
+
+    if changed:
+        tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(written, fh)
+        os.replace(tmp_path, manifest_path)
 
     return project_dir
 
@@ -268,21 +301,21 @@ def get_or_create_tempdir_for_project(code_state: RepositoryCodeState, files: Di
 def preview_root(request, repo_id):
     """
     Root handler for repo preview:
-    - If index.html exists in snapshot, redirect to it
+    - If the snapshot's entry page (usually index.html) exists, redirect to it
     - Otherwise show file browser for repo root
     """
-    code_state, files = fetch_files_from_db(repo_id)
+    code_state, files = fetch_files_from_db(repo_id, hydrate_path="")
     if not code_state:
         return render(request, "preview/error.html", {
             "error": "No code state found for this repository."
         })
 
     temp_dir = get_or_create_tempdir_for_project(code_state, files)
-    index_path = os.path.join(temp_dir, "index.html")
+    entry_path = code_state.entry_path or "index.html"
 
-    if os.path.exists(index_path):
+    if os.path.exists(os.path.join(temp_dir, entry_path)):
         # Redirect so URL is explicit (/preview/<repo_id>/index.html)
-        return redirect("preview:preview_serve", repo_id=repo_id, path="index.html")
+        return redirect("preview:preview_serve", repo_id=repo_id, path=entry_path)
 
     # No index.html → show file browser for root
     try:
@@ -304,15 +337,15 @@ def preview_serve(request, repo_id, path=""):
     - files -> return with proper Content-Type
       * HTML and CSS are rewritten so leading-/root-absolute links point into /preview/<repo_id>/...
     """
-    code_state, files = fetch_files_from_db(repo_id)
+    # normalize path (strip leading slash if any)
+    path = (path or "").lstrip("/")
+
+    code_state, files = fetch_files_from_db(repo_id, hydrate_path=path)
     if not code_state:
         return HttpResponse("404 Not Found", status=404)
 
     temp_dir = get_or_create_tempdir_for_project(code_state, files)
 
-    # normalize path (strip leading slash if any)
-    path = (path or "").lstrip("/")
-
     # safe_join prevents path traversal
     try:
         target_path = safe_join(temp_dir, path)
@@ -368,7 +401,13 @@ def preview_serve(request, repo_id, path=""):
                 # if '<base ' not in content.lower():
                 #     content = content.replace('<head>', '<head><base href="%s/">' % prefix, 1)
 
-                return HttpResponse(content, content_type=f"{mime_type}; charset=utf-8")
+                response = HttpResponse(content, content_type=f"{mime_type}; charset=utf-8")
+                # Lets the page (or a client polling it) know the snapshot is still filling in
+                response["X-Preview-Status"] = code_state.status
+                response["X-Preview-Pending-Files"] = sum(
+                    1 for info in files.values() if info["pending"]
+                )
+                return response
 
             # If CSS, rewrite url(...) absolute paths
             if mime_type == "text/css":
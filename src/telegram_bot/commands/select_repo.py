@@ -1,11 +1,18 @@
-import asyncio
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from accounts.models import User, Repository, Branch
 from accounts.services.github_service import GitHubService
 from ..helpers import get_github_user
-from preview.services import update_codebase
+from jobs.models import Job
+from jobs.queue import cancel_speculative, enqueue, snapshot_key, speculate
+from preview.models import RepositoryCodeState
 
+logger = logging.getLogger(__name__)
 github_service = GitHubService()
 
 
@@ -36,6 +43,45 @@ async def select_repo_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
 
 
+async def prefetch_default_branch(user, repo, branches):
+    """
+    Start building the default branch's snapshot while the user is still
+    looking at the branch keyboard; most of them pick it. Tapping it then
+    attaches to this job instead of starting from scratch.
+    """
+    branch = next((b for b in branches if b.name == repo.default_branch), None)
+    if branch is None or not branch.last_commit_sha:
+        return
+    built = await RepositoryCodeState.objects.filter(
+        repository=repo, branch=branch, commit_sha=branch.last_commit_sha
+    ).aexists()
+    if not built:
+        await speculate(
+            Job.KIND_SNAPSHOT,
+            {"branch_id": branch.id, "commit_sha": branch.last_commit_sha},
+            dedup_key=snapshot_key(branch, branch.last_commit_sha),
+            owner=user.id,
+        )
+
+
+async def sync_branches(user, repo):
+    """
+    Fresh branches of a repository: from the batched GraphQL sync, or the
+    REST branch listing when GraphQL fails or leaves the repository out.
+    Returns None when both fail.
+    """
+    try:
+        synced = await github_service.sync_repository_metadata(user.access_token, [repo])
+    except Exception as e:
+        logger.error(f"GraphQL metadata sync failed for {repo.full_name}: {e}")
+        synced = {}
+    if repo.id in synced:
+        return synced[repo.id]
+    logger.warning(f"Listing branches of {repo.full_name} over REST instead")
+    branches = await github_service.update_branches(user.access_token, repo)
+    return sorted(branches, key=lambda b: b.name) if branches is not None else None
+
+
 # Step 2: Handle button press
 async def select_repo_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -60,12 +106,18 @@ async def select_repo_callback(update: Update, context: ContextTypes.DEFAULT_TYP
         return
 
     try:
-        branch_data = await github_service.update_branches(user.access_token, repo)
-        url = f"https://api.github.com/repos/{repo.full_name}"
-        repo_data = await github_service._make_request(user.access_token, url)
-        await github_service._update_permissions(repo, repo_data.get("permissions", {}))
+        # Warmed up after login (or synced recently): no GitHub round trip
+        max_age = timedelta(seconds=settings.REPO_METADATA_MAX_AGE)
+        if repo.metadata_synced_at and timezone.now() - repo.metadata_synced_at < max_age:
+            branch_data = sorted(repo.branches.all(), key=lambda b: b.name)
+        else:
+            branch_data = await sync_branches(user, repo)
         user.selected_repo = repo
         await user.asave()
+        repo.last_selected_at = timezone.now()
+        await Repository.objects.filter(id=repo.id).aupdate(
+            last_selected_at=repo.last_selected_at
+        )
         repo_summary = f"Repository *{repo.full_name}* selected! The AI will now work on this repo."
 
         if branch_data:
@@ -79,6 +131,13 @@ async def select_repo_callback(update: Update, context: ContextTypes.DEFAULT_TYP
                 reply_markup=reply_markup,
                 parse_mode="Markdown",
             )
+            await prefetch_default_branch(user, repo, branch_data)
+        elif branch_data is None:
+            await query.edit_message_text(
+                f"{repo_summary}\n⚠️ Couldn't fetch its branches from GitHub. "
+                "Please select the repository again in a moment.",
+                parse_mode="Markdown",
+            )
         else:
             await query.edit_message_text(
                 f"{repo_summary}\n_No branches found._", parse_mode="Markdown"
@@ -90,24 +149,9 @@ async def select_repo_callback(update: Update, context: ContextTypes.DEFAULT_TYP
         )
 
 
-async def animate_loading(query, context, loading_message):
-    dots = ["", ".", "..", "..."]
-    i = 0
-    while not context.chat_data.get("setup_done"):
-        await asyncio.sleep(0.1)
-        i = (i + 1) % len(dots)
-        try:
-            await query.edit_message_text(
-                f"{loading_message}{dots[i]}", parse_mode="Markdown"
-            )
-        except Exception:
-            break
-
-
 async def select_branch_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    await query.edit_message_text("Setting up codebase...")
     branch_id = query.data.split(":")[1]
     user = (
         await User.objects.select_related("selected_repo")
@@ -119,32 +163,20 @@ async def select_branch_callback(update: Update, context: ContextTypes.DEFAULT_T
     user.current_branch = branch.name
     await user.asave()
 
-    loading_message = f"Setting up codebase for *{branch.name}*"
-    await query.edit_message_text(loading_message, parse_mode="Markdown")
-    # Init flag
-    context.chat_data["setup_done"] = False
-
-    # Animate the loading dots while update_codebase runs
-
-    # Run the animation in background
-    asyncio.create_task(
-        animate_loading(query=query, context=context, loading_message=loading_message)
-    )
-
-    # Do the heavy work
-    await update_codebase(
-        user, user.selected_repo, branch, branch.last_commit_sha, user.access_token
+    # The snapshot is built by a worker, which messages the user when it's ready.
+    # A prefetch of this branch is picked up; one of another branch is dropped
+    dedup_key = snapshot_key(branch, branch.last_commit_sha)
+    await cancel_speculative(user.id, keep=dedup_key)
+    await enqueue(
+        Job.KIND_SNAPSHOT,
+        {"branch_id": branch.id, "commit_sha": branch.last_commit_sha},
+        priority=Job.PRIORITY_INTERACTIVE,
+        dedup_key=dedup_key,
+        notify=query.from_user.id,
     )
 
-    # Mark setup done so animation stops
-    context.chat_data["setup_done"] = True
-    await asyncio.sleep(0)  # let animate_loading break cleanly
-
-    # Final message
     await query.edit_message_text(
-        f"🌿 Branch set to *{branch.name}*", parse_mode="Markdown"
-    )
-
-    await context.bot.send_message(
-        chat_id=query.from_user.id, text="Now run /preview to view your application."
+        f"Setting up codebase for *{branch.name}*...\n"
+        "I'll let you know when it's ready.",
+        parse_mode="Markdown",
     )
@@ -3,6 +3,7 @@ from accounts.models import User
 async def get_github_user(telegram_user_id: int):
     
     user = await User.objects.filter(chat_id=telegram_user_id).afirst()
-    if user and user.access_token:
+    # Decrypted only where the token is actually used
+    if user and user.has_access_token:
         return user
     return None
\ No newline at end of file
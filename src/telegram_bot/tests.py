@@ -1,3 +1,85 @@
+from unittest import mock
+
+import httpx
+from asgiref.sync import async_to_sync
 from django.test import TestCase
 
-# Create your tests here.
+from accounts.models import Repository, User
+from accounts.services.github_client import github_client
+from accounts.services.github_service import GRAPHQL_URL
+from .commands.select_repo import sync_branches
+
+
+class SyncBranchesTests(TestCase):
+    """Branches for /select_repo: batched GraphQL first, REST when that fails"""
+
+    def setUp(self):
+        self.user = User.objects.create(username="bot", access_token="token")
+        self.repo = Repository.objects.create(
+            user=self.user, repo_id=1, name="site", full_name="owner/site"
+        )
+        self.sent = []
+
+    def _sync(self, graphql, rest):
+        def handler(request):
+            self.sent.append(request.method)
+            if str(request.url) == GRAPHQL_URL:
+                return graphql()
+            self.assertEqual(request.url.path, "/repos/owner/site/branches")
+            return rest()
+
+        transport = httpx.MockTransport(handler)
+        with mock.patch.object(
+            github_client, "_build_client", lambda: httpx.AsyncClient(transport=transport)
+        ):
+            return async_to_sync(sync_branches)(self.user, self.repo)
+
+    @staticmethod
+    def _rest_branches():
+        return httpx.Response(
+            200,
+            json=[
+                {"name": "main", "protected": True, "commit": {"sha": "a" * 40, "url": "u"}},
+                {"name": "dev", "protected": False, "commit": {"sha": "b" * 40, "url": "u"}},
+            ],
+        )
+
+    def test_graphql_errors_fall_back_to_rest(self):
+        branches = self._sync(
+            lambda: httpx.Response(200, json={"data": None, "errors": [{"message": "boom"}]}),
+            self._rest_branches,
+        )
+
+        self.assertEqual([b.name for b in branches], ["dev", "main"])
+        self.assertEqual(self.sent, ["POST", "GET"])
+
+    def test_failed_graphql_request_falls_back_to_rest(self):
+        branches = self._sync(lambda: httpx.Response(401), self._rest_branches)
+
+        self.assertEqual([b.name for b in branches], ["dev", "main"])
+
+    def test_graphql_result_is_used_when_complete(self):
+        node = {
+            "pushedAt": None,
+            "viewerPermission": "READ",
+            "licenseInfo": None,
+            "repositoryTopics": {"nodes": []},
+            "refs": {
+                "pageInfo": {"hasNextPage": False, "endCursor": None},
+                "nodes": [
+                    {"name": "main", "branchProtectionRule": None, "target": {"oid": "c" * 40}}
+                ],
+            },
+        }
+
+        branches = self._sync(
+            lambda: httpx.Response(200, json={"data": {"r0": node}}), self._rest_branches
+        )
+
+        self.assertEqual([(b.name, b.last_commit_sha) for b in branches], [("main", "c" * 40)])
+        self.assertEqual(self.sent, ["POST"])
+
+    def test_none_when_both_fail(self):
+        self.assertIsNone(
+            self._sync(lambda: httpx.Response(401), lambda: httpx.Response(404))
+        )